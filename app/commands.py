@@ -1,12 +1,30 @@
 from datetime import datetime
-from data_type.redisList import check_if_lists, rpush, lpush, llen, lrange, lpop_n, blpop
-from data_type.redisStream import check_if_stream, xadd, xrange, xread
+from data_type.redisBitmap import (setbit, getbit, bitcount, bitpos, bitop, bitfield, parse_bit_offset,
+                                   parse_bitfield_type, BITOP_OPS)
+from data_type.redisList import rpush, lpush, llen, lrange, lindex, lset, ltrim, linsert, pop_n, lmove
+import data_type.blocking as blocking
+from data_type.redisHash import hset, hget, hmget, hgetall, hdel, hincrby, hexists, hlen, hscan
+from data_type.redisSet import (sadd, srem, sismember, smismember, scard, smembers, srandmember, spop, sscan,
+                                set_algebra, set_algebra_store)
+from data_type.redisZset import (zadd, zincrby, zscore, zrank, zrem, zcard, zcount, zpop, zremrangebyscore, get_zset,
+                                 parse_score, format_score, parse_score_bound, parse_lex_bound, score_range, lex_range)
+from data_type.redisStream import (xadd, xrange, xread, xlen, xdel, xtrim, xsetid, parse_id, parse_range_id,
+                                   format_id, write_entry, StreamError, STREAM_NODE_MAX_ENTRIES, STREAM_ID_MAX_SEQ)
+import data_type.redisStream as streams
 import data_type.redisKey as rkey
+import data_type.keyspace as keyspace
+from data_type.keyspace import WrongTypeError
+import data_type.expires as expiry
+import data_type.evict as evict
+from data_type.expires import expires, now_ms, EXPIRE_MAX_MS
 from typing import List
 import asyncio
+import math
 from convert_commands import build_resp_array
-from persistence import log_to_aof
+from persistence import aof, rdb
+from replication import backlog, ack_waiters
 from registry  import redis_cmd
+import resp
 
 write_commands = {'set', 'incr', 'rpush', 'lpush', 'lpop', 'xadd'}
 
@@ -14,228 +32,1681 @@ write_commands = {'set', 'incr', 'rpush', 'lpush', 'lpop', 'xadd'}
 # Key Functions
 @redis_cmd(is_write=False)
 def ping_func(args, _):
-    return "+PONG\r\n"
+    return resp.PONG
 
 @redis_cmd(is_write=False)
 def echo_func(args, _):
-    return f"${len(args[0])}\r\n{args[0]}\r\n"
+    return resp.bulk(args[0])
 
 @redis_cmd(is_write=True)
 def set_func(args, client_state):
-    print(f"inset {args}")
     try:
-        rkey.rset(args, client_state)
-        return "+OK\r\n"
+        expire_ms = rkey.rset(args, client_state)
+        if expire_ms is not None:
+            # Relative TTLs would restart when replayed, so the absolute time is propagated
+            client_state['propagate_as'] = ("set", [args[0], args[1], b"PXAT", b"%d" % expire_ms])
+        return resp.OK
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
     except Exception as e:
-        return f"-ERR set failed: {str(e)}\r\n"
+        return resp.error(f"ERR set failed: {str(e)}")
     
 @redis_cmd(is_write=False)
 def get_func(args, client_state):
     try:
-        val = rkey.get(args)
-        if val is None:
-            return "$-1\r\n"
-        s = str(val)
-        return f"${len(s)}\r\n{s}\r\n"
+        return resp.bulk(rkey.get(args))
+    except WrongTypeError:
+        return resp.WRONGTYPE
     except Exception as e:
-        return f"-ERR get failed: {str(e)}\r\n"
+        return resp.error(f"ERR get failed: {str(e)}")
 
 @redis_cmd(is_write=False)
 def type_func(args, _):
-    try:
-        key = args[0]
-        t = rkey.check_type(key)
-        if t is not None:
-            return f"+{t}\r\n"
-        if check_if_lists(key):
-            return "+lists\r\n"
-        if check_if_stream(key):
-            return "+stream\r\n"
-        return "+none\r\n"
-    except Exception as e:
-        return f"-ERR type failed: {str(e)}\r\n"
+    if len(args) != 1:
+        return resp.error("ERR wrong number of arguments for 'type' command")
+    return resp.simple(keyspace.key_type(args[0]))
 
 @redis_cmd(is_write=True)
 def incr_func(args, client_state):
     try:
         return rkey.incr(args[0], client_state)
+    except WrongTypeError:
+        return resp.WRONGTYPE
     except Exception as e:
-        return f"-ERR incr failed: {str(e)}\r\n"
+        return resp.error(f"ERR incr failed: {str(e)}")
+
+# Keyspace Functions
+@redis_cmd(is_write=True, deny_oom=False)
+def del_func(args, client_state):
+    if not args:
+        return resp.error("ERR wrong number of arguments for 'del' command")
+    return resp.integer(sum(1 for key in args if keyspace.delete(key)))
+
+@redis_cmd(is_write=True, deny_oom=False)
+def unlink_func(args, client_state):
+    # Values are released by the garbage collector either way, so this is DEL
+    if not args:
+        return resp.error("ERR wrong number of arguments for 'unlink' command")
+    return resp.integer(sum(1 for key in args if keyspace.delete(key)))
+
+@redis_cmd(is_write=False)
+def exists_func(args, client_state):
+    if not args:
+        return resp.error("ERR wrong number of arguments for 'exists' command")
+    # A key given twice is counted twice, as in Redis
+    return resp.integer(sum(1 for key in args if keyspace.exists(key)))
+
+@redis_cmd(is_write=False)
+def dbsize_func(args, client_state):
+    return resp.integer(keyspace.count())
+
+@redis_cmd(is_write=True, deny_oom=False)
+def rename_func(args, client_state):
+    if len(args) != 2:
+        return resp.error("ERR wrong number of arguments for 'rename' command")
+    if not keyspace.rename(args[0], args[1]):
+        return resp.error("ERR no such key")
+    return resp.OK
+
+@redis_cmd(is_write=False)
+def keys_func(args, client_state):
+    if len(args) != 1:
+        return resp.error("ERR wrong number of arguments for 'keys' command")
+    return resp.bulk_array(list(keyspace.iter_keys(args[0])))
+
+def parse_scan_args(args, options=(b'match', b'count')):
+    """
+    args: cursor [MATCH pattern] [COUNT count] ..., with the options allowed.
+    Returns (cursor, match function or None, count, {other option: value}). Raises ValueError.
+    """
+    try:
+        cursor = int(args[0])
+        if cursor < 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError("invalid cursor")
+    match = None
+    count = keyspace.SCAN_DEFAULT_COUNT
+    extra = {}
+    i = 1
+    while i < len(args):
+        opt = args[i].lower()
+        if i + 1 >= len(args) or opt not in options:
+            raise ValueError("syntax error")
+        if opt == b'match':
+            if args[i + 1] != b'*':
+                match = keyspace.compile_pattern(args[i + 1]).match
+        elif opt == b'count':
+            try:
+                count = int(args[i + 1])
+            except ValueError:
+                raise ValueError("value is not an integer or out of range")
+            if count < 1:
+                raise ValueError("syntax error")
+        else:
+            extra[opt] = args[i + 1]
+        i += 2
+    return cursor, match, count, extra
+
+@redis_cmd(is_write=False)
+def scan_func(args, client_state):
+    if not args:
+        return resp.error("ERR wrong number of arguments for 'scan' command")
+    try:
+        cursor, match, count, extra = parse_scan_args(args, (b'match', b'count', b'type'))
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+    kind = extra[b'type'].decode(errors='replace').lower() if b'type' in extra else None
+
+    cursor, keys = keyspace.db.scan(cursor, count)
+    found = []
+    for key in keys:
+        # Looking the key up expires it if its time has passed
+        ent = keyspace.lookup(key, notouch=True)
+        if ent is None or (kind is not None and ent.kind != kind) or (match is not None and not match(key)):
+            continue
+        found.append(key)
+    out = resp.ReplyBuilder().array(2).bulk(b"%d" % cursor).array(len(found))
+    for key in found:
+        out.bulk(key)
+    return out.getvalue()
+
+@redis_cmd(is_write=False)
+def object_func(args, client_state):
+    if len(args) != 2:
+        return resp.error("ERR wrong number of arguments for 'object' command")
+    sub = args[0].lower()
+    ent = keyspace.lookup(args[1], notouch=True)
+    if ent is None:
+        return resp.NIL
+    if sub == b'encoding':
+        return resp.bulk(keyspace.encoding(ent))
+    if sub == b'idletime':
+        if keyspace.access_mode == 'lfu':
+            return resp.error("ERR An LFU maxmemory policy is selected, idle time not tracked.")
+        return resp.integer((keyspace.lru_clock() - ent.lru) * keyspace.LRU_CLOCK_RESOLUTION // 1000)
+    if sub == b'freq':
+        if keyspace.access_mode != 'lfu':
+            return resp.error("ERR An LFU maxmemory policy is not selected, access frequency not tracked.")
+        return resp.integer(keyspace.lfu_counter(ent.lru))
+    return resp.error(f"ERR unknown subcommand '{args[0].decode(errors='replace')}'")
+
+@redis_cmd(is_write=False)
+def memory_func(args, client_state):
+    sub = args[0].lower() if args else b''
+    if sub == b'usage':
+        # SAMPLES is accepted for compatibility: sizes are tracked, not sampled
+        if len(args) not in (2, 4) or (len(args) == 4 and args[2].lower() != b'samples'):
+            return resp.error("ERR syntax error")
+        ent = keyspace.lookup(args[1], notouch=True)
+        if ent is None:
+            return resp.NIL
+        return resp.integer(keyspace.key_overhead(args[1]) + keyspace.value_size(ent))
+    if sub == b'stats' and len(args) == 1:
+        return memory_stats(client_state['server_state'])
+    return resp.error("ERR unknown subcommand or wrong number of arguments for 'memory' command")
+
+def memory_stats(server_state) -> bytes:
+    db = keyspace.db
+    keys = len(db)
+    dataset = sum(size for _, size in db.encodings.values())
+    fields = [
+        ("total.allocated", db.used_memory),
+        ("replication.backlog", backlog.size if backlog.active else 0),
+        ("keys.count", keys),
+        ("keys.bytes-per-key", db.used_memory // keys if keys else 0),
+        ("overhead.hashtable.main", db.used_memory - dataset),
+        ("dataset.bytes", dataset),
+        ("dataset.percentage", f"{dataset * 100 / db.used_memory:.2f}" if db.used_memory else "0"),
+    ]
+    encodings = sorted((name, n, size) for name, (n, size) in db.encodings.items() if n)
+    out = resp.ReplyBuilder().array(2 * len(fields) + 2)
+    for name, value in fields:
+        out.bulk(name)
+        if isinstance(value, int):
+            out.integer(value)
+        else:
+            out.bulk(value)
+    # What each encoding costs: its keys, value bytes and bytes per key
+    out.bulk("encodings").array(2 * len(encodings))
+    for name, n, size in encodings:
+        out.bulk(name).array(6).bulk("keys").integer(n).bulk("bytes").integer(size)
+        out.bulk("bytes-per-key").integer(size // n)
+    return out.getvalue()
+
+# Expiry Functions
+EXPIRE_FLAGS = (b'nx', b'xx', b'gt', b'lt')
+
+def expire_generic(args, client_state, unit_ms: int, absolute: bool) -> bytes:
+    if len(args) < 2:
+        return resp.error("ERR wrong number of arguments")
+    key = args[0]
+    try:
+        amount = int(args[1])
+    except ValueError:
+        return resp.error("ERR value is not an integer or out of range")
+    flags = {a.lower() for a in args[2:]}
+    if not flags <= set(EXPIRE_FLAGS):
+        return resp.error(f"ERR Unsupported option {args[2].decode(errors='replace')}")
+    if (b'nx' in flags and len(flags) > 1) or {b'gt', b'lt'} <= flags:
+        return resp.error("ERR NX and XX, GT or LT options at the same time are not compatible")
+    if not keyspace.exists(key):
+        return resp.integer(0)
+
+    when = amount * unit_ms + (0 if absolute else now_ms())
+    if not -EXPIRE_MAX_MS <= amount * unit_ms <= EXPIRE_MAX_MS or not -EXPIRE_MAX_MS <= when <= EXPIRE_MAX_MS:
+        name = ('p' if unit_ms == 1 else '') + 'expire' + ('at' if absolute else '')
+        return resp.error(f"ERR invalid expire time in '{name}' command")
+    current = expires.get(key)  # None means no TTL, i.e. an infinite one for GT/LT
+    if (b'nx' in flags and current is not None) or (b'xx' in flags and current is None) \
+            or (b'gt' in flags and (current is None or when <= current)) \
+            or (b'lt' in flags and current is not None and when >= current):
+        return resp.integer(0)
+
+    # While loading the AOF or following a master the key is kept: the deadline is
+    # applied later, by our own expiry or by the master's DEL
+    if when <= now_ms() and not client_state['is_replica']:
+        keyspace.delete(key)
+        client_state['propagate_as'] = ("del", [key])
+    else:
+        expires.set(key, when)
+        client_state['propagate_as'] = ("pexpireat", [key, b"%d" % when])
+    return resp.integer(1)
+
+@redis_cmd(is_write=True, deny_oom=False)
+def expire_func(args, client_state):
+    return expire_generic(args, client_state, 1000, absolute=False)
+
+@redis_cmd(is_write=True, deny_oom=False)
+def pexpire_func(args, client_state):
+    return expire_generic(args, client_state, 1, absolute=False)
+
+@redis_cmd(is_write=True, deny_oom=False)
+def expireat_func(args, client_state):
+    return expire_generic(args, client_state, 1000, absolute=True)
+
+@redis_cmd(is_write=True, deny_oom=False)
+def pexpireat_func(args, client_state):
+    return expire_generic(args, client_state, 1, absolute=True)
+
+def ttl_generic(args, unit_ms: int, absolute: bool) -> bytes:
+    if len(args) != 1:
+        return resp.error("ERR wrong number of arguments")
+    if not keyspace.exists(args[0]):
+        return resp.integer(-2)
+    when = expires.get(args[0])
+    if when is None:
+        return resp.integer(-1)
+    if absolute:
+        return resp.integer(when // unit_ms)
+    remaining = max(0, when - now_ms())
+    return resp.integer((remaining + unit_ms // 2) // unit_ms)
+
+@redis_cmd(is_write=False)
+def ttl_func(args, client_state):
+    return ttl_generic(args, 1000, absolute=False)
+
+@redis_cmd(is_write=False)
+def pttl_func(args, client_state):
+    return ttl_generic(args, 1, absolute=False)
+
+@redis_cmd(is_write=False)
+def expiretime_func(args, client_state):
+    return ttl_generic(args, 1000, absolute=True)
+
+@redis_cmd(is_write=False)
+def pexpiretime_func(args, client_state):
+    return ttl_generic(args, 1, absolute=True)
+
+@redis_cmd(is_write=True, deny_oom=False)
+def persist_func(args, client_state):
+    if len(args) != 1:
+        return resp.error("ERR wrong number of arguments for 'persist' command")
+    if not keyspace.exists(args[0]):
+        return resp.integer(0)
+    return resp.integer(int(expires.remove(args[0])))
+
+# Bitmap Functions
+BITFIELD_SUBCOMMANDS = {b'get': 2, b'set': 3, b'incrby': 3}
+BITFIELD_OVERFLOW = (b'wrap', b'sat', b'fail')
+
+@redis_cmd(is_write=True)
+def setbit_func(args, client_state):
+    if len(args) != 3:
+        return resp.error("ERR wrong number of arguments for 'setbit' command")
+    try:
+        offset = parse_bit_offset(args[1])
+        if args[2] not in (b"0", b"1"):
+            raise ValueError("bit is not an integer or out of range")
+        return resp.integer(setbit(args[0], offset, int(args[2])))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+
+@redis_cmd(is_write=False)
+def getbit_func(args, _):
+    if len(args) != 2:
+        return resp.error("ERR wrong number of arguments for 'getbit' command")
+    try:
+        return resp.integer(getbit(args[0], parse_bit_offset(args[1])))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+
+def parse_bit_range(args):
+    """[start [end [BYTE|BIT]]] of BITCOUNT and BITPOS as (start, end, unit), None where absent. Raises ValueError."""
+    if len(args) > 3:
+        raise ValueError("syntax error")
+    unit = 'byte'
+    if len(args) == 3:
+        unit = args[2].lower().decode(errors='replace')
+        if unit not in ('byte', 'bit'):
+            raise ValueError("syntax error")
+    try:
+        bounds = [int(a) for a in args[:2]]
+    except ValueError:
+        raise ValueError("value is not an integer or out of range")
+    bounds += [None] * (2 - len(bounds))
+    return bounds[0], bounds[1], unit
+
+@redis_cmd(is_write=False)
+def bitcount_func(args, _):
+    if not args:
+        return resp.error("ERR wrong number of arguments for 'bitcount' command")
+    try:
+        if len(args) == 2:
+            raise ValueError("syntax error")
+        return resp.integer(bitcount(args[0], *parse_bit_range(args[1:])))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+
+@redis_cmd(is_write=False)
+def bitpos_func(args, _):
+    if len(args) < 2:
+        return resp.error("ERR wrong number of arguments for 'bitpos' command")
+    try:
+        if args[1] not in (b"0", b"1"):
+            raise ValueError("The bit argument must be 1 or 0.")
+        return resp.integer(bitpos(args[0], int(args[1]), *parse_bit_range(args[2:])))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+
+@redis_cmd(is_write=True)
+def bitop_func(args, client_state):
+    if len(args) < 3:
+        return resp.error("ERR wrong number of arguments for 'bitop' command")
+    op = args[0].lower()
+    if op not in BITOP_OPS:
+        return resp.error("ERR syntax error")
+    if op == b'not' and len(args) != 3:
+        return resp.error("ERR BITOP NOT must be called with a single source key.")
+    try:
+        return resp.integer(bitop(op, args[1], args[2:]))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+
+@redis_cmd(is_write=True)
+def bitfield_func(args, client_state):
+    if not args:
+        return resp.error("ERR wrong number of arguments for 'bitfield' command")
+    ops = []
+    policy = b'wrap'
+    i = 1
+    try:
+        while i < len(args):
+            sub = args[i].lower()
+            if sub == b'overflow' and i + 1 < len(args):
+                policy = args[i + 1].lower()
+                if policy not in BITFIELD_OVERFLOW:
+                    raise ValueError("Invalid OVERFLOW type specified")
+                i += 2
+                continue
+            nargs = BITFIELD_SUBCOMMANDS.get(sub)
+            if nargs is None or i + nargs >= len(args):
+                raise ValueError("syntax error")
+            signed, bits = parse_bitfield_type(args[i + 1])
+            offset = parse_bit_offset(args[i + 2], bits)
+            value = None
+            if sub != b'get':
+                try:
+                    value = int(args[i + 3])
+                    if not -(1 << 63) <= value < (1 << 63):
+                        raise ValueError
+                except ValueError:
+                    raise ValueError("value is not an integer or out of range")
+            ops.append((sub, signed, bits, offset, value, policy))
+            i += nargs + 1
+        replies = bitfield(args[0], ops)
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+    if all(op[0] == b'get' for op in ops):
+        # Nothing was written
+        client_state['propagate_as'] = ()
+    out = resp.ReplyBuilder().array(len(replies))
+    for reply in replies:
+        if reply is None:
+            out.bulk(None)
+        else:
+            out.integer(reply)
+    return out.getvalue()
 
 # List Functions
 @redis_cmd(is_write=True)
 def rpush_func(args, client_state):
+    if len(args) < 2:
+        return resp.error("ERR wrong number of arguments for 'rpush' command")
     try:
         cnt = rpush(args[0], *args[1:])
-        return f":{cnt}\r\n"
+        return resp.integer(cnt)
+    except WrongTypeError:
+        return resp.WRONGTYPE
     except Exception as e:
-        return f"-ERR rpush failed: {str(e)}\r\n"
+        return resp.error(f"ERR rpush failed: {str(e)}")
     
 @redis_cmd(is_write=True)
 def lpush_func(args, client_state):
+    if len(args) < 2:
+        return resp.error("ERR wrong number of arguments for 'lpush' command")
     try:
         cnt = lpush(args[0], *args[1:])
-        return f":{cnt}\r\n"
+        return resp.integer(cnt)
+    except WrongTypeError:
+        return resp.WRONGTYPE
     except Exception as e:
-        return f"-ERR lpush failed: {str(e)}\r\n"
+        return resp.error(f"ERR lpush failed: {str(e)}")
 
 @redis_cmd(is_write=False)
 def llen_func(args, _):
     try:
-        return f":{llen(args[0])}\r\n"
+        return resp.integer(llen(args[0]))
+    except WrongTypeError:
+        return resp.WRONGTYPE
     except Exception as e:
-        return f"-ERR llen failed: {str(e)}\r\n"
+        return resp.error(f"ERR llen failed: {str(e)}")
 
 @redis_cmd(is_write=False)
 def lrange_func(args, _):
     try:
-        arr = lrange(args[0], int(args[1]), int(args[2]))
-        res = f"*{len(arr)}\r\n"
-        for e in arr:
-            res += f"${len(e)}\r\n{e}\r\n"
-        return res
+        return resp.bulk_array(lrange(args[0], int(args[1]), int(args[2])))
+    except WrongTypeError:
+        return resp.WRONGTYPE
     except Exception as e:
-        return f"-ERR lrange failed: {str(e)}\r\n"
+        return resp.error(f"ERR lrange failed: {str(e)}")
+
+@redis_cmd(is_write=False)
+def lindex_func(args, _):
+    if len(args) != 2:
+        return resp.error("ERR wrong number of arguments for 'lindex' command")
+    try:
+        return resp.bulk(lindex(args[0], int(args[1])))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError:
+        return resp.error("ERR value is not an integer or out of range")
 
 @redis_cmd(is_write=True)
-def lpop_func(args, client_state):
+def lset_func(args, client_state):
+    if len(args) != 3:
+        return resp.error("ERR wrong number of arguments for 'lset' command")
+    try:
+        index = int(args[1])
+    except ValueError:
+        return resp.error("ERR value is not an integer or out of range")
+    try:
+        lset(args[0], index, args[2])
+        return resp.OK
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+
+@redis_cmd(is_write=True, deny_oom=False)
+def ltrim_func(args, client_state):
+    if len(args) != 3:
+        return resp.error("ERR wrong number of arguments for 'ltrim' command")
+    try:
+        ltrim(args[0], int(args[1]), int(args[2]))
+        return resp.OK
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError:
+        return resp.error("ERR value is not an integer or out of range")
+
+@redis_cmd(is_write=True)
+def linsert_func(args, client_state):
+    if len(args) != 4:
+        return resp.error("ERR wrong number of arguments for 'linsert' command")
+    where = args[1].lower()
+    if where not in (b"before", b"after"):
+        return resp.error("ERR syntax error")
+    try:
+        return resp.integer(linsert(args[0], where == b"before", args[2], args[3]))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+
+def pop_generic(args, where: str) -> bytes:
+    cmd = 'lpop' if where == 'left' else 'rpop'
+    if len(args) not in (1, 2):
+        return resp.error(f"ERR wrong number of arguments for '{cmd}' command")
     try:
         if len(args) == 1:
-            arr = lpop_n(args[0], 1)
-            return f"${len(arr[0])}\r\n{arr[0]}\r\n" if arr else "$-1\r\n"
-        else:
-            arr = lpop_n(args[0], int(args[1]))
-            res = f"*{len(arr)}\r\n"
-            for e in arr:
-                res += f"${len(e)}\r\n{e}\r\n"
-            return res
-    except Exception as e:
-        return f"-ERR lpop failed: {str(e)}\r\n"
+            popped = pop_n(args[0], 1, where)
+            return resp.bulk(popped[0]) if popped else resp.NIL
+        try:
+            count = int(args[1])
+        except ValueError:
+            return resp.error("ERR value is not an integer or out of range")
+        if count < 0:
+            return resp.error("ERR value is out of range, must be positive")
+        popped = pop_n(args[0], count, where)
+        # With a count, a missing key is a nil array rather than an empty one
+        return resp.bulk_array(popped) if popped is not None else resp.NIL_ARRAY
+    except WrongTypeError:
+        return resp.WRONGTYPE
+
+@redis_cmd(is_write=True, deny_oom=False)
+def lpop_func(args, client_state):
+    return pop_generic(args, 'left')
+
+@redis_cmd(is_write=True, deny_oom=False)
+def rpop_func(args, client_state):
+    return pop_generic(args, 'right')
+
+def parse_side(arg: bytes) -> str:
+    side = arg.lower()
+    if side not in (b"left", b"right"):
+        raise ValueError("syntax error")
+    return side.decode()
+
+def blocking_timeout(arg: bytes):
+    """A blocking command's timeout in seconds, None for 0 (wait forever). Raises ValueError."""
+    try:
+        timeout = float(arg)
+    except ValueError:
+        raise ValueError("timeout is not a float or out of range")
+    if not math.isfinite(timeout):
+        raise ValueError("timeout is not a float or out of range")
+    if timeout < 0:
+        raise ValueError("timeout is negative")
+    return timeout or None
 
 @redis_cmd(is_write=True)
-async def blpop_func(args, _):
+def lmove_func(args, client_state):
+    if len(args) != 4:
+        return resp.error("ERR wrong number of arguments for 'lmove' command")
     try:
-        tup = await blpop(args[0], float(args[1]) if len(args) > 1 else 0)
-        if not tup:
-            return "$-1\r\n"
-        key, val = tup
-        return f"*2\r\n${len(key)}\r\n{key}\r\n${len(val)}\r\n{val}\r\n"
-    except Exception as e:
-        return f"-ERR blpop failed: {str(e)}\r\n"
+        return resp.bulk(lmove(args[0], args[1], parse_side(args[2]), parse_side(args[3])))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+
+async def bpop_generic(args, client_state, where: str) -> bytes:
+    """BLPOP/BRPOP key [key ...] timeout: pop from the first non-empty key, or block on all of them."""
+    cmd = 'lpop' if where == 'left' else 'rpop'
+    if len(args) < 2:
+        return resp.error(f"ERR wrong number of arguments for 'b{cmd}' command")
+    try:
+        keys, timeout = args[:-1], blocking_timeout(args[-1])
+        for key in keys:
+            popped = pop_n(key, 1, where)
+            if popped:
+                client_state['propagate_as'] = (cmd, [key])
+                return resp.bulk_array([key, popped[0]])
+        # Nothing is propagated unless an element is popped, and then as LPOP/RPOP
+        client_state['propagate_as'] = ()
+        if client_state.get('in_exec'):
+            return resp.NIL_ARRAY
+
+        def serve(key: bytes):
+            try:
+                popped = pop_n(key, 1, where)
+            except WrongTypeError:
+                return None
+            if not popped:
+                return None
+            blocking.propagate(cmd, [key])
+            return resp.bulk_array([key, popped[0]])
+
+        reply = await blocking.block(keys, timeout, serve)
+        return reply if reply is not None else resp.NIL_ARRAY
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+
+@redis_cmd(is_write=True, deny_oom=False)
+async def blpop_func(args, client_state):
+    return await bpop_generic(args, client_state, 'left')
+
+@redis_cmd(is_write=True, deny_oom=False)
+async def brpop_func(args, client_state):
+    return await bpop_generic(args, client_state, 'right')
+
+@redis_cmd(is_write=True)
+async def blmove_func(args, client_state):
+    if len(args) != 5:
+        return resp.error("ERR wrong number of arguments for 'blmove' command")
+    try:
+        src, dst = args[0], args[1]
+        wherefrom, whereto = parse_side(args[2]), parse_side(args[3])
+        timeout = blocking_timeout(args[4])
+        moved = lmove(src, dst, wherefrom, whereto)
+        if moved is not None:
+            client_state['propagate_as'] = ("lmove", list(args[:4]))
+            return resp.bulk(moved)
+        client_state['propagate_as'] = ()
+        if client_state.get('in_exec'):
+            return resp.NIL
+
+        def serve(key: bytes):
+            try:
+                moved = lmove(src, dst, wherefrom, whereto)
+            except WrongTypeError:
+                return None
+            if moved is None:
+                return None
+            blocking.propagate("lmove", list(args[:4]))
+            return resp.bulk(moved)
+
+        reply = await blocking.block([src], timeout, serve)
+        return reply if reply is not None else resp.NIL
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+
+# Hash Functions
+@redis_cmd(is_write=True)
+def hset_func(args, client_state):
+    if len(args) < 3 or len(args) % 2 == 0:
+        return resp.error("ERR wrong number of arguments for 'hset' command")
+    try:
+        return resp.integer(hset(args[0], zip(args[1::2], args[2::2])))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+
+@redis_cmd(is_write=False)
+def hget_func(args, _):
+    if len(args) != 2:
+        return resp.error("ERR wrong number of arguments for 'hget' command")
+    try:
+        return resp.bulk(hget(args[0], args[1]))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+
+@redis_cmd(is_write=False)
+def hmget_func(args, _):
+    if len(args) < 2:
+        return resp.error("ERR wrong number of arguments for 'hmget' command")
+    try:
+        return resp.bulk_array(hmget(args[0], args[1:]))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+
+@redis_cmd(is_write=False)
+def hgetall_func(args, _):
+    if len(args) != 1:
+        return resp.error("ERR wrong number of arguments for 'hgetall' command")
+    try:
+        pairs = hgetall(args[0])
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    out = resp.ReplyBuilder().array(2 * len(pairs))
+    for field, value in pairs:
+        out.bulk(field).bulk(value)
+    return out.getvalue()
+
+@redis_cmd(is_write=True, deny_oom=False)
+def hdel_func(args, client_state):
+    if len(args) < 2:
+        return resp.error("ERR wrong number of arguments for 'hdel' command")
+    try:
+        return resp.integer(hdel(args[0], args[1:]))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+
+@redis_cmd(is_write=True)
+def hincrby_func(args, client_state):
+    if len(args) != 3:
+        return resp.error("ERR wrong number of arguments for 'hincrby' command")
+    try:
+        increment = int(args[2])
+        if not -(1 << 63) <= increment < (1 << 63):
+            raise ValueError
+    except ValueError:
+        return resp.error("ERR value is not an integer or out of range")
+    try:
+        return resp.integer(hincrby(args[0], args[1], increment))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+
+@redis_cmd(is_write=False)
+def hexists_func(args, _):
+    if len(args) != 2:
+        return resp.error("ERR wrong number of arguments for 'hexists' command")
+    try:
+        return resp.integer(int(hexists(args[0], args[1])))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+
+@redis_cmd(is_write=False)
+def hlen_func(args, _):
+    if len(args) != 1:
+        return resp.error("ERR wrong number of arguments for 'hlen' command")
+    try:
+        return resp.integer(hlen(args[0]))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+
+@redis_cmd(is_write=False)
+def hscan_func(args, _):
+    if len(args) < 2:
+        return resp.error("ERR wrong number of arguments for 'hscan' command")
+    try:
+        cursor, match, count, _ = parse_scan_args(args[1:])
+        cursor, pairs = hscan(args[0], cursor, count)
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+    if match is not None:
+        pairs = [(f, v) for f, v in pairs if match(f)]
+    out = resp.ReplyBuilder().array(2).bulk(b"%d" % cursor).array(2 * len(pairs))
+    for field, value in pairs:
+        out.bulk(field).bulk(value)
+    return out.getvalue()
+
+# Set Functions
+@redis_cmd(is_write=True)
+def sadd_func(args, client_state):
+    if len(args) < 2:
+        return resp.error("ERR wrong number of arguments for 'sadd' command")
+    try:
+        return resp.integer(sadd(args[0], args[1:]))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+
+@redis_cmd(is_write=True, deny_oom=False)
+def srem_func(args, client_state):
+    if len(args) < 2:
+        return resp.error("ERR wrong number of arguments for 'srem' command")
+    try:
+        return resp.integer(srem(args[0], args[1:]))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+
+@redis_cmd(is_write=False)
+def sismember_func(args, _):
+    if len(args) != 2:
+        return resp.error("ERR wrong number of arguments for 'sismember' command")
+    try:
+        return resp.integer(int(sismember(args[0], args[1])))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+
+@redis_cmd(is_write=False)
+def smismember_func(args, _):
+    if len(args) < 2:
+        return resp.error("ERR wrong number of arguments for 'smismember' command")
+    try:
+        found = smismember(args[0], args[1:])
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    out = resp.ReplyBuilder().array(len(found))
+    for f in found:
+        out.integer(int(f))
+    return out.getvalue()
+
+@redis_cmd(is_write=False)
+def scard_func(args, _):
+    if len(args) != 1:
+        return resp.error("ERR wrong number of arguments for 'scard' command")
+    try:
+        return resp.integer(scard(args[0]))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+
+@redis_cmd(is_write=False)
+def smembers_func(args, _):
+    if len(args) != 1:
+        return resp.error("ERR wrong number of arguments for 'smembers' command")
+    try:
+        return resp.bulk_array(smembers(args[0]))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+
+def parse_set_count(args, cmd: str):
+    """The optional count of SRANDMEMBER/SPOP key [count]: None if absent. Raises ValueError."""
+    if len(args) not in (1, 2):
+        raise ValueError(f"wrong number of arguments for '{cmd}' command")
+    if len(args) == 1:
+        return None
+    try:
+        return int(args[1])
+    except ValueError:
+        raise ValueError("value is not an integer or out of range")
+
+@redis_cmd(is_write=False)
+def srandmember_func(args, _):
+    try:
+        count = parse_set_count(args, 'srandmember')
+        members = srandmember(args[0], 1 if count is None else count)
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+    if count is None:
+        return resp.bulk(members[0] if members else None)
+    return resp.bulk_array(members)
+
+@redis_cmd(is_write=True, deny_oom=False)
+def spop_func(args, client_state):
+    try:
+        count = parse_set_count(args, 'spop')
+        if count is not None and count < 0:
+            raise ValueError("value is out of range, must be positive")
+        popped = spop(args[0], 1 if count is None else count)
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+    # The members were drawn at random, so replicas and the AOF get them as an SREM
+    client_state['propagate_as'] = ("srem", [args[0]] + popped) if popped else ()
+    if count is None:
+        return resp.bulk(popped[0] if popped else None)
+    return resp.bulk_array(popped)
+
+@redis_cmd(is_write=False)
+def sscan_func(args, _):
+    if len(args) < 2:
+        return resp.error("ERR wrong number of arguments for 'sscan' command")
+    try:
+        cursor, match, count, _ = parse_scan_args(args[1:])
+        cursor, members = sscan(args[0], cursor, count)
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+    if match is not None:
+        members = [m for m in members if match(m)]
+    out = resp.ReplyBuilder().array(2).bulk(b"%d" % cursor).array(len(members))
+    for member in members:
+        out.bulk(member)
+    return out.getvalue()
+
+def set_algebra_generic(args, op: str, cmd: str) -> bytes:
+    if not args:
+        return resp.error(f"ERR wrong number of arguments for '{cmd}' command")
+    try:
+        return resp.bulk_array(set_algebra(op, args))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+
+def set_algebra_store_generic(args, op: str, cmd: str) -> bytes:
+    if len(args) < 2:
+        return resp.error(f"ERR wrong number of arguments for '{cmd}' command")
+    try:
+        return resp.integer(set_algebra_store(op, args[0], args[1:]))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+
+@redis_cmd(is_write=False)
+def sinter_func(args, _):
+    return set_algebra_generic(args, 'inter', 'sinter')
+
+@redis_cmd(is_write=False)
+def sunion_func(args, _):
+    return set_algebra_generic(args, 'union', 'sunion')
+
+@redis_cmd(is_write=False)
+def sdiff_func(args, _):
+    return set_algebra_generic(args, 'diff', 'sdiff')
+
+@redis_cmd(is_write=True)
+def sinterstore_func(args, client_state):
+    return set_algebra_store_generic(args, 'inter', 'sinterstore')
+
+@redis_cmd(is_write=True)
+def sunionstore_func(args, client_state):
+    return set_algebra_store_generic(args, 'union', 'sunionstore')
+
+@redis_cmd(is_write=True)
+def sdiffstore_func(args, client_state):
+    return set_algebra_store_generic(args, 'diff', 'sdiffstore')
+
+# Sorted Set Functions
+ZADD_FLAGS = (b'nx', b'xx', b'gt', b'lt', b'ch', b'incr')
+
+@redis_cmd(is_write=True)
+def zadd_func(args, client_state):
+    if len(args) < 3:
+        return resp.error("ERR wrong number of arguments for 'zadd' command")
+    i = 1
+    flags = set()
+    while i < len(args) and args[i].lower() in ZADD_FLAGS:
+        flags.add(args[i].lower())
+        i += 1
+    rest = args[i:]
+    if not rest or len(rest) % 2:
+        return resp.error("ERR syntax error")
+    if {b'nx', b'xx'} <= flags:
+        return resp.error("ERR XX and NX options at the same time are not compatible")
+    if {b'gt', b'lt'} <= flags or (b'nx' in flags and flags & {b'gt', b'lt'}):
+        return resp.error("ERR GT, LT, and/or NX options at the same time are not compatible")
+    incr = b'incr' in flags
+    if incr and len(rest) > 2:
+        return resp.error("ERR INCR option supports a single increment-element pair")
+    try:
+        pairs = [(parse_score(score), member) for score, member in zip(rest[0::2], rest[1::2])]
+        result = zadd(args[0], pairs, nx=b'nx' in flags, xx=b'xx' in flags, gt=b'gt' in flags,
+                      lt=b'lt' in flags, ch=b'ch' in flags, incr=incr)
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+    if incr:
+        return resp.bulk(format_score(result) if result is not None else None)
+    return resp.integer(result)
+
+@redis_cmd(is_write=True)
+def zincrby_func(args, client_state):
+    if len(args) != 3:
+        return resp.error("ERR wrong number of arguments for 'zincrby' command")
+    try:
+        return resp.bulk(format_score(zincrby(args[0], parse_score(args[1]), args[2])))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+
+@redis_cmd(is_write=False)
+def zscore_func(args, _):
+    if len(args) != 2:
+        return resp.error("ERR wrong number of arguments for 'zscore' command")
+    try:
+        score = zscore(args[0], args[1])
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    return resp.bulk(format_score(score) if score is not None else None)
+
+@redis_cmd(is_write=False)
+def zcard_func(args, _):
+    if len(args) != 1:
+        return resp.error("ERR wrong number of arguments for 'zcard' command")
+    try:
+        return resp.integer(zcard(args[0]))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+
+@redis_cmd(is_write=False)
+def zrank_func(args, _):
+    if len(args) not in (2, 3):
+        return resp.error("ERR wrong number of arguments for 'zrank' command")
+    withscore = len(args) == 3
+    if withscore and args[2].lower() != b"withscore":
+        return resp.error("ERR syntax error")
+    try:
+        found = zrank(args[0], args[1])
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    if found is None:
+        return resp.NIL_ARRAY if withscore else resp.NIL
+    rank, score = found
+    if withscore:
+        return resp.ReplyBuilder().array(2).integer(rank).bulk(format_score(score)).getvalue()
+    return resp.integer(rank)
+
+@redis_cmd(is_write=True, deny_oom=False)
+def zrem_func(args, client_state):
+    if len(args) < 2:
+        return resp.error("ERR wrong number of arguments for 'zrem' command")
+    try:
+        return resp.integer(zrem(args[0], args[1:]))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+
+@redis_cmd(is_write=False)
+def zcount_func(args, _):
+    if len(args) != 3:
+        return resp.error("ERR wrong number of arguments for 'zcount' command")
+    try:
+        return resp.integer(zcount(args[0], parse_score_bound(args[1]), parse_score_bound(args[2])))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+
+@redis_cmd(is_write=True, deny_oom=False)
+def zremrangebyscore_func(args, client_state):
+    if len(args) != 3:
+        return resp.error("ERR wrong number of arguments for 'zremrangebyscore' command")
+    try:
+        return resp.integer(zremrangebyscore(args[0], parse_score_bound(args[1]), parse_score_bound(args[2])))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+
+def zrange_items(args):
+    """
+    ZRANGE key start stop [BYSCORE|BYLEX] [REV] [LIMIT offset count] [WITHSCORES]:
+    returns ([(member, score)] in reply order, withscores). Raises ValueError.
+    """
+    by = None
+    rev = withscores = False
+    offset, count = 0, -1
+    limit = False
+    i = 3
+    while i < len(args):
+        opt = args[i].lower()
+        if opt in (b"byscore", b"bylex"):
+            by = opt
+        elif opt == b"rev":
+            rev = True
+        elif opt == b"withscores":
+            withscores = True
+        elif opt == b"limit" and i + 2 < len(args):
+            try:
+                offset, count = int(args[i + 1]), int(args[i + 2])
+            except ValueError:
+                raise ValueError("value is not an integer or out of range")
+            limit = True
+            i += 2
+        else:
+            raise ValueError("syntax error")
+        i += 1
+    if limit and by is None:
+        raise ValueError("syntax error, LIMIT is only supported in combination with either BYSCORE or BYLEX")
+    if withscores and by == b"bylex":
+        raise ValueError("syntax error, WITHSCORES not supported in combination with BYLEX")
+    key, start, stop = args[0], args[1], args[2]
+    if by is None:
+        try:
+            start, stop = int(start), int(stop)
+        except ValueError:
+            raise ValueError("value is not an integer or out of range")
+    elif by == b"byscore":
+        start, stop = parse_score_bound(start), parse_score_bound(stop)
+    else:
+        start, stop = parse_lex_bound(start), parse_lex_bound(stop)
+    z = get_zset(key)
+    if z is None:
+        return [], withscores
+    L = len(z)
+    if by is None:
+        # Ranks count from the end with REV
+        if start < 0: start = max(0, L + start)
+        if stop < 0: stop = L + stop
+        stop = min(stop, L - 1)
+        if start > stop:
+            return [], withscores
+        lo, hi = (L - 1 - stop, L - start) if rev else (start, stop + 1)
+    else:
+        # With REV the range is given as max min
+        if rev:
+            start, stop = stop, start
+        lo, hi = (score_range if by == b"byscore" else lex_range)(z, start, stop)
+        if offset < 0:
+            return [], withscores
+        if rev:
+            hi = max(lo, hi - offset)
+            if count >= 0:
+                lo = max(lo, hi - count)
+        else:
+            lo = min(hi, lo + offset)
+            if count >= 0:
+                hi = min(hi, lo + count)
+    items = z.range(lo, hi)
+    if rev:
+        items.reverse()
+    return [(member, score) for score, member in items], withscores
+
+@redis_cmd(is_write=False)
+def zrange_func(args, _):
+    if len(args) < 3:
+        return resp.error("ERR wrong number of arguments for 'zrange' command")
+    try:
+        items, withscores = zrange_items(args)
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+    out = resp.ReplyBuilder().array(len(items) * (2 if withscores else 1))
+    for member, score in items:
+        out.bulk(member)
+        if withscores:
+            out.bulk(format_score(score))
+    return out.getvalue()
+
+def write_popped(popped) -> bytes:
+    out = resp.ReplyBuilder().array(2 * len(popped))
+    for member, score in popped:
+        out.bulk(member).bulk(format_score(score))
+    return out.getvalue()
+
+def zpop_generic(args, where: str) -> bytes:
+    if len(args) not in (1, 2):
+        return resp.error(f"ERR wrong number of arguments for 'zpop{where}' command")
+    count = 1
+    if len(args) == 2:
+        try:
+            count = int(args[1])
+        except ValueError:
+            return resp.error("ERR value is not an integer or out of range")
+        if count < 0:
+            return resp.error("ERR value is out of range, must be positive")
+    try:
+        return write_popped(zpop(args[0], count, where))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+
+@redis_cmd(is_write=True, deny_oom=False)
+def zpopmin_func(args, client_state):
+    return zpop_generic(args, 'min')
+
+@redis_cmd(is_write=True, deny_oom=False)
+def zpopmax_func(args, client_state):
+    return zpop_generic(args, 'max')
+
+async def bzpop_generic(args, client_state, where: str) -> bytes:
+    """BZPOPMIN/BZPOPMAX key [key ...] timeout: pop from the first non-empty key, or block on all of them."""
+    cmd = f'zpop{where}'
+    if len(args) < 2:
+        return resp.error(f"ERR wrong number of arguments for 'b{cmd}' command")
+    try:
+        keys, timeout = args[:-1], blocking_timeout(args[-1])
+
+        def pop(key: bytes):
+            popped = zpop(key, 1, where)
+            if not popped:
+                return None
+            member, score = popped[0]
+            return resp.bulk_array([key, member, format_score(score)])
+
+        for key in keys:
+            reply = pop(key)
+            if reply is not None:
+                client_state['propagate_as'] = (cmd, [key])
+                return reply
+        # As with BLPOP only a pop is propagated, as ZPOPMIN/ZPOPMAX
+        client_state['propagate_as'] = ()
+        if client_state.get('in_exec'):
+            return resp.NIL_ARRAY
+
+        def serve(key: bytes):
+            try:
+                reply = pop(key)
+            except WrongTypeError:
+                return None
+            if reply is not None:
+                blocking.propagate(cmd, [key])
+            return reply
+
+        reply = await blocking.block(keys, timeout, serve, blocking.ZPOPS)
+        return reply if reply is not None else resp.NIL_ARRAY
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return resp.error(f"ERR {e}")
+
+@redis_cmd(is_write=True, deny_oom=False)
+async def bzpopmin_func(args, client_state):
+    return await bzpop_generic(args, client_state, 'min')
+
+@redis_cmd(is_write=True, deny_oom=False)
+async def bzpopmax_func(args, client_state):
+    return await bzpop_generic(args, client_state, 'max')
 
 # Stream Functions
+def stream_error(e: ValueError) -> bytes:
+    """Consumer group errors carry their own code (NOGROUP, BUSYGROUP); other ValueErrors are ERR."""
+    return resp.error(str(e) if isinstance(e, StreamError) else f"ERR {e}")
+
+def parse_stream_int(text: bytes) -> int:
+    try:
+        return int(text)
+    except ValueError:
+        raise ValueError("value is not an integer or out of range")
+
+# Approximate trimming removes at most this many entries per call unless LIMIT says otherwise
+STREAM_TRIM_DEFAULT_LIMIT = 100 * STREAM_NODE_MAX_ENTRIES
+
+def parse_trim(args, i: int):
+    """
+    Parse MAXLEN|MINID [=|~] threshold [LIMIT count] starting at args[i].
+    Returns (Redis_Stream.trim arguments, index past them). Raises ValueError.
+    """
+    strategy = args[i].lower()
+    i += 1
+    approx = False
+    if i < len(args) and args[i] in (b"=", b"~"):
+        approx = args[i] == b"~"
+        i += 1
+    if i >= len(args):
+        raise ValueError("syntax error")
+    if strategy == b"maxlen":
+        maxlen = parse_stream_int(args[i])
+        if maxlen < 0:
+            raise ValueError("The MAXLEN argument must be >= 0.")
+        trim = {'maxlen': maxlen}
+    else:
+        trim = {'minid': parse_id(args[i])}
+    i += 1
+    limit = STREAM_TRIM_DEFAULT_LIMIT if approx else None
+    if i + 1 < len(args) and args[i].lower() == b"limit":
+        if not approx:
+            raise ValueError("syntax error, LIMIT cannot be used without the special ~ option")
+        limit = parse_stream_int(args[i + 1])
+        if limit < 0:
+            raise ValueError("The LIMIT argument must be >= 0.")
+        i += 2
+    trim.update(approx=approx, limit=limit or None)
+    return trim, i
+
 @redis_cmd(is_write=True)
 def xadd_func(args, client_state):
     try:
         key = args[0]
-        new_id = args[1]
-        field = {args[i]: args[i+1] for i in range(2, len(args), 2)}
-        new_id = xadd(key, new_id, field)
-        if new_id == "Error code 01":
-            return "-ERR The ID specified in XADD must be greater than 0-0\r\n"
+        nomkstream, trim = False, None
+        i = 1
+        while i < len(args) and args[i].lower() in (b"nomkstream", b"maxlen", b"minid"):
+            if args[i].lower() == b"nomkstream":
+                nomkstream = True
+                i += 1
+            else:
+                trim, i = parse_trim(args, i)
+        if i + 3 > len(args) or (len(args) - i) % 2 == 0:
+            return resp.error("ERR wrong number of arguments for 'xadd' command")
+        new_id = args[i].decode()
+        field = {args[j]: args[j+1] for j in range(i + 1, len(args), 2)}
+        new_id = xadd(key, new_id, field, nomkstream, trim)
+        if new_id is None:
+            return resp.NIL
+        elif new_id == "Error code 01":
+            return resp.error("ERR The ID specified in XADD must be greater than 0-0")
         elif new_id == "Error code 02":
-            return "-ERR The ID specified in XADD is equal or smaller than the target stream top item\r\n"
-        return f"${len(new_id)}\r\n{new_id}\r\n"
+            return resp.error("ERR The ID specified in XADD is equal or smaller than the target stream top item")
+        # Replicas and the AOF get the ID that was assigned and, if entries were
+        # trimmed, the exact length that was left rather than an approximation
+        prefix = [key]
+        if trim:
+            prefix += [b"MAXLEN", b"=", b"%d" % xlen(key)]
+        client_state['propagate_as'] = ("xadd", prefix + [new_id.encode()] + list(args[i + 1:]))
+        return resp.bulk(new_id)
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return stream_error(e)
     except Exception as e:
-        return f"-ERR xadd failed: {str(e)}\r\n"
+        return resp.error(f"ERR xadd failed: {str(e)}")
+
+def xrange_generic(args, rev: bool) -> bytes:
+    name = 'xrevrange' if rev else 'xrange'
+    if len(args) not in (3, 5):
+        return resp.error(f"ERR wrong number of arguments for '{name}' command")
+    key, start, end = args[:3]
+    if rev:
+        start, end = end, start
+    count = None
+    if len(args) == 5:
+        if args[3].lower() != b"count":
+            return resp.error("ERR syntax error")
+        count = max(0, parse_stream_int(args[4]))
+    return xrange(key, start.decode(), end.decode(), count, rev)
 
 @redis_cmd(is_write=False)
 def xrange_func(args, _):
     try:
-        key, start, end = args
-        arr = xrange(key, start, end)
-        return arr
+        return xrange_generic(args, rev=False)
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return stream_error(e)
     except Exception as e:
-        return f"-ERR xrange failed: {str(e)}\r\n"
+        return resp.error(f"ERR xrange failed: {str(e)}")
+
+@redis_cmd(is_write=False)
+def xrevrange_func(args, _):
+    try:
+        return xrange_generic(args, rev=True)
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return stream_error(e)
+    except Exception as e:
+        return resp.error(f"ERR xrevrange failed: {str(e)}")
+
+@redis_cmd(is_write=False)
+def xlen_func(args, _):
+    if len(args) != 1:
+        return resp.error("ERR wrong number of arguments for 'xlen' command")
+    try:
+        return resp.integer(xlen(args[0]))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+
+@redis_cmd(is_write=True, deny_oom=False)
+def xdel_func(args, _):
+    if len(args) < 2:
+        return resp.error("ERR wrong number of arguments for 'xdel' command")
+    try:
+        return resp.integer(xdel(args[0], [parse_id(a) for a in args[1:]]))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return stream_error(e)
+
+@redis_cmd(is_write=True, deny_oom=False)
+def xtrim_func(args, client_state):
+    try:
+        if len(args) < 3 or args[1].lower() not in (b"maxlen", b"minid"):
+            return resp.error("ERR syntax error")
+        trim, i = parse_trim(args, 1)
+        if i != len(args):
+            return resp.error("ERR syntax error")
+        removed = xtrim(args[0], trim)
+        client_state['propagate_as'] = ("xtrim", [args[0], b"MAXLEN", b"=", b"%d" % xlen(args[0])])
+        return resp.integer(removed)
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return stream_error(e)
+
+@redis_cmd(is_write=True, deny_oom=False)
+def xsetid_func(args, _):
+    try:
+        if len(args) not in (2, 4, 6):
+            return resp.error("ERR syntax error")
+        opts = {args[i].lower(): args[i + 1] for i in range(2, len(args), 2)}
+        if not set(opts) <= {b"entriesadded", b"maxdeletedid"}:
+            return resp.error("ERR syntax error")
+        entries_added = int(opts[b"entriesadded"]) if b"entriesadded" in opts else None
+        max_deleted_id = parse_id(opts[b"maxdeletedid"]) if b"maxdeletedid" in opts else None
+        if entries_added is not None and entries_added < 0:
+            return resp.error("ERR entries_added must be positive")
+        xsetid(args[0], parse_id(args[1]), entries_added, max_deleted_id)
+        return resp.OK
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return stream_error(e)
 
 @redis_cmd(is_write=False)
 async def xread_func(args, client_state):
     try:
         block_ms = None
+        count = None
         stream_idx = 0
-        if args[0].lower() == "block":
-            if len(args) < 4 or args[2].lower() != "streams":
-                return "-ERR syntax error\r\n"
+        while stream_idx + 1 < len(args) and args[stream_idx].lower() in (b"block", b"count"):
+            opt, val = args[stream_idx].lower(), args[stream_idx + 1]
             try:
-                block_ms = int(args[1])
-                if block_ms < 0:
-                    return "-ERR invalid block timeout\r\n"
+                num = int(val)
             except ValueError:
-                return "-ERR block timeout is not an integer\r\n"
-            stream_idx = 2
-        if args[stream_idx].lower() != "streams":
-            return "-ERR syntax error: expected STREAMS\r\n"
+                return resp.error(f"ERR {opt.decode()} is not an integer")
+            if opt == b"block":
+                if num < 0:
+                    return resp.error("ERR invalid block timeout")
+                block_ms = num
+            else:
+                count = num if num > 0 else None
+            stream_idx += 2
+        if stream_idx >= len(args) or args[stream_idx].lower() != b"streams":
+            return resp.error("ERR syntax error: expected STREAMS")
         stream_idx += 1
         if len(args) < stream_idx + 2:
-            return "-ERR wrong number of arguments for 'xread' command\r\n"
+            return resp.error("ERR wrong number of arguments for 'xread' command")
         mid = (len(args) - stream_idx) // 2
         keys = args[stream_idx:stream_idx + mid]
-        data_ids = args[stream_idx + mid:]
+        data_ids = [d.decode() for d in args[stream_idx + mid:]]
         if len(keys) != len(data_ids):
-            return "-ERR number of keys does not match number of IDs\r\n"
-        return await xread(keys, data_ids, block_ms)
+            return resp.error("ERR number of keys does not match number of IDs")
+        if client_state.get('in_exec'):
+            block_ms = None     # blocking commands do not block inside MULTI/EXEC
+        return await xread(keys, data_ids, block_ms, count)
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return stream_error(e)
     except Exception as e:
-        return f"-ERR xread failed: {str(e)}\r\n"
+        return resp.error(f"ERR xread failed: {str(e)}")
+
+@redis_cmd(is_write=True)
+def xgroup_func(args, _):
+    try:
+        sub = args[0].lower() if args else b""
+        if sub in (b"create", b"setid") and len(args) >= 4:
+            key, group, id_text = args[1:4]
+            mkstream, entries_read = False, None
+            i = 4
+            while i < len(args):
+                opt = args[i].lower()
+                if opt == b"mkstream" and sub == b"create":
+                    mkstream = True
+                    i += 1
+                elif opt == b"entriesread" and i + 1 < len(args):
+                    entries_read = parse_stream_int(args[i + 1])
+                    if entries_read < -1:
+                        return resp.error("ERR value for ENTRIESREAD must be positive or -1")
+                    i += 2
+                else:
+                    return resp.error("ERR syntax error")
+            if sub == b"create":
+                streams.xgroup_create(key, group, id_text, mkstream, entries_read)
+            else:
+                streams.xgroup_setid(key, group, id_text, entries_read)
+            return resp.OK
+        if sub == b"destroy" and len(args) == 3:
+            return resp.integer(int(streams.xgroup_destroy(args[1], args[2])))
+        if sub == b"createconsumer" and len(args) == 4:
+            return resp.integer(int(streams.xgroup_createconsumer(*args[1:4])))
+        if sub == b"delconsumer" and len(args) == 4:
+            return resp.integer(streams.xgroup_delconsumer(*args[1:4]))
+        return resp.error(f"ERR unknown subcommand or wrong number of arguments for '{sub.decode()}'")
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return stream_error(e)
+
+@redis_cmd(is_write=True)
+async def xreadgroup_func(args, client_state):
+    try:
+        if len(args) < 6 or args[0].lower() != b"group":
+            return resp.error("ERR syntax error")
+        group, consumer = args[1], args[2]
+        count = block_ms = None
+        noack = False
+        i = 3
+        while i < len(args) and args[i].lower() != b"streams":
+            opt = args[i].lower()
+            if opt == b"noack":
+                noack = True
+                i += 1
+            elif opt in (b"count", b"block") and i + 1 < len(args):
+                num = parse_stream_int(args[i + 1])
+                if opt == b"block":
+                    if num < 0:
+                        return resp.error("ERR timeout is negative")
+                    block_ms = num
+                else:
+                    count = num if num > 0 else None
+                i += 2
+            else:
+                return resp.error("ERR syntax error")
+        rest = args[i + 1:]
+        if i >= len(args) or not rest or len(rest) % 2:
+            return resp.error("ERR Unbalanced 'xreadgroup' list of streams: for each stream key an ID "
+                              "or '>' must be specified.")
+        keys, ids = rest[:len(rest) // 2], rest[len(rest) // 2:]
+        # Replicas and the AOF get a read that does not block
+        opts = [b"GROUP", group, consumer] + ([b"COUNT", b"%d" % count] if count else []) + \
+            ([b"NOACK"] if noack else [])
+        if client_state.get('in_exec'):
+            block_ms = None     # blocking commands do not block inside MULTI/EXEC
+        result, served = await streams.xreadgroup(group, consumer, keys, ids, block_ms, count, noack)
+        client_state['propagate_as'] = () if served else ("xreadgroup", opts + [b"STREAMS"] + list(rest))
+        return result
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return stream_error(e)
+
+@redis_cmd(is_write=True, deny_oom=False)
+def xack_func(args, _):
+    if len(args) < 3:
+        return resp.error("ERR wrong number of arguments for 'xack' command")
+    try:
+        return resp.integer(streams.xack(args[0], args[1], [parse_id(a) for a in args[2:]]))
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return stream_error(e)
+
+@redis_cmd(is_write=False)
+def xpending_func(args, _):
+    if len(args) < 2:
+        return resp.error("ERR wrong number of arguments for 'xpending' command")
+    try:
+        if len(args) == 2:
+            return streams.xpending_summary(args[0], args[1])
+        key, group = args[0], args[1]
+        rest = list(args[2:])
+        min_idle = 0
+        if rest and rest[0].lower() == b"idle":
+            if len(rest) < 2:
+                return resp.error("ERR syntax error")
+            min_idle = parse_stream_int(rest[1])
+            rest = rest[2:]
+        if len(rest) not in (3, 4):
+            return resp.error("ERR syntax error")
+        start = parse_range_id(rest[0].decode(), 0)
+        end = parse_range_id(rest[1].decode(), STREAM_ID_MAX_SEQ)
+        count = parse_stream_int(rest[2])
+        consumer = rest[3] if len(rest) == 4 else None
+        if start is None or end is None or count <= 0:
+            streams.get_group(key, group)
+            return resp.EMPTY_ARRAY
+        return streams.xpending_range(key, group, start, end, count, consumer, min_idle)
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return stream_error(e)
+
+def write_claimed(res: resp.ReplyBuilder, claimed, justid: bool) -> None:
+    res.array(len(claimed))
+    for sid, fields in claimed:
+        if justid:
+            res.bulk(format_id(sid))
+        else:
+            write_entry(res, format_id(sid), fields)
+
+def claim_propagation(key, group, consumer, claimed, deleted, now: int, justid: bool, extra=()):
+    """
+    XCLAIM and XAUTOCLAIM reach replicas and the AOF as an XCLAIM of exactly the entries
+    that changed hands (and those dropped as deleted), at the same delivery time.
+    """
+    ids = sorted([sid for sid, _ in claimed] + deleted)
+    if not ids:
+        return ("xgroup", [b"CREATECONSUMER", key, group, consumer])
+    return ("xclaim", [key, group, consumer, b"0"] + [format_id(sid) for sid in ids]
+            + [b"TIME", b"%d" % now] + ([b"JUSTID"] if justid else []) + list(extra))
+
+@redis_cmd(is_write=True)
+def xclaim_func(args, client_state):
+    try:
+        if len(args) < 5:
+            return resp.error("ERR wrong number of arguments for 'xclaim' command")
+        key, group, consumer = args[0], args[1], args[2]
+        min_idle = parse_stream_int(args[3])
+        ids, i = [], 4
+        while i < len(args):
+            try:
+                ids.append(parse_id(args[i]))
+            except ValueError:
+                break
+            i += 1
+        now = now_ms()
+        delivery_time = retry_count = last_id = None
+        force = justid = False
+        extra = []
+        while i < len(args):
+            opt = args[i].lower()
+            if opt in (b"force", b"justid"):
+                force, justid = force or opt == b"force", justid or opt == b"justid"
+                if opt == b"force":
+                    extra.append(b"FORCE")
+                i += 1
+            elif opt in (b"idle", b"time", b"retrycount", b"lastid") and i + 1 < len(args):
+                val = args[i + 1]
+                if opt == b"idle":
+                    delivery_time = now - parse_stream_int(val)
+                elif opt == b"time":
+                    delivery_time = parse_stream_int(val)
+                elif opt == b"retrycount":
+                    retry_count = parse_stream_int(val)
+                    extra += [b"RETRYCOUNT", val]
+                else:
+                    last_id = parse_id(val)
+                    extra += [b"LASTID", val]
+                i += 2
+            else:
+                return resp.error(f"ERR Unrecognized XCLAIM option '{args[i].decode(errors='replace')}'")
+        claimed, deleted = streams.xclaim(key, group, consumer, min_idle, ids, delivery_time, retry_count,
+                                          force, justid, last_id, now)
+        when = delivery_time if delivery_time is not None else now
+        client_state['propagate_as'] = claim_propagation(key, group, consumer, claimed, deleted, when,
+                                                         justid, extra)
+        res = resp.ReplyBuilder()
+        write_claimed(res, claimed, justid)
+        return res.getvalue()
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return stream_error(e)
+
+@redis_cmd(is_write=True)
+def xautoclaim_func(args, client_state):
+    try:
+        if len(args) < 5:
+            return resp.error("ERR wrong number of arguments for 'xautoclaim' command")
+        key, group, consumer = args[0], args[1], args[2]
+        min_idle = parse_stream_int(args[3])
+        start = parse_range_id(args[4].decode(), 0)
+        count, justid = 100, False
+        i = 5
+        while i < len(args):
+            opt = args[i].lower()
+            if opt == b"count" and i + 1 < len(args):
+                count = parse_stream_int(args[i + 1])
+                if count < 1:
+                    return resp.error("ERR COUNT must be > 0")
+                i += 2
+            elif opt == b"justid":
+                justid = True
+                i += 1
+            else:
+                return resp.error("ERR syntax error")
+        if start is None:
+            return resp.error("ERR Invalid stream ID specified as stream command argument")
+        now = now_ms()
+        cursor, claimed, deleted = streams.xautoclaim(key, group, consumer, min_idle, start, count, justid, now)
+        client_state['propagate_as'] = claim_propagation(key, group, consumer, claimed, deleted, now, justid)
+        res = resp.ReplyBuilder().array(3).bulk(format_id(cursor))
+        write_claimed(res, claimed, justid)
+        res.array(len(deleted))
+        for sid in deleted:
+            res.bulk(format_id(sid))
+        return res.getvalue()
+    except WrongTypeError:
+        return resp.WRONGTYPE
+    except ValueError as e:
+        return stream_error(e)
 
 # Replication Commands
 @redis_cmd(is_write=False)
 def replconf_getack_func(args, client_state):
-    if args[0].lower() != 'getack' or args[1] != '*':
-        return "-ERR invalid REPLCONF GETACK arguments\r\n"
+    if args[0].lower() != b'getack' or args[1] != b'*':
+        return resp.error("ERR invalid REPLCONF GETACK arguments")
     offset = client_state['server_state'].get('processed_offset', 0)
-    resp = f"*3\r\n$8\r\nREPLCONF\r\n$3\r\nACK\r\n${len(str(offset))}\r\n{offset}\r\n"
-    print(f"replconf_getack_func: offset={offset}, resp={resp!r}")
-    return resp
+    return build_resp_array("REPLCONF", [b"ACK", b"%d" % offset])
 
 @redis_cmd(is_write=False)
 async def wait_func(args, client_state):
     if len(args) != 2:
-        return "-ERR invalid WAIT arguments\r\n"
+        return resp.error("ERR invalid WAIT arguments")
     try:
         num_replicas = int(args[0])
         timeout_ms = int(args[1])
         if num_replicas < 0 or timeout_ms < 0:
-            return "-ERR WAIT arguments must be non-negative\r\n"
+            return resp.error("ERR WAIT arguments must be non-negative")
     except ValueError:
-        return "-ERR WAIT arguments must be integers\r\n"
+        return resp.error("ERR WAIT arguments must be integers")
     
+    # Every write this client made so far is covered by the current offset
     server_state = client_state['server_state']
     target_offset = server_state['master_repl_offset']
-    print(f"wait_func: num_replicas={num_replicas}, timeout_ms={timeout_ms}, target_offset={target_offset}")
-    
-    # Send REPLCONF GETACK * to all replicas
-    getack_cmd = build_resp_array("REPLCONF", ["GETACK", "*"]).encode()
-    for replica_writer, _ in server_state['replicas']:
-        try:
-            replica_writer.write(getack_cmd)
-            await replica_writer.drain()
-            print(f"wait_func: Sent REPLCONF GETACK * to replica {replica_writer}")
-        except Exception as e:
-            print(f"wait_func: Failed to send REPLCONF GETACK to replica: {e}")
-    
-    # Wait for acknowledgments or timeout
-    start_time = asyncio.get_event_loop().time()
-    timeout_s = timeout_ms / 1000.0
-    while asyncio.get_event_loop().time() - start_time < timeout_s:
-        synced_replicas = sum(1 for _, offset in server_state['replicas'] if offset >= target_offset)
-        if synced_replicas >= num_replicas:
-            print(f"wait_func: Returning {synced_replicas} replicas")
-            return f":{synced_replicas}\r\n"
-        await asyncio.sleep(0.01)
-    
-    synced_replicas = sum(1 for _, offset in server_state['replicas'] if offset >= target_offset)
-    print(f"wait_func: Timeout reached, returning {synced_replicas} replicas")
-    return f":{synced_replicas}\r\n"
+    return resp.integer(await ack_waiters.wait(server_state, num_replicas, target_offset, timeout_ms))
 # Command mapping
 
 # app/commands.py
 
+@redis_cmd(is_write=False)
 async def exec_func(args, client_state):
     if client_state['multi_event'].is_set():
-        return "-ERR EXEC without MULTI\r\n"
+        return resp.error("ERR EXEC without MULTI")
     if not client_state['exec_event']:
         client_state['multi_event'].set()
-        return "*0\r\n"
+        return resp.EMPTY_ARRAY
 
     replies = []
     # Commit transaction updates to the data store
@@ -245,46 +1716,127 @@ async def exec_func(args, client_state):
     # Import the centralized router logic (to avoid circular imports, import inside function)
     from router import execute_command 
 
-    for c, a in client_state['exec_event']:
-        # Re-route each queued command through the 3-layer system
-        # This automatically handles AOF, Replication, and Sync/Async
-        result = await execute_command(c.lower(), a, client_state)
-        replies.append(result)
+    # Blocked clients are served once the whole transaction has run
+    client_state['in_exec'] = True
+    try:
+        for c, a in client_state['exec_event']:
+            # Re-route each queued command through the 3-layer system
+            # This automatically handles AOF, Replication, and Sync/Async
+            result = await execute_command(c.lower(), a, client_state)
+            replies.append(result)
+    finally:
+        client_state['in_exec'] = False
 
     client_state['exec_event'].clear()
     
     # Format the multi-bulk response
-    out = f"*{len(replies)}\r\n"
+    out = resp.ReplyBuilder().array(len(replies))
     for r in replies:
-        out += r if isinstance(r, str) else r.decode('utf-8', errors='replace')
-    return out
+        out.raw(r)
+    return out.getvalue()
 
 @redis_cmd(is_write=False)
 def multi_func(args, client_state):
     client_state['multi_event'].clear() # Set 'multi' mode
-    return "+OK\r\n"
+    return resp.OK
 
 @redis_cmd(is_write=False)
 def discard_func(args, client_state):
     if client_state['multi_event'].is_set():
-        return "-ERR DISCARD without MULTI\r\n"
+        return resp.error("ERR DISCARD without MULTI")
     client_state['exec_event'].clear()
     client_state['multi_event'].set()
     rkey.rkey.discard_transaction()
-    return "+OK\r\n"
+    return resp.OK
 
+# Persistence Commands
 @redis_cmd(is_write=False)
-def info_func(args, client_state):
-    server_state = client_state['server_state']
+def bgrewriteaof_func(args, client_state):
+    if not aof.enabled:
+        return resp.error("ERR AOF is not enabled")
+    if aof.rewrite_in_progress:
+        return resp.error("ERR Background append only file rewriting already in progress")
+    if not aof.start_rewrite():
+        return resp.error("ERR Can't start background append only file rewriting")
+    return resp.simple("Background append only file rewriting started")
+
+@redis_cmd(is_write=False)
+def bgsave_func(args, client_state):
+    if rdb.in_progress:
+        return resp.error("ERR Background save already in progress")
+    if not rdb.start_bgsave():
+        return resp.error("ERR Can't start background save")
+    return resp.simple("Background saving started")
+
+@redis_cmd(is_write=False)
+def lastsave_func(args, client_state):
+    return resp.integer(rdb.lastsave)
+
+def clients_info(server_state) -> str:
+    response = "# Clients\r\n"
+    for field, value in blocking.stats.items():
+        response += f"{field}:{value}\r\n"
+    return response
+
+def replication_info(server_state) -> str:
     response = "# Replication\r\n"
     response += f"role:{server_state['role']}\r\n"
     if server_state['role'] == 'slave':
         response += f"master_host:{server_state['master_host']}\r\nmaster_port:{server_state['master_port']}\r\n"
     else:
         response += f"master_repl_offset:{server_state.get('master_repl_offset', 0)}\r\nmaster_replid:{server_state.get('master_replid', '8371b4fb1155b71f4a04d3e1bc3e18c4a990aeeb')}\r\n"
-    return f"${len(response)}\r\n{response}\r\n"
+        replicas = server_state['replicas']
+        response += f"connected_slaves:{len(replicas) + len(server_state.get('syncing_replicas', ()))}\r\n"
+        for i, link in enumerate(replicas):
+            response += f"slave{i}:{link.info(server_state['master_repl_offset'])}\r\n"
+        for field, value in backlog.info().items():
+            response += f"{field}:{value}\r\n"
+    return response
+
+def persistence_info(server_state) -> str:
+    response = "# Persistence\r\n"
+    for field, value in (rdb.info() | aof.info()).items():
+        response += f"{field}:{value}\r\n"
+    return response
+
+def memory_info(server_state) -> str:
+    response = "# Memory\r\n"
+    for field, value in evict.info().items():
+        response += f"{field}:{value}\r\n"
+    return response
+
+def stats_info(server_state) -> str:
+    response = "# Stats\r\n"
+    for field, value in (expiry.stats | evict.stats).items():
+        response += f"{field}:{value}\r\n"
+    return response
+
+def keyspace_info(server_state) -> str:
+    response = "# Keyspace\r\n"
+    keys = keyspace.count()
+    if keys:
+        response += f"db0:keys={keys},expires={len(expires)},avg_ttl=0\r\n"
+    return response
+
+INFO_SECTIONS = {
+    'clients': clients_info,
+    'replication': replication_info,
+    'memory': memory_info,
+    'persistence': persistence_info,
+    'stats': stats_info,
+    'keyspace': keyspace_info,
+}
+
+@redis_cmd(is_write=False)
+def info_func(args, client_state):
+    server_state = client_state['server_state']
+    wanted = [a.decode().lower() for a in args]
+    if not wanted or any(w in ('all', 'default', 'everything') for w in wanted):
+        wanted = list(INFO_SECTIONS)
+    sections = [INFO_SECTIONS[w](server_state) for w in wanted if w in INFO_SECTIONS]
+    return resp.bulk("\r\n".join(sections))
 
-async def redis_command(cmd: str, args: List[str], client_state: dict, is_replica: bool = False) -> str:
+async def redis_command(cmd: str, args: List[bytes], client_state: dict, is_replica: bool = False) -> bytes:
     """
     Entry point for commands. In the new 3-layer architecture, 
     this delegates to the Router's execution engine.
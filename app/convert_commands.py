@@ -48,28 +48,149 @@ def convert_resp(data):
             if pos + length > len(data):
                 print(f"convert_resp: Incomplete bulk string, pos={pos}, length={length}, buffer={data[:100]}")
                 return None, [], 0
-            arg = data[pos:pos+length].decode('utf-8', errors='replace')
-            args.append(arg)
+            args.append(data[pos:pos+length])
             pos += length + 2  # Skip \r\n
         
-        cmd = args[0].lower() if args else None
-        print(f"convert_resp: Success, cmd={cmd}, args={args[1:]}, consumed={pos}")
+        cmd = args[0].decode('utf-8', errors='replace').lower() if args else None
         return cmd, args[1:], pos
     except (ValueError, IndexError, UnicodeDecodeError) as e:
         print(f"convert_resp error: {str(e)}, buffer={data[:100]}")
         return None, [], 0
 
-def build_resp_array(cmd: str, args: list):
+class ProtocolError(Exception):
+    """Raised when a client sends bytes that can never form a valid request."""
+
+
+class RespParser:
+    """
+    Incremental RESP request parser for a single connection.
+    Bytes are fed as they arrive from the socket; every complete command
+    is pulled out of the buffer and partial trailing data is kept for the next read.
+    A multibulk request that is still arriving keeps the arguments read so far and
+    the length of the next bulk string, so each byte is parsed once however many
+    reads the request spans.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._args = None       # arguments of the partial multibulk request, None between requests
+        self._missing = 0       # arguments still to come
+        self._bulk_len = -1     # length of the next bulk string once its header was read
+        self._size = 0          # bytes of the partial request already taken out of the buffer
+
+    def feed(self, data) -> None:
+        self._buf += data
+
+    def pending(self) -> int:
+        return len(self._buf) + (self._size if self._args is not None else 0)
+
+    def __iter__(self):
+        """Yield (command, args, consumed_bytes) for every complete command in the buffer."""
+        buf = self._buf
+        pos = 0
+        try:
+            while pos < len(buf):
+                if self._args is None:
+                    parsed = self._parse_header(buf, pos)
+                    if parsed is None:
+                        break
+                    cmd, args, end = parsed
+                    if self._args is None:
+                        # An inline or empty request, complete already
+                        consumed = end - pos
+                        pos = end
+                        if cmd:
+                            yield cmd, args, consumed
+                        continue
+                    self._size = end - pos
+                    pos = end
+                pos = self._parse_args(buf, pos)
+                if self._missing:
+                    break
+                args, consumed = self._args, self._size
+                self._args = None
+                yield args[0].decode('utf-8', errors='replace').lower(), args[1:], consumed
+        finally:
+            if pos:
+                del buf[:pos]
+
+    def _parse_header(self, buf, pos):
+        """
+        Parse an inline request, or the *<count> line of a multibulk one, which starts
+        collecting its arguments. Returns (cmd, args, end), or None if incomplete.
+        """
+        if buf[pos] != 0x2A:  # '*'
+            # Inline command (e.g. typed through telnet)
+            eol = buf.find(b"\n", pos)
+            if eol == -1:
+                return None
+            parts = bytes(buf[pos:eol]).split()
+            if not parts:
+                return None, [], eol + 1
+            return parts[0].decode('utf-8', errors='replace').lower(), parts[1:], eol + 1
+
+        eol = buf.find(b"\r\n", pos)
+        if eol == -1:
+            return None
+        try:
+            count = int(buf[pos + 1:eol])
+        except ValueError:
+            raise ProtocolError("invalid multibulk length")
+        if count > 0:
+            self._args, self._missing = [], count
+        return None, [], eol + 2
+
+    def _parse_args(self, buf, pos: int) -> int:
+        """Read as many of the missing arguments as the buffer holds. Returns the position past them."""
+        # Arguments are copied straight out of the buffer as bytes, exactly once.
+        # The view is released before returning so the buffer can be compacted.
+        args = self._args
+        with memoryview(buf) as view:
+            while self._missing:
+                if self._bulk_len < 0:
+                    if pos >= len(buf):
+                        break
+                    if buf[pos] != 0x24:  # '$'
+                        raise ProtocolError(f"expected '$', got '{chr(buf[pos])}'")
+                    eol = buf.find(b"\r\n", pos)
+                    if eol == -1:
+                        break
+                    try:
+                        length = int(view[pos + 1:eol])
+                    except ValueError:
+                        raise ProtocolError("invalid bulk length")
+                    if length < 0:
+                        raise ProtocolError("invalid bulk length")
+                    self._size += eol + 2 - pos
+                    pos = eol + 2
+                    self._bulk_len = length
+                # Nothing is looked at until the whole bulk string and its CRLF are in
+                end = pos + self._bulk_len + 2
+                if end > len(buf):
+                    break
+                args.append(view[pos:end - 2].tobytes())
+                self._size += end - pos
+                pos = end
+                self._bulk_len = -1
+                self._missing -= 1
+        return pos
+
+
+def build_resp_array(cmd, args: list) -> bytes:
     """Build a RESP array from command and arguments."""
-    parts = [f"${len(cmd)}\r\n{cmd}\r\n"]
-    for arg in args:
-        parts.append(f"${len(arg)}\r\n{arg}\r\n")
-    return f"*{len(args) + 1}\r\n{''.join(parts)}"
+    parts = [cmd.encode() if isinstance(cmd, str) else cmd]
+    parts.extend(args)
+    out = [b"*%d\r\n" % len(parts)]
+    for arg in parts:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(out)
 def main():
     data1 = b"*3\r\n$3\r\nSET\r\n$3\r\nfoo\r\n$3\r\n123\r\n"
     data2 = b"*2\r\n$3\r\nGET\r\n$3\r\nfoo\r\n"
-    print(convert_resp(data1))  # Should print: ('set', ['foo', '123'], 26)
-    print(convert_resp(data2))  # Should print: ('get', ['foo'], 18)
+    print(convert_resp(data1))  # Should print: ('set', [b'foo', b'123'], 31)
+    print(convert_resp(data2))  # Should print: ('get', [b'foo'], 22)
     print(convert_resp(b"invalid"))  # Should print: (None, [], 0)
     print(convert_resp(b"\r\n$3\r\nfoo\r\n$3\r\n123\r\n"))  # Should print: (None, [], 0)
 
@@ -0,0 +1,216 @@
+"""
+Clients blocked on keys: BLPOP, BRPOP, BLMOVE, BZPOPMIN, BZPOPMAX, XREAD BLOCK
+and XREADGROUP BLOCK.
+
+A blocked client is one Waiter with one future, queued in FIFO order on every
+key it waits for. Commands that add data call signal(key), which only marks
+the key ready; once the command has run (and been propagated), the router
+calls serve_ready_keys(). For each ready key the waiters are offered the key
+in order through their serve(key) callback, which performs the pop or read
+and returns the reply, or None if there is nothing for that waiter. Serving
+happens before any other command runs, so an element is handed to exactly
+one client and the replicas see the push and the pop in the same order.
+
+Queues are per (key, tag): list and sorted set pops have a tag each and stop
+at the first waiter that gets nothing, since the rest would get nothing
+either; XREAD waiters do not consume, so all of them are offered the key.
+Timeouts are kept in a single heap served by one timer handle, so idle
+blocked clients cost a future and a heap entry each. Waiters that finish are
+dropped from their queues and the heap lazily.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+POPS = None           # tag of the queue for BLPOP, BRPOP and BLMOVE
+ZPOPS = 'zpop'        # tag of the queue for BZPOPMIN and BZPOPMAX
+XREAD = 'xread'       # tag of the queue for XREAD; XREADGROUP uses the group name
+# Finished waiters are dropped from a queue or the timer heap once they are
+# more than half of it and at least this many
+BLOCKING_MIN_COMPACT = 1024
+
+propagate_hook = None   # propagate_hook(cmd, args): send a served pop to the AOF and replicas
+
+stats = {
+    'blocked_clients': 0,
+}
+
+
+class Waiter:
+    __slots__ = ('keys', 'tag', 'future', 'serve', 'deadline', 'done')
+
+    def __init__(self, keys: List[bytes], tag, future: asyncio.Future, serve: Callable, deadline: Optional[float]):
+        self.keys = keys
+        self.tag = tag
+        self.future = future
+        self.serve = serve          # serve(key) -> reply bytes, or None to keep waiting
+        self.deadline = deadline    # loop time, None to wait forever
+        self.done = False
+
+
+class WaitQueue(deque):
+    """Waiters for one key and tag, oldest first; `stale` counts finished ones not removed yet."""
+
+    def __init__(self, exclusive: bool):
+        super().__init__()
+        self.exclusive = exclusive
+        self.stale = 0
+
+
+_queues: Dict[bytes, Dict[object, WaitQueue]] = {}
+_ready: Dict[bytes, None] = {}        # keys signalled since the last serve, in order
+_timers: list = []                    # heap of (deadline, seq, waiter)
+_timer_stale = 0
+_timer_handle: Optional[asyncio.TimerHandle] = None
+_timer_at: Optional[float] = None
+_seq = itertools.count()
+
+
+def signal(key: bytes) -> None:
+    """Note that key may now have data for blocked clients."""
+    if key in _queues:
+        _ready[key] = None
+
+def propagate(cmd: str, args: list) -> None:
+    if propagate_hook is not None:
+        propagate_hook(cmd, args)
+
+async def block(keys: List[bytes], timeout: Optional[float], serve: Callable, tag=POPS) -> Optional[bytes]:
+    """
+    Wait until serve(key) returns a reply for one of keys, and return it.
+    timeout is in seconds, None to wait forever; returns None when it expires.
+    """
+    if timeout is not None and not math.isfinite(timeout):
+        # A NaN deadline would sit at the top of the heap and stop every other timeout
+        raise ValueError("timeout is not a float or out of range")
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    waiter = Waiter(keys, tag, loop.create_future(), serve, deadline)
+    for key in dict.fromkeys(keys):
+        tags = _queues.setdefault(key, {})
+        queue = tags.get(tag)
+        if queue is None:
+            queue = tags[tag] = WaitQueue(exclusive=tag != XREAD)
+        queue.append(waiter)
+    if deadline is not None:
+        heapq.heappush(_timers, (deadline, next(_seq), waiter))
+        _schedule(loop)
+    stats['blocked_clients'] += 1
+    try:
+        return await waiter.future
+    finally:
+        # Timed out, served, or the client went away
+        if not waiter.done:
+            _finish(waiter, None)
+
+def serve_ready_keys() -> None:
+    """Hand the keys signalled so far to their waiters. Serving may signal more keys (BLMOVE)."""
+    while _ready:
+        key = next(iter(_ready))
+        del _ready[key]
+        tags = _queues.get(key)
+        if not tags:
+            continue
+        for tag, queue in list(tags.items()):
+            if queue.exclusive:
+                _serve_fifo(queue, key)
+            else:
+                _serve_all(queue, key)
+            _drop_if_empty(key, tag)
+
+def _offer(waiter: Waiter, key: bytes) -> bool:
+    try:
+        reply = waiter.serve(key)
+    except Exception as e:
+        # A failing waiter must not break the command that made the key ready
+        print(f"Error serving blocked client on {key!r}: {e}")
+        reply = None
+    if reply is None:
+        return False
+    _finish(waiter, reply)
+    return True
+
+def _serve_fifo(queue: WaitQueue, key: bytes) -> None:
+    while queue:
+        waiter = queue[0]
+        if waiter.done:
+            queue.popleft()
+            queue.stale -= 1
+        elif not _offer(waiter, key):
+            break
+
+def _serve_all(queue: WaitQueue, key: bytes) -> None:
+    for waiter in list(queue):
+        if not waiter.done:
+            _offer(waiter, key)
+
+def _drop_if_empty(key: bytes, tag) -> None:
+    """Forget a queue that only holds finished waiters."""
+    tags = _queues.get(key)
+    queue = tags.get(tag) if tags else None
+    if queue is not None and len(queue) <= queue.stale:
+        del tags[tag]
+        if not tags:
+            del _queues[key]
+
+def _finish(waiter: Waiter, reply: Optional[bytes]) -> None:
+    """Resolve the waiter and take it out of its queues and the timer heap."""
+    global _timer_stale, _timers
+    waiter.done = True
+    stats['blocked_clients'] -= 1
+    if not waiter.future.done():
+        waiter.future.set_result(reply)
+    for key in dict.fromkeys(waiter.keys):
+        tags = _queues.get(key)
+        queue = tags.get(waiter.tag) if tags else None
+        if queue is None:
+            continue
+        if queue and queue[0] is waiter:
+            queue.popleft()
+        elif queue and queue[-1] is waiter:
+            queue.pop()
+        else:
+            queue.stale += 1
+            if queue.stale > BLOCKING_MIN_COMPACT and queue.stale * 2 > len(queue):
+                live = [w for w in queue if not w.done]
+                queue.clear()
+                queue.extend(live)
+                queue.stale = 0
+        _drop_if_empty(key, waiter.tag)
+    if waiter.deadline is not None:
+        # Finished before its deadline: its heap entry is left for _schedule or compaction
+        _timer_stale += 1
+        if _timer_stale > BLOCKING_MIN_COMPACT and _timer_stale * 2 > len(_timers):
+            _timers = [t for t in _timers if not t[2].done]
+            heapq.heapify(_timers)
+            _timer_stale = 0
+
+def _schedule(loop: asyncio.AbstractEventLoop) -> None:
+    """Point the timer handle at the earliest deadline still pending."""
+    global _timer_handle, _timer_at, _timer_stale
+    while _timers and _timers[0][2].done:
+        heapq.heappop(_timers)
+        _timer_stale = max(0, _timer_stale - 1)
+    at = _timers[0][0] if _timers else None
+    if at == _timer_at:
+        return
+    if _timer_handle is not None:
+        _timer_handle.cancel()
+    _timer_handle = loop.call_at(at, _expire, loop) if at is not None else None
+    _timer_at = at
+
+def _expire(loop: asyncio.AbstractEventLoop) -> None:
+    global _timer_handle, _timer_at, _timer_stale
+    _timer_handle = _timer_at = None
+    now = loop.time()
+    while _timers and _timers[0][0] <= now:
+        _, _, waiter = heapq.heappop(_timers)
+        if waiter.done:
+            _timer_stale = max(0, _timer_stale - 1)
+        else:
+            waiter.deadline = None   # its heap entry is gone already
+            _finish(waiter, None)
+    _schedule(loop)
@@ -0,0 +1,130 @@
+"""
+Eviction under maxmemory.
+
+Before running a command the server calls perform_evictions(), which deletes
+keys chosen by the policy until the keyspace's estimated used_memory is back
+under maxmemory. Commands that may grow the dataset are refused with an OOM
+error when that is not possible (noeviction, or nothing left to evict).
+
+Like Redis, the policies are approximations that need no global LRU list:
+each round samples `samples` random keys (from the whole keyspace, or from
+the keys with a TTL for the volatile-* policies) and merges them into a small
+pool of the best candidates seen so far; the best one in the pool is evicted.
+  - allkeys-lru / volatile-lru: longest time since last access
+  - allkeys-lfu: lowest (decayed) access frequency
+  - volatile-ttl: closest expire time
+Evicted keys are propagated as DEL through propagate_hook, installed by the server.
+"""
+import os
+from typing import Optional
+import data_type.keyspace as keyspace
+from data_type.expires import expires
+
+POLICIES = ('noeviction', 'allkeys-lru', 'allkeys-lfu', 'volatile-lru', 'volatile-ttl')
+EVPOOL_SIZE = 16
+MAXMEMORY_SAMPLES = 5
+
+maxmemory = 0                 # bytes, 0 for no limit
+policy = 'noeviction'
+samples = MAXMEMORY_SAMPLES
+propagate_hook = None         # propagate_hook(key): send DEL to the AOF and replicas
+
+stats = {
+    'evicted_keys': 0,
+}
+
+_pool = []   # [(score, key)] ascending by score: the best candidate is last
+
+
+def configure(limit: int, policy_name: str, n_samples: int = MAXMEMORY_SAMPLES) -> None:
+    """Must run before the dataset is loaded, so entries get the access data the policy needs."""
+    global maxmemory, policy, samples
+    maxmemory, policy, samples = limit, policy_name, max(1, n_samples)
+    keyspace.access_mode = 'lfu' if policy.endswith('-lfu') else 'lru'
+    _pool.clear()
+
+def over_limit() -> bool:
+    return bool(maxmemory) and keyspace.db.used_memory > maxmemory
+
+def _score(key: bytes, entry) -> int:
+    """Higher is a better candidate for eviction."""
+    if policy == 'volatile-ttl':
+        return -expires.get(key)
+    if policy == 'allkeys-lfu':
+        return 255 - keyspace.lfu_counter(entry.lru)
+    # The older the last access the better; unlike idle time this does not age in the pool
+    return -entry.lru
+
+def _populate_pool() -> None:
+    volatile = policy.startswith('volatile-')
+    for _ in range(samples):
+        if volatile:
+            if not len(expires):
+                return
+            key = expires.random_key()
+        else:
+            key = keyspace.db.random_key()
+            if key is None:
+                return
+        entry = keyspace.db.get(key)
+        if entry is None or any(k == key for _, k in _pool):
+            continue
+        score = _score(key, entry)
+        if len(_pool) >= EVPOOL_SIZE:
+            if score <= _pool[0][0]:
+                continue
+            _pool.pop(0)
+        i = 0
+        while i < len(_pool) and _pool[i][0] < score:
+            i += 1
+        _pool.insert(i, (score, key))
+
+def _pick() -> Optional[bytes]:
+    _populate_pool()
+    volatile = policy.startswith('volatile-')
+    while _pool:
+        _, key = _pool.pop()
+        # The pool may hold keys deleted (or made persistent) since they were sampled
+        if key in keyspace.db and (not volatile or key in expires):
+            return key
+    return None
+
+def perform_evictions() -> bool:
+    """Evict until used memory is under maxmemory. Returns False if it still is not."""
+    if not over_limit():
+        return True
+    if policy == 'noeviction':
+        return False
+    while over_limit():
+        key = _pick()
+        if key is None:
+            return False
+        keyspace.delete(key)
+        stats['evicted_keys'] += 1
+        if propagate_hook is not None:
+            propagate_hook(key)
+    return True
+
+def info() -> dict:
+    used = keyspace.db.used_memory
+    return {
+        'used_memory': used,
+        'used_memory_human': _human(used),
+        'used_memory_rss': _rss(),
+        'maxmemory': maxmemory,
+        'maxmemory_human': _human(maxmemory),
+        'maxmemory_policy': policy,
+    }
+
+def _human(n: int) -> str:
+    for unit in ('B', 'K', 'M', 'G'):
+        if n < 1024 or unit == 'G':
+            return f"{n}{unit}" if unit == 'B' else f"{n:.2f}{unit}"
+        n /= 1024
+
+def _rss() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
@@ -0,0 +1,155 @@
+"""
+Key expiry shared by every data type.
+
+Expire times live in one table next to the values, like Redis' db->expires:
+a dict key -> unix time in ms plus a list of the same keys. Setting a TTL
+replaces the old one in place, so nothing stale piles up, and the active
+cycle can draw random keys in O(1).
+
+Keys are expired in two ways:
+  - lazily, when a command touches a key whose time has passed
+  - actively, by active_expire_cycle(), which samples keys with a TTL a few
+    times per second and keeps going while many of them turn out expired,
+    within a time budget per cycle
+Removing the value from its store and propagating the DEL are done through
+delete_hook and propagate_hook, installed by the keyspace and the server.
+"""
+import asyncio
+import random
+import time
+from typing import Optional
+
+ACTIVE_EXPIRE_CYCLE_HZ = 10
+ACTIVE_EXPIRE_CYCLE_KEYS_PER_LOOP = 20
+ACTIVE_EXPIRE_CYCLE_ACCEPTABLE_STALE = 10     # % of expired keys in a sample that ends the cycle
+ACTIVE_EXPIRE_CYCLE_SLOW_TIME_PERC = 25       # % of the cycle period the cycle may use
+# Expire times are signed 64-bit unix ms, as in Redis, so they fit the RDB and the AOF
+EXPIRE_MAX_MS = (1 << 63) - 1
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class ExpireTable:
+    __slots__ = ('_when', '_keys', '_pos')
+
+    def __init__(self):
+        self._when = {}   # key -> unix ms
+        self._keys = []   # keys with a TTL, for random sampling
+        self._pos = {}    # key -> index in _keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key) -> bool:
+        return key in self._when
+
+    def get(self, key: bytes) -> Optional[int]:
+        return self._when.get(key)
+
+    def set(self, key: bytes, when_ms: int) -> None:
+        if key not in self._when:
+            self._pos[key] = len(self._keys)
+            self._keys.append(key)
+        self._when[key] = when_ms
+
+    def remove(self, key: bytes) -> bool:
+        if self._when.pop(key, None) is None:
+            return False
+        # Swap the last key into the hole so removal stays O(1)
+        i = self._pos.pop(key)
+        last = self._keys.pop()
+        if i < len(self._keys):
+            self._keys[i] = last
+            self._pos[last] = i
+        return True
+
+    def random_key(self) -> bytes:
+        return self._keys[random.randrange(len(self._keys))]
+
+    def items(self):
+        return self._when.items()
+
+    def clear(self) -> None:
+        self._when.clear()
+        self._keys.clear()
+        self._pos.clear()
+
+
+expires = ExpireTable()
+
+# Installed by the owners of the values and of the replication stream
+delete_hook = None        # delete_hook(key): remove the value from its store
+propagate_hook = None     # propagate_hook(key): send DEL to the AOF and replicas
+
+# Replicas never delete on their own; they wait for the master's DEL
+active = True
+# Nothing expires while the AOF is replayed, or a later command could miss its key
+loading = False
+
+stats = {
+    'expired_keys': 0,
+    'expired_stale_perc': 0.0,
+    'expired_time_cap_reached_count': 0,
+}
+
+
+def is_expired(key: bytes) -> bool:
+    if loading:
+        return False
+    when = expires._when.get(key)
+    return when is not None and when <= now_ms()
+
+def expire_if_needed(key: bytes) -> bool:
+    """Lazy expiry: delete key if its time has passed. Returns True if it is logically gone."""
+    if not is_expired(key):
+        return False
+    if active:
+        expire_key(key)
+    return True
+
+def expire_key(key: bytes) -> None:
+    expires.remove(key)
+    delete_hook(key)
+    stats['expired_keys'] += 1
+    if propagate_hook is not None:
+        propagate_hook(key)
+
+def active_expire_cycle(time_limit: float) -> None:
+    """
+    Sample keys with a TTL and delete the expired ones. Repeats while more than
+    ACCEPTABLE_STALE percent of a sample was expired, but never for longer
+    than time_limit seconds.
+    """
+    started = time.perf_counter()
+    sampled_total = expired_total = 0
+    while len(expires):
+        now = now_ms()
+        sampled = min(ACTIVE_EXPIRE_CYCLE_KEYS_PER_LOOP, len(expires))
+        expired = 0
+        for _ in range(sampled):
+            if not len(expires):
+                break
+            key = expires.random_key()
+            if expires.get(key) <= now:
+                expire_key(key)
+                expired += 1
+        sampled_total += sampled
+        expired_total += expired
+        if expired * 100 <= sampled * ACTIVE_EXPIRE_CYCLE_ACCEPTABLE_STALE:
+            break
+        if time.perf_counter() - started > time_limit:
+            stats['expired_time_cap_reached_count'] += 1
+            break
+    if sampled_total:
+        # Running average of how stale the sampled keys were, as in Redis
+        current = expired_total / sampled_total * 100
+        stats['expired_stale_perc'] = round(stats['expired_stale_perc'] * 0.95 + current * 0.05, 2)
+
+async def active_expire_loop() -> None:
+    period = 1 / ACTIVE_EXPIRE_CYCLE_HZ
+    time_limit = period * ACTIVE_EXPIRE_CYCLE_SLOW_TIME_PERC / 100
+    while True:
+        await asyncio.sleep(period)
+        if active:
+            active_expire_cycle(time_limit)
@@ -0,0 +1,360 @@
+"""
+The keyspace: one dict from key to a typed Entry for every data type, so a
+command costs a single hash lookup and type checks happen in one place.
+TTLs are kept next to it in data_type.expires.
+
+Besides the dict, the keyspace records the order keys were added in a slot
+list, each slot tagged with an increasing sequence number. SCAN cursors are
+sequence numbers: a scan resumes with a binary search, visits COUNT slots and
+never copies the key set. Slots of deleted keys are left as holes and squeezed
+out once they make up half the list; compaction keeps the order, so a cursor
+still points at the right place and every key present for the whole scan is
+returned exactly once. Keys added during a scan land after it and may or may
+not be seen, as in Redis.
+
+For maxmemory and MEMORY STATS the keyspace also keeps:
+  - used_memory, an estimate of the bytes held by keys and values, updated on
+    every write rather than measured, and the same split per encoding.
+    Aggregates (lists, sets, hashes, sorted sets, streams) keep their own running size in `mem` and
+    report growth and encoding conversions through db.grow() / db.convert().
+  - on each entry, the access data the eviction policies sample: the last
+    access time in ms, or under an LFU policy Redis' packed form
+    (minutes of the last decrement << 8 | logarithmic access counter)
+"""
+import random
+import re
+import time
+from array import array
+from bisect import bisect_left
+from typing import Iterator, List, Optional, Tuple
+import data_type.expires as expiry
+import data_type.blocking as blocking
+
+KEYSPACE_MIN_COMPACT_HOLES = 1024
+SCAN_DEFAULT_COUNT = 10
+# Estimated bytes per key for the dict slot, Entry object and scan slot, and per bytes/int object
+ENTRY_OVERHEAD = 160
+BYTES_OVERHEAD = 33
+INT_SIZE = 32
+# Strings holding a small integer share one int object, like Redis' shared integers
+OBJ_SHARED_INTEGERS = 10000
+OBJ_ENCODING_EMBSTR_SIZE_LIMIT = 44
+LFU_INIT_VAL = 5
+LFU_LOG_FACTOR = 10
+LFU_DECAY_TIME = 1   # minutes for the access counter to lose one
+
+# 'lfu' under the allkeys-lfu policy, set before any key is created
+access_mode = 'lru'
+
+
+class WrongTypeError(Exception):
+    """The key holds a value of another type than the command works on."""
+
+
+LRU_CLOCK_RESOLUTION = 1000   # ms
+
+_clock = 0
+
+def lru_clock() -> int:
+    """
+    The access clock in LRU_CLOCK_RESOLUTION units. The same int object is
+    returned until it ticks, so entries touched in the same tick share it.
+    """
+    global _clock
+    now = int(time.monotonic() * 1000) // LRU_CLOCK_RESOLUTION
+    if now != _clock:
+        _clock = now
+    return _clock
+
+def _lfu_minutes() -> int:
+    return int(time.monotonic() // 60) & 0xFFFF
+
+def lfu_counter(lru: int) -> int:
+    """The access counter of a packed LFU value, decayed by the minutes since it was last updated."""
+    elapsed = (_lfu_minutes() - (lru >> 8)) & 0xFFFF
+    return max(0, (lru & 0xFF) - elapsed // LFU_DECAY_TIME)
+
+def _lfu_log_incr(counter: int) -> int:
+    # The counter grows logarithmically: the more hits it has, the less likely one increments it
+    if counter < 255 and random.random() < 1.0 / ((max(0, counter - LFU_INIT_VAL)) * LFU_LOG_FACTOR + 1):
+        counter += 1
+    return counter
+
+def _initial_access() -> int:
+    return (_lfu_minutes() << 8) | LFU_INIT_VAL if access_mode == 'lfu' else lru_clock()
+
+def touch(entry: 'Entry') -> None:
+    if access_mode == 'lfu':
+        entry.lru = (_lfu_minutes() << 8) | _lfu_log_incr(lfu_counter(entry.lru))
+    else:
+        entry.lru = lru_clock()
+
+_shared_integers = list(range(OBJ_SHARED_INTEGERS))
+
+def shared_int(num: int) -> int:
+    return _shared_integers[num] if 0 <= num < OBJ_SHARED_INTEGERS else num
+
+def value_size(entry: 'Entry') -> int:
+    value = entry.value
+    if entry.kind != 'string':
+        return value.mem
+    if isinstance(value, int):
+        return 0 if 0 <= value < OBJ_SHARED_INTEGERS else INT_SIZE
+    return BYTES_OVERHEAD + len(value)
+
+def key_overhead(key: bytes) -> int:
+    """Estimated bytes a key costs besides its value."""
+    return ENTRY_OVERHEAD + BYTES_OVERHEAD + len(key)
+
+def encoding(entry: 'Entry') -> str:
+    """The encoding name OBJECT ENCODING reports for the value."""
+    value = entry.value
+    if entry.kind != 'string':
+        return value.encoding
+    if isinstance(value, int):
+        return 'int'
+    # Bitmaps are bytearrays, written in place like Redis' raw strings
+    if isinstance(value, bytearray) or len(value) > OBJ_ENCODING_EMBSTR_SIZE_LIMIT:
+        return 'raw'
+    return 'embstr'
+
+
+class Entry:
+    __slots__ = ('kind', 'value', 'slot', 'lru')
+
+    def __init__(self, kind: str, value):
+        self.kind = kind      # 'string', 'list', 'set', 'hash', 'zset' or 'stream', as reported by TYPE
+        self.value = value
+        self.slot = -1        # index in Keyspace._slots
+        self.lru = _initial_access()
+
+
+class Keyspace:
+    def __init__(self):
+        self._dict = {}          # key -> Entry
+        self._slots = []         # keys in the order they were added, None where one was deleted
+        self._seqs = array('q')  # scan sequence number of each slot, ascending
+        self._next_seq = 1       # 0 is the cursor that starts a scan
+        self._holes = 0
+        self.used_memory = 0
+        self.encodings = {}      # encoding -> [keys, value bytes]
+
+    def __len__(self) -> int:
+        return len(self._dict)
+
+    def __contains__(self, key) -> bool:
+        return key in self._dict
+
+    def get(self, key: bytes) -> Optional[Entry]:
+        return self._dict.get(key)
+
+    def set(self, key: bytes, entry: Entry) -> None:
+        old = self._dict.get(key)
+        if old is not None:
+            # Overwriting keeps the key's place in the scan order
+            entry.slot = old.slot
+            self._count_value(old, -1)
+        else:
+            entry.slot = len(self._slots)
+            self._slots.append(key)
+            self._seqs.append(self._next_seq)
+            self._next_seq += 1
+            self.used_memory += key_overhead(key)
+        self._count_value(entry, 1)
+        self._dict[key] = entry
+
+    def pop(self, key: bytes) -> Optional[Entry]:
+        entry = self._dict.pop(key, None)
+        if entry is not None:
+            self.used_memory -= key_overhead(key)
+            self._count_value(entry, -1)
+            self._slots[entry.slot] = None
+            self._holes += 1
+            if self._holes > KEYSPACE_MIN_COMPACT_HOLES and self._holes * 2 > len(self._slots):
+                self._compact()
+        return entry
+
+    def _count_value(self, entry: Entry, sign: int) -> None:
+        size = value_size(entry)
+        self.used_memory += sign * size
+        stats = self.encodings.setdefault(encoding(entry), [0, 0])
+        stats[0] += sign
+        stats[1] += sign * size
+
+    def grow(self, encoding_name: str, delta: int) -> None:
+        """An aggregate stored here changed size in place by delta bytes."""
+        self.used_memory += delta
+        self.encodings[encoding_name][1] += delta
+
+    def convert(self, old_encoding: str, old_size: int, new_encoding: str, new_size: int) -> None:
+        """An aggregate stored here switched encodings."""
+        self.used_memory += new_size - old_size
+        old = self.encodings[old_encoding]
+        old[0] -= 1
+        old[1] -= old_size
+        new = self.encodings.setdefault(new_encoding, [0, 0])
+        new[0] += 1
+        new[1] += new_size
+
+    def _compact(self) -> None:
+        slots, seqs = [], array('q')
+        for key, seq in zip(self._slots, self._seqs):
+            if key is not None:
+                self._dict[key].slot = len(slots)
+                slots.append(key)
+                seqs.append(seq)
+        self._slots, self._seqs, self._holes = slots, seqs, 0
+
+    def items(self):
+        return self._dict.items()
+
+    def keys(self):
+        return self._dict.keys()
+
+    def clear(self) -> None:
+        self._dict.clear()
+        self._slots.clear()
+        self._seqs = array('q')
+        self._holes = 0
+        self.used_memory = 0
+        self.encodings.clear()
+
+    def random_key(self) -> Optional[bytes]:
+        """A key drawn uniformly at random, for the eviction sampler."""
+        if not self._dict:
+            return None
+        while True:
+            # Holes are at most half of the slots (or few), so this rarely loops
+            key = self._slots[random.randrange(len(self._slots))]
+            if key is not None:
+                return key
+
+    def scan(self, cursor: int, count: int) -> Tuple[int, List[bytes]]:
+        """Visit up to count slots from cursor. Returns the next cursor (0 when done) and the keys seen."""
+        i = bisect_left(self._seqs, cursor)
+        end = min(i + count, len(self._slots))
+        keys = [key for key in self._slots[i:end] if key is not None]
+        return (self._seqs[end] if end < len(self._slots) else 0), keys
+
+db = Keyspace()
+
+
+def lookup(key: bytes, notouch: bool = False) -> Optional[Entry]:
+    """
+    The entry for key, or None if it does not exist or has expired. Counts as an
+    access for eviction unless notouch (TYPE, EXISTS, SCAN only look at the key).
+    """
+    if expiry.expire_if_needed(key):
+        return None
+    entry = db.get(key)
+    if entry is not None and not notouch:
+        touch(entry)
+    return entry
+
+def lookup_value(key: bytes, kind: str):
+    """The value of key if it holds a `kind`, None if it does not exist. Raises WrongTypeError."""
+    entry = lookup(key)
+    if entry is None:
+        return None
+    if entry.kind != kind:
+        raise WrongTypeError()
+    return entry.value
+
+def store(key: bytes, kind: str, value) -> None:
+    """Add key, or replace its value. The TTL is left to the caller."""
+    db.set(key, Entry(kind, value))
+
+def exists(key: bytes) -> bool:
+    return lookup(key, notouch=True) is not None
+
+def key_type(key: bytes) -> str:
+    entry = lookup(key, notouch=True)
+    return entry.kind if entry is not None else 'none'
+
+def delete(key: bytes) -> bool:
+    """Remove key together with its TTL. Returns False if it did not exist (or had expired)."""
+    existed = not expiry.is_expired(key)
+    expiry.expires.remove(key)
+    return _remove_value(key) and existed
+
+def _remove_value(key: bytes) -> bool:
+    return db.pop(key) is not None
+
+def rename(src: bytes, dst: bytes) -> bool:
+    """Move src and its TTL to dst, replacing dst. Returns False if src does not exist."""
+    entry = lookup(src)
+    if entry is None:
+        return False
+    when = expiry.expires.get(src)
+    if src != dst:
+        delete(dst)
+        delete(src)
+        store(dst, entry.kind, entry.value)
+        if when is not None:
+            expiry.expires.set(dst, when)
+        # Clients blocked on dst may be able to pop from it now
+        blocking.signal(dst)
+    return True
+
+def count() -> int:
+    return len(db)
+
+def compile_pattern(pattern: bytes) -> re.Pattern:
+    """
+    Translate a Redis glob-style pattern (*, ?, [abc], [^a-z], \\x escapes)
+    into a compiled regex matching the whole key.
+    """
+    out = bytearray()
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i:i + 1]
+        i += 1
+        if c == b'*':
+            out += b'.*'
+        elif c == b'?':
+            out += b'.'
+        elif c == b'\\' and i < n:
+            out += re.escape(pattern[i:i + 1])
+            i += 1
+        elif c == b'[':
+            j = i
+            negate = j < n and pattern[j:j + 1] == b'^'
+            if negate:
+                j += 1
+            members = bytearray()
+            while j < n and pattern[j:j + 1] != b']':
+                if pattern[j:j + 1] == b'\\' and j + 1 < n:
+                    members += re.escape(pattern[j + 1:j + 2])
+                    j += 2
+                elif pattern[j + 1:j + 2] == b'-' and j + 2 < n and pattern[j + 2:j + 3] != b']':
+                    lo, hi = sorted((pattern[j:j + 1], pattern[j + 2:j + 3]))
+                    members += re.escape(lo) + b'-' + re.escape(hi)
+                    j += 3
+                else:
+                    members += re.escape(pattern[j:j + 1])
+                    j += 1
+            if j >= n:
+                # No closing bracket: Redis matches the rest literally
+                out += re.escape(pattern[i - 1:])
+                break
+            if members:
+                out += b'[' + (b'^' if negate else b'') + bytes(members) + b']'
+            else:
+                out += b'.' if negate else b'(?!)'
+            i = j + 1
+        else:
+            out += re.escape(c)
+    return re.compile(bytes(out) + rb'\Z', re.DOTALL)
+
+def iter_keys(pattern: Optional[bytes] = None) -> Iterator[bytes]:
+    """Live keys matching pattern, for KEYS."""
+    match = compile_pattern(pattern).match if pattern not in (None, b'*') else None
+    now = expiry.now_ms()
+    for key in db.keys():
+        when = expiry.expires.get(key)
+        if when is not None and when <= now:
+            continue
+        if match is None or match(key):
+            yield key
+
+expiry.delete_hook = _remove_value
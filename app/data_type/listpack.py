@@ -0,0 +1,319 @@
+"""
+Listpack encoding as used by Redis for small aggregates and stream nodes.
+
+  <total-bytes:u32le> <num-elements:u16le> <entry> ... <entry> <0xFF>
+  entry = <encoding+data> <backlen>
+
+Elements are bytes or ints; strings that are canonical integers are stored
+with the integer encodings, exactly like lpAppend() does.
+"""
+from typing import List, Union
+
+LP_HDR_SIZE = 6
+LP_EOF = 0xFF
+LP_NUMELE_UNKNOWN = 65535
+
+Element = Union[bytes, int]
+
+
+def string_to_int(value: bytes):
+    """Return the int for a canonical decimal string that fits in 64 bits, else None."""
+    if not 0 < len(value) <= 20:
+        return None
+    try:
+        num = int(value)
+    except ValueError:
+        return None
+    # Reject non-canonical forms such as "007", "+7", " 7" or "1_0"
+    if not -(1 << 63) <= num < (1 << 63) or b"%d" % num != value:
+        return None
+    return num
+
+
+def _encode_backlen(length: int) -> bytes:
+    if length <= 127:
+        return bytes((length,))
+    if length < 16383:
+        return bytes((length >> 7, (length & 127) | 128))
+    if length < 2097151:
+        return bytes((length >> 14, ((length >> 7) & 127) | 128, (length & 127) | 128))
+    if length < 268435455:
+        return bytes((length >> 21, ((length >> 14) & 127) | 128, ((length >> 7) & 127) | 128,
+                      (length & 127) | 128))
+    return bytes((length >> 28, ((length >> 21) & 127) | 128, ((length >> 14) & 127) | 128,
+                  ((length >> 7) & 127) | 128, (length & 127) | 128))
+
+
+def _backlen_size(length: int) -> int:
+    if length <= 127:
+        return 1
+    if length < 16383:
+        return 2
+    if length < 2097151:
+        return 3
+    if length < 268435455:
+        return 4
+    return 5
+
+
+def encode_element(value: Element) -> bytes:
+    """Encode one listpack entry, including its backlen."""
+    if not isinstance(value, int):
+        num = string_to_int(value)
+        if num is not None:
+            value = num
+    if isinstance(value, int):
+        if 0 <= value <= 127:
+            enc = bytes((value,))
+        elif -4096 <= value <= 4095:
+            v = value & 0x1FFF
+            enc = bytes((0xC0 | (v >> 8), v & 0xFF))
+        elif -32768 <= value <= 32767:
+            enc = b"\xf1" + value.to_bytes(2, 'little', signed=True)
+        elif -8388608 <= value <= 8388607:
+            enc = b"\xf2" + value.to_bytes(3, 'little', signed=True)
+        elif -2147483648 <= value <= 2147483647:
+            enc = b"\xf3" + value.to_bytes(4, 'little', signed=True)
+        else:
+            enc = b"\xf4" + value.to_bytes(8, 'little', signed=True)
+    else:
+        n = len(value)
+        if n < 64:
+            enc = bytes((0x80 | n,)) + value
+        elif n < 4096:
+            enc = bytes((0xE0 | (n >> 8), n & 0xFF)) + value
+        else:
+            enc = b"\xf0" + n.to_bytes(4, 'little') + value
+    return enc + _encode_backlen(len(enc))
+
+
+def encode(elements) -> bytes:
+    """Build a complete listpack from an iterable of elements."""
+    body = bytearray()
+    count = 0
+    for element in elements:
+        body += encode_element(element)
+        count += 1
+    total = LP_HDR_SIZE + len(body) + 1
+    return (total.to_bytes(4, 'little')
+            + min(count, LP_NUMELE_UNKNOWN).to_bytes(2, 'little')
+            + bytes(body) + b"\xff")
+
+
+def _decode_entry(buf, pos: int):
+    """Decode the entry at pos. Returns (value, next_pos)."""
+    b = buf[pos]
+    if b < 0x80:                       # 7 bit uint
+        value, size = b, 1
+    elif b < 0xC0:                     # 6 bit string length
+        n = b & 0x3F
+        value, size = bytes(buf[pos + 1:pos + 1 + n]), 1 + n
+    elif b < 0xE0:                     # 13 bit int
+        v = ((b & 0x1F) << 8) | buf[pos + 1]
+        value, size = (v - 0x2000 if v & 0x1000 else v), 2
+    elif b < 0xF0:                     # 12 bit string length
+        n = ((b & 0x0F) << 8) | buf[pos + 1]
+        value, size = bytes(buf[pos + 2:pos + 2 + n]), 2 + n
+    elif b == 0xF0:                    # 32 bit string length
+        n = int.from_bytes(buf[pos + 1:pos + 5], 'little')
+        value, size = bytes(buf[pos + 5:pos + 5 + n]), 5 + n
+    elif b == 0xF1:
+        value, size = int.from_bytes(buf[pos + 1:pos + 3], 'little', signed=True), 3
+    elif b == 0xF2:
+        value, size = int.from_bytes(buf[pos + 1:pos + 4], 'little', signed=True), 4
+    elif b == 0xF3:
+        value, size = int.from_bytes(buf[pos + 1:pos + 5], 'little', signed=True), 5
+    elif b == 0xF4:
+        value, size = int.from_bytes(buf[pos + 1:pos + 9], 'little', signed=True), 9
+    else:
+        raise ValueError(f"invalid listpack encoding byte 0x{b:02x}")
+    return value, pos + size + _backlen_size(size)
+
+
+def _entry_size(buf, pos: int) -> int:
+    """Bytes taken by the entry at pos, backlen included, without decoding it."""
+    b = buf[pos]
+    if b < 0x80:
+        size = 1
+    elif b < 0xC0:
+        size = 1 + (b & 0x3F)
+    elif b < 0xE0:
+        size = 2
+    elif b < 0xF0:
+        size = 2 + (((b & 0x0F) << 8) | buf[pos + 1])
+    elif b == 0xF0:
+        size = 5 + int.from_bytes(buf[pos + 1:pos + 5], 'little')
+    elif b <= 0xF4:
+        size = (3, 4, 5, 9)[b - 0xF1]
+    else:
+        raise ValueError(f"invalid listpack encoding byte 0x{b:02x}")
+    return size + _backlen_size(size)
+
+
+def iter_elements(buf):
+    """Iterate over the elements of a listpack (ints for integer-encoded entries)."""
+    pos = LP_HDR_SIZE
+    end = len(buf)
+    while pos < end and buf[pos] != LP_EOF:
+        value, pos = _decode_entry(buf, pos)
+        yield value
+
+
+def decode(buf) -> List[Element]:
+    return list(iter_elements(buf))
+
+
+def as_bytes(value: Element) -> bytes:
+    return b"%d" % value if isinstance(value, int) else value
+
+
+def _entry_start(buf, end: int) -> int:
+    """Start of the entry whose backlen ends just before end, read right to left."""
+    length, shift, pos = 0, 0, end - 1
+    while True:
+        b = buf[pos]
+        length |= (b & 127) << shift
+        shift += 7
+        pos -= 1
+        if not b & 128:
+            break
+    return pos + 1 - length
+
+
+class Listpack:
+    """
+    A mutable listpack: the elements of a small list packed back to back in one
+    bytearray, the way Redis stores small aggregates, instead of one object per
+    element. The buffer is always a valid listpack. Pushing and popping at either
+    end edit the buffer in place; indexing walks it from the nearer end, which is
+    cheap at the sizes this encoding is used for. Elements are returned as bytes.
+    """
+    __slots__ = ('_buf', '_count')
+
+    def __init__(self, elements=()):
+        self._buf = bytearray(encode(()))
+        self._count = 0
+        for element in elements:
+            self.append(element)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self):
+        for value in iter_elements(self._buf):
+            yield as_bytes(value)
+
+    def _index(self, index: int) -> int:
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("listpack index out of range")
+        return index
+
+    def _seek(self, index: int) -> int:
+        """Byte offset of entry index (0 <= index <= count; count is the end marker)."""
+        buf = self._buf
+        if index * 2 <= self._count:
+            pos = LP_HDR_SIZE
+            for _ in range(index):
+                pos += _entry_size(buf, pos)
+        else:
+            pos = len(buf) - 1
+            for _ in range(self._count - index):
+                pos = _entry_start(buf, pos)
+        return pos
+
+    def __getitem__(self, index: int) -> bytes:
+        return as_bytes(_decode_entry(self._buf, self._seek(self._index(index)))[0])
+
+    def __setitem__(self, index: int, value: bytes) -> None:
+        pos = self._seek(self._index(index))
+        self._buf[pos:pos + _entry_size(self._buf, pos)] = encode_element(value)
+        self._update_header(0)
+
+    def slice(self, start: int, stop: int) -> List[bytes]:
+        """Elements start to stop - 1, with 0 <= start <= stop <= len."""
+        buf = self._buf
+        pos = self._seek(start)
+        out = []
+        for _ in range(stop - start):
+            value, pos = _decode_entry(buf, pos)
+            out.append(as_bytes(value))
+        return out
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._buf)
+
+    def _update_header(self, delta: int) -> None:
+        self._count += delta
+        self._buf[0:LP_HDR_SIZE] = (len(self._buf).to_bytes(4, 'little')
+                                    + min(self._count, LP_NUMELE_UNKNOWN).to_bytes(2, 'little'))
+
+    def append(self, value: bytes) -> None:
+        end = len(self._buf) - 1
+        self._buf[end:end] = encode_element(value)
+        self._update_header(1)
+
+    def appendleft(self, value: bytes) -> None:
+        self._buf[LP_HDR_SIZE:LP_HDR_SIZE] = encode_element(value)
+        self._update_header(1)
+
+    def extend(self, values) -> None:
+        encoded = [encode_element(value) for value in values]
+        end = len(self._buf) - 1
+        self._buf[end:end] = b"".join(encoded)
+        self._update_header(len(encoded))
+
+    def find(self, value: bytes, skip: int = 0) -> int:
+        """
+        Index of the first entry equal to value among entries 0, skip + 1, 2 * (skip + 1)...,
+        -1 if there is none. Entries are compared encoded, so nothing is decoded.
+        """
+        target = encode_element(value)
+        buf = self._buf
+        pos = LP_HDR_SIZE
+        for index in range(self._count):
+            size = _entry_size(buf, pos)
+            if index % (skip + 1) == 0 and buf[pos:pos + size] == target:
+                return index
+            pos += size
+        return -1
+
+    def insert(self, index: int, value: bytes) -> None:
+        """Insert value before entry index (0 <= index <= len)."""
+        pos = self._seek(index)
+        self._buf[pos:pos] = encode_element(value)
+        self._update_header(1)
+
+    def delete_range(self, start: int, count: int) -> None:
+        """Remove count entries from entry start on."""
+        if count <= 0:
+            return
+        buf = self._buf
+        pos = end = self._seek(start)
+        for _ in range(count):
+            end += _entry_size(buf, end)
+        del buf[pos:end]
+        self._update_header(-count)
+
+    def popleft(self) -> bytes:
+        if not self._count:
+            raise IndexError("pop from an empty listpack")
+        value, end = _decode_entry(self._buf, LP_HDR_SIZE)
+        del self._buf[LP_HDR_SIZE:end]
+        self._update_header(-1)
+        return as_bytes(value)
+
+    def pop(self) -> bytes:
+        if not self._count:
+            raise IndexError("pop from an empty listpack")
+        end = len(self._buf) - 1
+        start = _entry_start(self._buf, end)
+        value = _decode_entry(self._buf, start)[0]
+        del self._buf[start:end]
+        self._update_header(-1)
+        return as_bytes(value)
+
+    def tobytes(self) -> bytes:
+        return bytes(self._buf)
@@ -0,0 +1,220 @@
+"""
+Quicklist: the encoding of lists too large for one listpack.
+
+The elements are split over a chain of listpack nodes of bounded size, as in
+Redis' quicklist. Next to the nodes we keep the position of each node's first
+element in `starts`, in the same coordinates as `head`, the position of
+element 0. Pushing or popping on the left only moves head and the first start,
+so the index stays sorted without rewriting it, and element i is found with a
+bisect on head + i: LINDEX, LSET and LRANGE cost O(log n) to find the node
+plus a walk of at most one node. LTRIM drops whole nodes from either end.
+Inserting in the middle shifts the starts on whichever side of the node is
+shorter.
+"""
+from bisect import bisect_right
+from typing import List
+from data_type.listpack import Listpack
+
+# A node takes no more elements once it has this many or this many bytes, like
+# list-max-listpack-size -2; a larger element gets a node of its own
+QUICKLIST_NODE_MAX_ENTRIES = 128
+QUICKLIST_NODE_MAX_BYTES = 8192
+
+
+class Quicklist:
+    __slots__ = ('nodes', 'starts', 'head', 'count', 'nbytes')
+
+    def __init__(self, elements=()):
+        self.nodes: List[Listpack] = []
+        self.starts: List[int] = []   # position of each node's first element
+        self.head = 0                 # position of element 0
+        self.count = 0
+        self.nbytes = 0               # bytes of all node buffers
+        self.extend(elements)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self):
+        for node in self.nodes:
+            yield from node
+
+    def _fits(self, node: Listpack, value: bytes) -> bool:
+        return len(node) < QUICKLIST_NODE_MAX_ENTRIES and node.nbytes + len(value) <= QUICKLIST_NODE_MAX_BYTES
+
+    def _add_node(self, i: int, start: int, node: Listpack = None) -> Listpack:
+        node = node if node is not None else Listpack()
+        self.nodes.insert(i, node)
+        self.starts.insert(i, start)
+        self.nbytes += node.nbytes
+        return node
+
+    def _drop_nodes(self, i: int, j: int) -> None:
+        self.nbytes -= sum(node.nbytes for node in self.nodes[i:j])
+        del self.nodes[i:j]
+        del self.starts[i:j]
+
+    def _locate(self, index: int):
+        """(node number, offset in the node) of element index, 0 <= index < count."""
+        pos = self.head + index
+        i = bisect_right(self.starts, pos) - 1
+        return i, pos - self.starts[i]
+
+    def _shift(self, i: int, delta: int) -> None:
+        """Node i grew by delta elements in the middle: move the starts of the shorter side."""
+        if i * 2 < len(self.nodes):
+            for j in range(i + 1):
+                self.starts[j] -= delta
+            self.head -= delta
+        else:
+            for j in range(i + 1, len(self.starts)):
+                self.starts[j] += delta
+
+    def append(self, value: bytes) -> None:
+        if not self.nodes or not self._fits(self.nodes[-1], value):
+            self._add_node(len(self.nodes), self.head + self.count)
+        node = self.nodes[-1]
+        before = node.nbytes
+        node.append(value)
+        self.nbytes += node.nbytes - before
+        self.count += 1
+
+    def extend(self, values) -> None:
+        """Append values, filling each node in one go."""
+        node = self.nodes[-1] if self.nodes else None
+        batch, size = [], 0
+        for value in values:
+            if node is None or (len(node) + len(batch) >= QUICKLIST_NODE_MAX_ENTRIES
+                                or (len(node) + len(batch) and node.nbytes + size + len(value) > QUICKLIST_NODE_MAX_BYTES)):
+                self._fill(node, batch)
+                node = self._add_node(len(self.nodes), self.head + self.count)
+                batch, size = [], 0
+            batch.append(value)
+            size += len(value)
+        self._fill(node, batch)
+
+    def _fill(self, node: Listpack, batch: List[bytes]) -> None:
+        if batch:
+            before = node.nbytes
+            node.extend(batch)
+            self.nbytes += node.nbytes - before
+            self.count += len(batch)
+
+    def appendleft(self, value: bytes) -> None:
+        if not self.nodes or not self._fits(self.nodes[0], value):
+            self._add_node(0, self.head)
+        node = self.nodes[0]
+        before = node.nbytes
+        node.appendleft(value)
+        self.nbytes += node.nbytes - before
+        self.starts[0] -= 1
+        self.head -= 1
+        self.count += 1
+
+    def pop(self) -> bytes:
+        if not self.count:
+            raise IndexError("pop from an empty quicklist")
+        node = self.nodes[-1]
+        before = node.nbytes
+        value = node.pop()
+        self.nbytes += node.nbytes - before
+        self.count -= 1
+        if not len(node):
+            self._drop_nodes(len(self.nodes) - 1, len(self.nodes))
+        return value
+
+    def popleft(self) -> bytes:
+        if not self.count:
+            raise IndexError("pop from an empty quicklist")
+        node = self.nodes[0]
+        before = node.nbytes
+        value = node.popleft()
+        self.nbytes += node.nbytes - before
+        self.starts[0] += 1
+        self.head += 1
+        self.count -= 1
+        if not len(node):
+            self._drop_nodes(0, 1)
+        return value
+
+    def __getitem__(self, index: int) -> bytes:
+        i, offset = self._locate(index)
+        return self.nodes[i][offset]
+
+    def __setitem__(self, index: int, value: bytes) -> None:
+        i, offset = self._locate(index)
+        node = self.nodes[i]
+        before = node.nbytes
+        node[offset] = value
+        self.nbytes += node.nbytes - before
+
+    def range(self, start: int, stop: int) -> List[bytes]:
+        """Elements start to stop - 1, with 0 <= start <= stop <= count."""
+        out = []
+        if start >= stop:
+            return out
+        i, offset = self._locate(start)
+        remaining = stop - start
+        while remaining:
+            node = self.nodes[i]
+            take = min(len(node) - offset, remaining)
+            out += node.slice(offset, offset + take)
+            remaining -= take
+            i += 1
+            offset = 0
+        return out
+
+    def find(self, value: bytes) -> int:
+        """Index of the first element equal to value, -1 if there is none."""
+        for node, start in zip(self.nodes, self.starts):
+            for offset, element in enumerate(node):
+                if element == value:
+                    return start - self.head + offset
+        return -1
+
+    def insert(self, index: int, value: bytes) -> None:
+        """Insert value before element index (0 <= index <= count)."""
+        if index == self.count:
+            return self.append(value)
+        if index == 0:
+            return self.appendleft(value)
+        i, offset = self._locate(index)
+        node = self.nodes[i]
+        before = node.nbytes
+        node.insert(offset, value)
+        self.nbytes += node.nbytes - before
+        self.count += 1
+        self._shift(i, 1)
+        if len(node) > QUICKLIST_NODE_MAX_ENTRIES or (node.nbytes > QUICKLIST_NODE_MAX_BYTES and len(node) > 1):
+            # Split the overfull node in two halves
+            half = len(node) // 2
+            tail = Listpack(node.slice(half, len(node)))
+            before = node.nbytes
+            node.delete_range(half, len(node) - half)
+            self.nbytes += node.nbytes - before
+            self._add_node(i + 1, self.starts[i] + half, tail)
+
+    def trim(self, start: int, stop: int) -> None:
+        """Keep only elements start to stop - 1, with 0 <= start < stop <= count."""
+        if stop < self.count:
+            i, offset = self._locate(stop - 1)
+            self._drop_nodes(i + 1, len(self.nodes))
+            node = self.nodes[i]
+            before = node.nbytes
+            node.delete_range(offset + 1, len(node) - offset - 1)
+            self.nbytes += node.nbytes - before
+        if start > 0:
+            i, offset = self._locate(start)
+            self._drop_nodes(0, i)
+            node = self.nodes[0]
+            before = node.nbytes
+            node.delete_range(0, offset)
+            self.nbytes += node.nbytes - before
+            self.starts[0] += offset
+            self.head += start
+        self.count = stop - start
+
+    def node_buffers(self):
+        """The nodes as listpack blobs, for RDB quicklist encoding."""
+        for node in self.nodes:
+            yield node.tobytes()
@@ -0,0 +1,238 @@
+"""
+Bit operations on strings: SETBIT, GETBIT, BITCOUNT, BITPOS, BITOP and BITFIELD.
+
+Strings are kept as bytes, or as an int once INCR touched them. The first bit
+write turns the value into a bytearray, which later writes change in place
+and grow with zero bytes as needed; to every other command it is still a
+string, in the raw encoding. Bit 0 is the most significant bit of byte 0, as
+in Redis. Counting, searching and BITOP work on whole chunks of the buffer
+converted to Python ints, so int.bit_count(), int.bit_length() and the
+bitwise operators do the per-bit work in C.
+"""
+from functools import reduce
+import operator
+from typing import List, Optional, Tuple
+from data_type.keyspace import lookup_value, store, delete, db
+
+# Bit offsets must stay below 2^32, a 512MB string, like Redis' proto-max-bulk-len
+BITMAP_MAX_BITS = 1 << 32
+# Bytes converted to one int at a time when counting or searching
+BITMAP_CHUNK = 64 * 1024
+
+BITOP_OPS = {b'and': operator.and_, b'or': operator.or_, b'xor': operator.xor, b'not': None}
+
+
+def parse_bit_offset(text: bytes, bits: int = 0) -> int:
+    """
+    A bit offset for SETBIT and GETBIT, or for a BITFIELD field of that many
+    bits, where #N stands for N * bits. Raises ValueError.
+    """
+    multiplier = 1
+    if bits and text[:1] == b"#":
+        text, multiplier = text[1:], bits
+    try:
+        offset = int(text) * multiplier
+    except ValueError:
+        offset = -1
+    if not 0 <= offset < BITMAP_MAX_BITS:
+        raise ValueError("bit offset is not an integer or out of range")
+    return offset
+
+def parse_bitfield_type(text: bytes) -> Tuple[bool, int]:
+    """(signed, bits) for a BITFIELD type, i1 to i64 or u1 to u63. Raises ValueError."""
+    signed = text[:1] == b"i"
+    try:
+        bits = int(text[1:])
+    except ValueError:
+        bits = 0
+    if text[:1] not in (b"i", b"u") or not 1 <= bits <= (64 if signed else 63):
+        raise ValueError("Invalid bitfield type. Use something like i16 u8. Note that u64 is not supported but i64 is.")
+    return signed, bits
+
+def _read(key: bytes):
+    """The string at key as bytes or a bytearray, None if missing. Raises WrongTypeError."""
+    value = lookup_value(key, 'string')
+    return b"%d" % value if isinstance(value, int) else value
+
+def _writable(key: bytes, nbytes: int) -> bytearray:
+    """The string at key as a bytearray at least nbytes long, created or converted as needed."""
+    value = lookup_value(key, 'string')
+    if not isinstance(value, bytearray):
+        buf = bytearray(_read(key) or b"")
+        if len(buf) < nbytes:
+            buf += bytes(nbytes - len(buf))
+        # Storing keeps the TTL and accounts for the new size
+        store(key, 'string', buf)
+        return buf
+    if len(value) < nbytes:
+        db.grow('raw', nbytes - len(value))
+        value += bytes(nbytes - len(value))
+    return value
+
+def _popcount(buf, start: int, end: int) -> int:
+    """Set bits in bytes start to end - 1."""
+    total = 0
+    with memoryview(buf) as view:
+        for i in range(start, end, BITMAP_CHUNK):
+            total += int.from_bytes(view[i:min(i + BITMAP_CHUNK, end)], 'little').bit_count()
+    return total
+
+def _find_bit(buf, bit: int, start: int, end: int) -> int:
+    """Position of the first bit equal to bit in bits start to end (inclusive), -1 if none."""
+    first, last = start >> 3, end >> 3
+    with memoryview(buf) as view:
+        for i in range(first, last + 1, BITMAP_CHUNK):
+            stop = min(i + BITMAP_CHUNK, last + 1)
+            width = 8 * (stop - i)
+            n = int.from_bytes(view[i:stop], 'big')
+            if not bit:
+                n ^= (1 << width) - 1
+            if i == first:
+                # Ignore the bits before start in its byte
+                n &= (1 << (width - (start & 7))) - 1
+            if stop == last + 1:
+                # and the bits after end in its byte
+                n &= ~((1 << (7 - (end & 7))) - 1)
+            if n:
+                return 8 * i + width - n.bit_length()
+    return -1
+
+def normalize_range(start: int, end: int, length: int) -> Tuple[int, int]:
+    """Inclusive start and end with negative values counted from length, clamped as BITCOUNT does."""
+    if start < 0:
+        start = max(start + length, 0)
+    if end < 0:
+        end = max(end + length, 0)
+    return start, min(end, length - 1)
+
+# convenience API
+def setbit(key: bytes, offset: int, bit: int) -> int:
+    """Set one bit, returning its old value."""
+    buf = _writable(key, (offset >> 3) + 1)
+    i, mask = offset >> 3, 0x80 >> (offset & 7)
+    old = buf[i] & mask
+    if bit:
+        buf[i] |= mask
+    else:
+        buf[i] &= ~mask & 0xFF
+    return int(old != 0)
+
+def getbit(key: bytes, offset: int) -> int:
+    value = _read(key)
+    i = offset >> 3
+    if value is None or i >= len(value):
+        return 0
+    return (value[i] >> (7 - (offset & 7))) & 1
+
+def bitcount(key: bytes, start: Optional[int] = None, end: Optional[int] = None, unit: str = 'byte') -> int:
+    """Set bits in the string, or in its start to end range of bytes or bits."""
+    value = _read(key)
+    if not value:
+        return 0
+    if start is None:
+        return _popcount(value, 0, len(value))
+    start, end = normalize_range(start, end, len(value) * (8 if unit == 'bit' else 1))
+    if start > end:
+        return 0
+    if unit == 'byte':
+        return _popcount(value, start, end + 1)
+    first, last = start >> 3, end >> 3
+    # Count whole bytes, then take off the bits outside the range at either end
+    total = _popcount(value, first, last + 1)
+    total -= (value[first] >> (8 - (start & 7))).bit_count()
+    total -= (value[last] & ((1 << (7 - (end & 7))) - 1)).bit_count()
+    return total
+
+def bitpos(key: bytes, bit: int, start: Optional[int] = None, end: Optional[int] = None,
+           unit: str = 'byte') -> int:
+    """
+    Position of the first bit equal to bit, in the whole string or a range of
+    bytes or bits; -1 if there is none. A missing key counts as all zeros.
+    """
+    value = _read(key)
+    if value is None:
+        return -1 if bit else 0
+    length = len(value) * (8 if unit == 'bit' else 1)
+    first, last = normalize_range(start or 0, length - 1 if end is None else end, length)
+    if first > last:
+        return -1
+    if unit == 'byte':
+        first, last = 8 * first, 8 * last + 7
+    pos = _find_bit(value, bit, first, last)
+    if pos < 0 and not bit and end is None:
+        # Without an end the string is taken to go on with zero bits
+        return 8 * len(value)
+    return pos
+
+def bitop(op: bytes, dest: bytes, keys: List[bytes]) -> int:
+    """Store the AND, OR, XOR or NOT of the strings at keys in dest; returns its length."""
+    values = [_read(k) or b"" for k in keys]
+    n = max(len(v) for v in values)
+    delete(dest)
+    if not n:
+        return 0
+    # Shorter strings are padded with zero bytes on the right
+    ints = [int.from_bytes(v, 'big') << (8 * (n - len(v))) for v in values]
+    if op == b'not':
+        result = ints[0] ^ ((1 << (8 * n)) - 1)
+    else:
+        result = reduce(BITOP_OPS[op], ints)
+    store(dest, 'string', bytearray(result.to_bytes(n, 'big')))
+    return n
+
+def _get_field(buf, offset: int, bits: int, signed: bool) -> int:
+    first, last = offset >> 3, (offset + bits - 1) >> 3
+    # Bytes past the end of the string read as zeros
+    chunk = buf[first:last + 1].ljust(last - first + 1, b"\0")
+    shift = 8 * len(chunk) - (offset & 7) - bits
+    value = (int.from_bytes(chunk, 'big') >> shift) & ((1 << bits) - 1)
+    if signed and value >> (bits - 1):
+        value -= 1 << bits
+    return value
+
+def _set_field(buf: bytearray, offset: int, bits: int, value: int) -> None:
+    first, last = offset >> 3, (offset + bits - 1) >> 3
+    shift = 8 * (last - first + 1) - (offset & 7) - bits
+    mask = ((1 << bits) - 1) << shift
+    n = int.from_bytes(buf[first:last + 1], 'big')
+    n = (n & ~mask) | ((value << shift) & mask)
+    buf[first:last + 1] = n.to_bytes(last - first + 1, 'big')
+
+def _overflow(value: int, bits: int, signed: bool, policy: bytes) -> Optional[int]:
+    """value brought into the field's range by the OVERFLOW policy, None if it fails."""
+    low, high = (-(1 << (bits - 1)), (1 << (bits - 1)) - 1) if signed else (0, (1 << bits) - 1)
+    if low <= value <= high:
+        return value
+    if policy == b'fail':
+        return None
+    if policy == b'sat':
+        return high if value > high else low
+    return (value - low) % (1 << bits) + low
+
+def bitfield(key: bytes, ops) -> List[Optional[int]]:
+    """
+    BITFIELD: ops are (op, signed, bits, offset, argument, overflow policy)
+    with op b'get', b'set' or b'incrby'. Returns one reply per op: the value
+    read, the old value for SET, the new one for INCRBY, or None where
+    OVERFLOW FAIL stopped the write.
+    """
+    ends = [offset + bits for op, _, bits, offset, _, _ in ops if op != b'get']
+    # As in Redis the string is grown once, for the furthest field written
+    buf = _writable(key, (max(ends) + 7) >> 3) if ends else (_read(key) or b"")
+    out = []
+    for op, signed, bits, offset, arg, policy in ops:
+        old = _get_field(buf, offset, bits, signed)
+        if op == b'get':
+            out.append(old)
+            continue
+        if op == b'set':
+            # An unsigned field takes the value as a 64-bit unsigned integer
+            new = _overflow(arg if signed else arg & ((1 << 64) - 1), bits, signed, policy)
+        else:
+            new = _overflow(old + arg, bits, signed, policy)
+        if new is None:
+            out.append(None)
+            continue
+        _set_field(buf, offset, bits, new)
+        out.append(old if op == b'set' else new)
+    return out
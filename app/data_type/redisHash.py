@@ -0,0 +1,168 @@
+from typing import Iterator, List, Optional, Tuple
+from data_type.keyspace import lookup_value, store, delete, db, BYTES_OVERHEAD
+from data_type.listpack import Listpack, string_to_int
+from data_type.slotdict import SlotDict
+
+# Small hashes are one listpack of alternating fields and values and become a
+# hashtable once they pass either limit, as with Redis' hash-max-listpack-entries
+# and hash-max-listpack-value. Both can be changed with configure().
+HASH_MAX_LISTPACK_ENTRIES = 128
+HASH_MAX_LISTPACK_VALUE = 64
+# Estimated bytes of an empty hash in each encoding, and per hashtable field on top of its bytes
+HASH_LISTPACK_OVERHEAD = 150
+HASH_OVERHEAD = 500
+HASH_FIELD_OVERHEAD = 100 + 2 * BYTES_OVERHEAD
+
+max_listpack_entries = HASH_MAX_LISTPACK_ENTRIES
+max_listpack_value = HASH_MAX_LISTPACK_VALUE
+
+def configure(entries: int, value: int) -> None:
+    global max_listpack_entries, max_listpack_value
+    max_listpack_entries, max_listpack_value = entries, value
+
+
+class Redis_Hash:
+    __slots__ = ('name', 'fields', 'encoding', 'mem')
+
+    def __init__(self, name: bytes):
+        self.name = name
+        self.fields = Listpack()      # field, value, field, value... or a SlotDict once converted
+        self.encoding = 'listpack'
+        self.mem = HASH_LISTPACK_OVERHEAD + self.fields.nbytes   # estimated size, kept up to date for maxmemory
+
+    def __len__(self) -> int:
+        if self.encoding == 'listpack':
+            return len(self.fields) // 2
+        return len(self.fields)
+
+    def _account(self, delta: int) -> None:
+        self.mem += delta
+        db.grow(self.encoding, delta)
+
+    def _convert(self) -> None:
+        old_mem = self.mem
+        self.fields = SlotDict(self.items())
+        self.encoding = 'hashtable'
+        self.mem = HASH_OVERHEAD + sum(HASH_FIELD_OVERHEAD + len(f) + len(v) for f, v in self.fields.items())
+        db.convert('listpack', old_mem, 'hashtable', self.mem)
+
+    def get(self, field: bytes) -> Optional[bytes]:
+        if self.encoding == 'listpack':
+            i = self.fields.find(field, skip=1)
+            return self.fields[i + 1] if i >= 0 else None
+        return self.fields.get(field)
+
+    def set(self, field: bytes, value: bytes) -> bool:
+        """Set field to value. Returns True if the field is new."""
+        if self.encoding == 'listpack':
+            if (len(field) > max_listpack_value or len(value) > max_listpack_value
+                    or len(self.fields) // 2 >= max_listpack_entries and self.fields.find(field, skip=1) < 0):
+                self._convert()
+            else:
+                lp = self.fields
+                before = lp.nbytes
+                i = lp.find(field, skip=1)
+                if i >= 0:
+                    lp[i + 1] = value
+                else:
+                    lp.append(field)
+                    lp.append(value)
+                self._account(lp.nbytes - before)
+                return i < 0
+        old = self.fields.get(field)
+        self.fields[field] = value
+        if old is None:
+            self._account(HASH_FIELD_OVERHEAD + len(field) + len(value))
+            return True
+        self._account(len(value) - len(old))
+        return False
+
+    def delete(self, field: bytes) -> bool:
+        if self.encoding == 'listpack':
+            lp = self.fields
+            i = lp.find(field, skip=1)
+            if i < 0:
+                return False
+            before = lp.nbytes
+            lp.delete_range(i, 2)
+            self._account(lp.nbytes - before)
+            return True
+        old = self.fields.pop(field, None)
+        if old is None:
+            return False
+        self._account(-(HASH_FIELD_OVERHEAD + len(field) + len(old)))
+        return True
+
+    def items(self) -> Iterator[Tuple[bytes, bytes]]:
+        if self.encoding == 'listpack':
+            it = iter(self.fields)
+            return zip(it, it)
+        return self.fields.items()
+
+    def scan(self, cursor: int, count: int) -> Tuple[int, List[Tuple[bytes, bytes]]]:
+        """Fields from cursor on; a listpack is returned whole with cursor 0, as in Redis."""
+        if self.encoding == 'listpack':
+            return 0, list(self.items())
+        return self.fields.scan(cursor, count)
+
+# convenience API
+def get_hash(key: bytes, create: bool = False) -> Optional[Redis_Hash]:
+    """The hash at key; None if missing unless create. Raises WrongTypeError for other types."""
+    h = lookup_value(key, 'hash')
+    if h is None and create:
+        h = Redis_Hash(key)
+        store(key, 'hash', h)
+    return h
+
+def hset(key: bytes, pairs) -> int:
+    """Set each (field, value); returns the number of fields that were added."""
+    h = get_hash(key, create=True)
+    return sum(h.set(field, value) for field, value in pairs)
+
+def hget(key: bytes, field: bytes) -> Optional[bytes]:
+    h = get_hash(key)
+    return h.get(field) if h is not None else None
+
+def hmget(key: bytes, fields: List[bytes]) -> List[Optional[bytes]]:
+    h = get_hash(key)
+    return [h.get(f) if h is not None else None for f in fields]
+
+def hgetall(key: bytes) -> List[Tuple[bytes, bytes]]:
+    h = get_hash(key)
+    return list(h.items()) if h is not None else []
+
+def hdel(key: bytes, fields: List[bytes]) -> int:
+    h = get_hash(key)
+    if h is None:
+        return 0
+    removed = sum(h.delete(f) for f in fields)
+    if not len(h):
+        # Empty hashes are removed, as in Redis
+        delete(key)
+    return removed
+
+def hincrby(key: bytes, field: bytes, increment: int) -> int:
+    """Raises ValueError if the field is not an integer or the result would overflow."""
+    h = get_hash(key, create=True)
+    current = h.get(field)
+    num = 0
+    if current is not None:
+        num = string_to_int(current)
+        if num is None:
+            raise ValueError("hash value is not an integer")
+    num += increment
+    if not -(1 << 63) <= num < (1 << 63):
+        raise ValueError("increment or decrement would overflow")
+    h.set(field, b"%d" % num)
+    return num
+
+def hexists(key: bytes, field: bytes) -> bool:
+    return hget(key, field) is not None
+
+def hlen(key: bytes) -> int:
+    h = get_hash(key)
+    return len(h) if h is not None else 0
+
+def hscan(key: bytes, cursor: int, count: int) -> Tuple[int, List[Tuple[bytes, bytes]]]:
+    h = get_hash(key)
+    return h.scan(cursor, count) if h is not None else (0, [])
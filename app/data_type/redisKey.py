@@ -1,153 +1,139 @@
-import time
-import heapq
-from collections import deque
 from typing import Optional, List
+import resp
+from data_type.expires import expires, now_ms, EXPIRE_MAX_MS
+from data_type.keyspace import lookup, lookup_value, store, shared_int, WrongTypeError
+from data_type.listpack import string_to_int
 
-class Entry:
-    def __init__(self, kind, value, expire_at=None):
-        self.kind = kind
-        self.value = value
-        self.expire_at = expire_at
+SET_EXPIRE_UNITS = {b'ex': 1000, b'px': 1, b'exat': 1000, b'pxat': 1}
+
+def try_int_encoding(val: bytes):
+    """
+    A canonical integer string is kept as an int (a shared one when small), which
+    is smaller than the bytes and turns back into exactly the same bytes on read.
+    """
+    num = string_to_int(val)
+    return shared_int(num) if num is not None else val
 
 class RedisKey:
     def __init__(self):
-        self._data = {}  # key -> Entry
-        self._expires = []  # heap of (expire_at, key)
-        self._transaction_queue = []  # List of [key, value, ttl, kind] for transaction updates
-
-    def _evict_expired(self):
-        now = time.time()
-        while self._expires and self._expires[0][0] <= now:
-            exp, key = heapq.heappop(self._expires)
-            ent = self._data.get(key)
-            if ent and ent.expire_at == exp:
-                del self._data[key]
-
-    def add_data(self, key: str, val, ttl: Optional[float], kind: str = None, client_state=None) -> None:
-        print(f"inadd_data {key},{val}")
+        # String values live in the shared keyspace as bytes, or as an int once INCR touched them
+        self._transaction_queue = []  # List of [key, value, expire_ms, kind, keepttl] for transaction updates
+
+    def _store(self, key: bytes, val, expire_ms: Optional[int], kind: str, keepttl: bool) -> None:
+        store(key, kind, val)
+        if expire_ms is not None:
+            expires.set(key, expire_ms)
+        elif not keepttl:
+            # Overwriting a key clears its TTL, as in Redis
+            expires.remove(key)
+
+    def add_data(self, key: bytes, val, expire_ms: Optional[int], kind: str = None, client_state=None,
+                 keepttl: bool = False) -> None:
         try:
-            expire = time.time() + ttl if ttl is not None else None
-            # Determine kind if not provided
             if kind is None:
-                if isinstance(val, int):
-                    kind = 'int'
-                elif isinstance(val, str):
-                    kind = 'string'
-                else:
-                    kind = 'None'
+                kind = 'string'
             if not client_state['multi_event'].is_set():
                 # Queue updates during transaction
-                self._transaction_queue.append([key, val, ttl, kind])
-                print(f"Transaction queue: {self._transaction_queue}, Multi: {client_state['multi_event'].is_set()}")
+                self._transaction_queue.append([key, val, expire_ms, kind, keepttl])
             else:
                 # Apply immediately
-                self._data[key] = Entry(kind, val, expire)
-                print(f"Direct update: {key}={val}, Multi: {client_state['multi_event'].is_set()}")
-                if expire:
-                    heapq.heappush(self._expires, (expire, key))
+                self._store(key, val, expire_ms, kind, keepttl)
         except Exception as e:
             print(f"Error in add_data: {str(e)}")
             raise
 
     def apply_transaction(self) -> None:
         # Apply queued transaction updates
-        print(f"Applying transaction: {self._transaction_queue}")
-        for key, value, ttl, kind in self._transaction_queue:
+        for key, value, expire_ms, kind, keepttl in self._transaction_queue:
             try:
-                expire = time.time() + ttl if ttl is not None else None
-                self._data[key] = Entry(kind, value, expire)
-                if expire:
-                    heapq.heappush(self._expires, (expire, key))
+                self._store(key, value, expire_ms, kind, keepttl)
             except Exception as e:
                 print(f"Error applying transaction for {key}: {str(e)}")
         self._transaction_queue.clear()
-        print(f"After transaction: {self._data}")
         
     def discard_transaction(self) -> None:
         # Apply queued transaction updates
-        print(f"Applying transaction: {self._transaction_queue}")
         self._transaction_queue.clear()
-        print(f"After transaction: {self._data}")
-
-    def get_val(self, key: str):
-        self._evict_expired()
-        ent = self._data.get(key)
-        if not ent:
-            return None
-        return ent.value
-
-    def get_type(self, key: str) -> Optional[str]:
-        self._evict_expired()
-        ent = self._data.get(key)
+
+    def get_val(self, key: bytes):
+        """The string value of key, None if missing. Raises WrongTypeError for other types."""
+        return lookup_value(key, 'string')
+
+    def get_bytes(self, key: bytes) -> Optional[bytes]:
+        """Return the value as bytes, encoding integer values only when read."""
+        val = self.get_val(key)
+        if isinstance(val, int):
+            return b"%d" % val
+        return val
+
+    def get_type(self, key: bytes) -> Optional[str]:
+        ent = lookup(key)
         return ent.kind if ent else None
 
-    def ensure_list(self, key: str):
-        self._evict_expired()
-        ent = self._data.get(key)
-        if ent and ent.kind != 'list':
-            raise TypeError("WRONGTYPE Operation against a key holding the wrong kind")
-        if not ent:
-            ent = Entry('list', deque(), None)
-            self._data[key] = ent
-        return ent.value
-
-    def rset(self, args: List[str], client_state=None) -> None:
-        print(f"inrset,{args}")
+    def rset(self, args: List[bytes], client_state=None) -> Optional[int]:
+        """
+        SET key value [EX s | PX ms | EXAT unix-s | PXAT unix-ms | KEEPTTL].
+        Returns the absolute expire time in ms, if one was given.
+        """
         try:
             key, val = args[0], args[1]
-            ttl = float(args[3]) / 1000 if len(args) == 4 else None
-            try:
-                int_val = int(val)
-                self.add_data(key, int_val, ttl, 'int', client_state)
-            except ValueError:
-                self.add_data(key, val, ttl, 'string', client_state)
+            expire_ms = None
+            keepttl = False
+            i = 2
+            while i < len(args):
+                opt = args[i].lower()
+                if opt == b'keepttl' and expire_ms is None:
+                    keepttl = True
+                    i += 1
+                elif opt in SET_EXPIRE_UNITS and i + 1 < len(args) and expire_ms is None and not keepttl:
+                    try:
+                        amount = int(args[i + 1])
+                    except ValueError:
+                        raise ValueError("value is not an integer or out of range")
+                    expire_ms = amount * SET_EXPIRE_UNITS[opt]
+                    if opt in (b'ex', b'px'):
+                        expire_ms += now_ms()
+                    if amount <= 0 or expire_ms > EXPIRE_MAX_MS:
+                        raise ValueError("invalid expire time in 'set' command")
+                    i += 2
+                else:
+                    raise ValueError("syntax error")
+            self.add_data(key, try_int_encoding(val), expire_ms, 'string', client_state, keepttl)
+            return expire_ms
         except Exception as e:
             print(f"Error in rset: {str(e)}")
             raise
 
-    def incr(self, key: str, client_state=None) -> str:
+    def incr(self, key: bytes, client_state=None) -> bytes:
         try:
-            self._evict_expired()
-            if key not in self._data:
+            value = self.get_val(key)
+            if value is None:
                 # Initialize non-existent key to 1
-                if not client_state['multi_event'].is_set():
-                    self._transaction_queue.append([key, 1, None, 'int'])
-                    print(f"INCR queue: {key}=1, Multi: {client_state['multi_event'].is_set()}")
-                else:
-                    self._data[key] = Entry('int', 1, None)
-                    print(f"INCR direct: {key}=1, Multi: {client_state['multi_event'].is_set()}")
-                return ":1\r\n"
-            ent = self._data[key]
-            if ent.kind != 'int' and ent.kind != 'string':
-                return "-ERR value is not an integer or out of range\r\n"
-            try:
-                int_value = int(ent.value)
-            except (ValueError, TypeError):
-                return "-ERR value is not an integer or out of range\r\n"
+                self.add_data(key, 1, None, 'string', client_state)
+                return resp.integer(1)
+            # Integer strings are already stored as ints; anything else is not a valid integer
+            int_value = value if isinstance(value, int) else string_to_int(value)
+            if int_value is None:
+                return resp.error("ERR value is not an integer or out of range")
             new_value = int_value + 1
-            if not client_state['multi_event'].is_set():
-                self._transaction_queue.append([key, new_value, ent.expire_at if ent.expire_at else None, 'int'])
-                print(f"INCR queue: {key}={new_value}, Multi: {client_state['multi_event'].is_set()}")
-            else:
-                self._data[key] = Entry('int', new_value, ent.expire_at)
-                print(f"INCR direct: {key}={new_value}, Multi: {client_state['multi_event'].is_set()}")
-                if ent.expire_at:
-                    heapq.heappush(self._expires, (ent.expire_at, key))
-            return f":{new_value}\r\n"
+            if new_value >= 1 << 63:
+                return resp.error("ERR increment or decrement would overflow")
+            # INCR keeps the key's TTL
+            self.add_data(key, shared_int(new_value), None, 'string', client_state, keepttl=True)
+            return resp.integer(new_value)
+        except WrongTypeError:
+            raise
         except Exception as e:
             print(f"Error in incr: {str(e)}")
             raise
 
 rkey = RedisKey()
 
-def get_store():
-    return rkey._data
-
 def get(args):
-    return rkey.get_val(args[0])
+    return rkey.get_bytes(args[0])
 
 def rset(args, client_state=None):
-    rkey.rset(args, client_state)
+    return rkey.rset(args, client_state)
 
 def check_type(key):
     return rkey.get_type(key)
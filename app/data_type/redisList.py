@@ -1,112 +1,218 @@
-from collections import deque
-import asyncio
+from typing import Optional
+from data_type.keyspace import lookup_value, store, delete, db
+from data_type.quicklist import Quicklist
+import data_type.blocking as blocking
+
+# Small lists are reported as a listpack and become a quicklist once they pass
+# either limit, as with Redis' list-max-listpack-size. Both are stored as a
+# Quicklist; a small list is simply one node.
+LIST_MAX_LISTPACK_ENTRIES = 128
+LIST_MAX_LISTPACK_VALUE = 64
+# Estimated bytes of an empty list in each encoding, and per quicklist node on top of its buffer
+LISTPACK_LIST_OVERHEAD = 150
+QUICKLIST_OVERHEAD = 700
+QUICKLIST_NODE_OVERHEAD = 80
 
 class Redis_List:
-    
+    __slots__ = ('name', 'elements', 'encoding', 'mem')
+
     def __init__(self,name):
         self.name = name
-        self.elements = deque()
-        self._waiters = deque() #[time:action]
+        self.elements = Quicklist()
+        self.encoding = 'listpack'
+        self.mem = self._size()   # estimated size, kept up to date for maxmemory
 
 
     def __len__(self) -> int:
         return len(self.elements)
 
     
-    def get_name(self) -> str:
+    def get_name(self) -> bytes:
         return self.name
 
-    def get_elements(self,i =  None) -> str:
+    def get_elements(self,i =  None) -> bytes:
         if i is None:
             return self.elements
         return self.elements[i]
     
     def get_element_length(self) -> int:
         return len(self.elements)
-        
+
+    def _size(self) -> int:
+        ql = self.elements
+        if self.encoding == 'listpack':
+            return LISTPACK_LIST_OVERHEAD + ql.nbytes
+        return QUICKLIST_OVERHEAD + ql.nbytes + QUICKLIST_NODE_OVERHEAD * len(ql.nodes)
+
+    def _resized(self, longest: int = 0) -> None:
+        """
+        Update the estimated size after a change that added values up to longest
+        bytes, switching to quicklist once past the listpack limits.
+        """
+        if self.encoding == 'listpack' and (len(self.elements) > LIST_MAX_LISTPACK_ENTRIES
+                                            or len(self.elements.nodes) > 1
+                                            or longest > LIST_MAX_LISTPACK_VALUE):
+            old_mem = self.mem
+            self.encoding = 'quicklist'
+            self.mem = self._size()
+            db.convert('listpack', old_mem, 'quicklist', self.mem)
+        else:
+            size = self._size()
+            db.grow(self.encoding, size - self.mem)
+            self.mem = size
+
     def append_right(self,elements) -> None:
         self.elements.append(elements)
-        if self._waiters:
-            fut = self._waiters.popleft()
-            if not fut.done():
-                fut.set_result(elements)
+        self._resized(len(elements))
 
     
-    def append_left(self,elements:str) -> None:
+    def append_left(self,elements:bytes) -> None:
         self.elements.appendleft(elements)
-        if self._waiters:
-            fut = self._waiters.popleft()
-            if not fut.done():
-                fut.set_result(elements)
+        self._resized(len(elements))
 
+    def extend(self, elements) -> None:
+        elements = list(elements)
+        self.elements.extend(elements)
+        self._resized(max(map(len, elements), default=0))
     
-    def pop_left(self) -> str:
+    def pop_left(self) -> bytes:
         remove = self.elements.popleft()
+        self._resized()
+        return remove
+
+    def pop_right(self) -> bytes:
+        remove = self.elements.pop()
+        self._resized()
         return remove
-    
-    async def blpop(self, timeout: float):
-        # immediate pop if we already have data:
-        if self.elements:
-            return self.elements.popleft()
-
-        loop = asyncio.get_running_loop()
-        fut = loop.create_future()
-        self._waiters.append(fut)
-
-        try:
-            if timeout > 0:
-                return await asyncio.wait_for(fut, timeout)
-            else:
-                # block forever
-                return await fut
-        except asyncio.TimeoutError:
-            # timed out, remove our waiter
-            self._waiters.remove(fut)
-            return None
-        
-lists: dict[str, Redis_List] = {}
-# convenience API
-def get_list(key: str) -> Redis_List:
-    return lists.setdefault(key, Redis_List(key))
 
-def check_if_lists(key):
-    return key in lists 
+    def set(self, index: int, value: bytes) -> None:
+        self.elements[index] = value
+        self._resized(len(value))
 
-def rpush(key: str, *vals: str) -> int:
-    lst = get_list(key)
-    for v in vals:
-        lst.append_right(v)
+    def insert(self, index: int, value: bytes) -> None:
+        self.elements.insert(index, value)
+        self._resized(len(value))
+
+    def trim(self, start: int, stop: int) -> None:
+        self.elements.trim(start, stop)
+        self._resized()
+
+# convenience API
+def get_list(key: bytes, create: bool = False) -> Optional[Redis_List]:
+    """The list at key; None if missing unless create. Raises WrongTypeError for other types."""
+    lst = lookup_value(key, 'list')
+    if lst is None and create:
+        lst = Redis_List(key)
+        store(key, 'list', lst)
+    return lst
+
+def rpush(key: bytes, *vals: bytes) -> int:
+    lst = get_list(key, create=True)
+    lst.extend(vals)
+    blocking.signal(key)
     return len(lst)
 
-def lpush(key: str, *vals: str) -> int:
-    lst = get_list(key)
+def lpush(key: bytes, *vals: bytes) -> int:
+    lst = get_list(key, create=True)
     for v in vals:
         lst.append_left(v)
+    blocking.signal(key)
     return len(lst)
 
-def llen(key: str) -> int:
-    return len(get_list(key))
+def llen(key: bytes) -> int:
+    lst = get_list(key)
+    return len(lst) if lst is not None else 0
 
-def lrange(key: str, start: int, stop: int) -> list[str]:
+def lrange(key: bytes, start: int, stop: int) -> list[bytes]:
     lst = get_list(key)
+    if lst is None:
+        return []
     L = len(lst)
     # normalize negatives
     if start < 0: start = max(0, L + start)
     if stop < 0: stop = L + stop
     if start > stop: return []
     stop = min(stop, L-1)
-    return [lst.get_elements(i) for i in range(start, stop+1)]
+    return lst.elements.range(start, stop+1)
+
+def normalize_index(lst: Redis_List, index: int) -> Optional[int]:
+    """index counted from the head, negative ones from the tail; None if out of range."""
+    if index < 0:
+        index += len(lst)
+    return index if 0 <= index < len(lst) else None
 
-def lpop_n(key: str, count: int) -> list[str]:
+def lindex(key: bytes, index: int) -> Optional[bytes]:
     lst = get_list(key)
-    n = min(count, len(lst))
-    return [lst.pop_left() for _ in range(n)]
+    if lst is None:
+        return None
+    index = normalize_index(lst, index)
+    return lst.elements[index] if index is not None else None
 
-async def blpop(key: str, timeout: float) -> tuple[str, str] | None:
+def lset(key: bytes, index: int, value: bytes) -> None:
+    """Raises ValueError if the key is missing or index is out of range."""
     lst = get_list(key)
-    val = await lst.blpop(timeout)
-    return (key, val) if val is not None else None
-    
+    if lst is None:
+        raise ValueError("no such key")
+    index = normalize_index(lst, index)
+    if index is None:
+        raise ValueError("index out of range")
+    lst.set(index, value)
+
+def ltrim(key: bytes, start: int, stop: int) -> None:
+    lst = get_list(key)
+    if lst is None:
+        return
+    L = len(lst)
+    if start < 0: start = max(0, L + start)
+    if stop < 0: stop = L + stop
+    stop = min(stop, L-1)
+    if start > stop:
+        delete(key)
+    elif start > 0 or stop < L-1:
+        lst.trim(start, stop+1)
 
+def linsert(key: bytes, before: bool, pivot: bytes, value: bytes) -> int:
+    """Insert value next to the first pivot; the new length, -1 without pivot, 0 without the key."""
+    lst = get_list(key)
+    if lst is None:
+        return 0
+    index = lst.elements.find(pivot)
+    if index < 0:
+        return -1
+    lst.insert(index if before else index + 1, value)
+    return len(lst)
 
-    
\ No newline at end of file
+def pop_n(key: bytes, count: int, where: str = 'left') -> Optional[list[bytes]]:
+    """Pop up to count elements from the 'left' or 'right' end; None if key is missing."""
+    lst = get_list(key)
+    if lst is None:
+        return None
+    n = min(count, len(lst))
+    pop = lst.pop_left if where == 'left' else lst.pop_right
+    popped = [pop() for _ in range(n)]
+    if not len(lst):
+        # Empty lists are removed, as in Redis
+        delete(key)
+    return popped
+
+def lpop_n(key: bytes, count: int) -> Optional[list[bytes]]:
+    return pop_n(key, count, 'left')
+
+def rpop_n(key: bytes, count: int) -> Optional[list[bytes]]:
+    return pop_n(key, count, 'right')
+
+def lmove(src: bytes, dst: bytes, wherefrom: str, whereto: str) -> Optional[bytes]:
+    """Pop from one end of src and push to one end of dst; None if src is missing."""
+    lst = get_list(src)
+    if lst is None:
+        return None
+    # Checked before popping, so a WRONGTYPE leaves src unchanged
+    get_list(dst)
+    element = pop_n(src, 1, wherefrom)[0]
+    target = get_list(dst, create=True)
+    if whereto == 'left':
+        target.append_left(element)
+    else:
+        target.append_right(element)
+    blocking.signal(dst)
+    return element
@@ -0,0 +1,353 @@
+import random
+from array import array
+from bisect import bisect_left, insort
+from itertools import compress, filterfalse
+from operator import not_
+from typing import Iterator, List, Optional, Tuple
+from data_type.keyspace import lookup_value, store, delete, db, BYTES_OVERHEAD
+from data_type.listpack import string_to_int
+from data_type.slotdict import SlotDict
+
+# Sets of integers are a sorted array('q'), Redis' intset, and become a
+# hashtable when a member is not a canonical 64-bit integer or the set grows
+# past set-max-intset-entries, which can be changed with configure().
+SET_MAX_INTSET_ENTRIES = 512
+# Estimated bytes of an empty set in each encoding, and per hashtable member on top of its bytes
+INTSET_OVERHEAD = 150
+SET_OVERHEAD = 500
+SET_MEMBER_OVERHEAD = 100 + BYTES_OVERHEAD
+# Fewer new members than this are inserted into an intset one by one, more in one pass over it
+INTSET_MERGE_MIN = 16
+# An intset this many times larger than the members it is checked against is probed with a
+# bisect per member rather than scanned whole
+INTSET_GALLOP_RATIO = 16
+
+max_intset_entries = SET_MAX_INTSET_ENTRIES
+
+def configure(entries: int) -> None:
+    global max_intset_entries
+    max_intset_entries = entries
+
+_int_to_bytes = b"%d".__mod__
+
+
+class Redis_Set:
+    __slots__ = ('name', 'members', 'encoding', 'mem')
+
+    def __init__(self, name: bytes):
+        self.name = name
+        self.members = array('q')     # sorted ints, or a SlotDict of members once converted
+        self.encoding = 'intset'
+        self.mem = INTSET_OVERHEAD    # estimated size, kept up to date for maxmemory
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def __iter__(self) -> Iterator[bytes]:
+        if self.encoding == 'intset':
+            return map(_int_to_bytes, self.members)
+        return iter(self.members)
+
+    def __contains__(self, member: bytes) -> bool:
+        if self.encoding == 'intset':
+            num = string_to_int(member)
+            return num is not None and self._has_int(num)
+        return member in self.members
+
+    def _has_int(self, num: int) -> bool:
+        ints = self.members
+        i = bisect_left(ints, num)
+        return i < len(ints) and ints[i] == num
+
+    def _account(self, delta: int) -> None:
+        self.mem += delta
+        db.grow(self.encoding, delta)
+
+    def _convert(self) -> None:
+        old_mem = self.mem
+        members = SlotDict()
+        members.add_new(self)
+        self.members = members
+        self.encoding = 'hashtable'
+        self.mem = SET_OVERHEAD + sum(SET_MEMBER_OVERHEAD + len(m) for m in members)
+        db.convert('intset', old_mem, 'hashtable', self.mem)
+
+    def update(self, members) -> int:
+        """Add members; returns how many were new."""
+        distinct = set(members)
+        if self.encoding == 'intset':
+            new = self._new_ints(distinct)
+            if new is not None and len(self.members) + len(new) <= max_intset_entries:
+                self._add_ints(new)
+                return len(new)
+            self._convert()
+        new = distinct.difference(self.members.keys())
+        self.members.add_new(new)
+        self._account(SET_MEMBER_OVERHEAD * len(new) + sum(map(len, new)))
+        return len(new)
+
+    def _new_ints(self, distinct) -> Optional[set]:
+        """The members not in the intset yet, as ints; None if one of them is not an integer."""
+        # A batch larger than an intset can hold is not worth parsing
+        if len(distinct) > max_intset_entries:
+            return None
+        ints = set()
+        for member in distinct:
+            num = string_to_int(member)
+            if num is None:
+                return None
+            ints.add(num)
+        if len(ints) * INTSET_GALLOP_RATIO < len(self.members):
+            return {num for num in ints if not self._has_int(num)}
+        return ints.difference(self.members)
+
+    def _add_ints(self, new) -> None:
+        if not new:
+            return
+        ints = self.members
+        new = sorted(new)
+        if not ints or new[0] > ints[-1]:
+            # All past the largest member, as when an intset is replayed in order
+            ints.extend(new)
+        elif len(new) < INTSET_MERGE_MIN:
+            for num in new:
+                insort(ints, num)
+        elif len(new) * INTSET_GALLOP_RATIO < len(ints):
+            # Copy the runs between the insertion points
+            merged = array('q')
+            prev = 0
+            for num in new:
+                i = bisect_left(ints, num, prev)
+                merged += ints[prev:i]
+                merged.append(num)
+                prev = i
+            merged += ints[prev:]
+            self.members = merged
+        else:
+            # Two sorted runs back to back: the sort is a single merge
+            merged = ints.tolist() + new
+            merged.sort()
+            self.members = array('q', merged)
+        self._account(8 * len(new))
+
+    def remove(self, member: bytes) -> bool:
+        if self.encoding == 'intset':
+            num = string_to_int(member)
+            ints = self.members
+            i = bisect_left(ints, num) if num is not None else len(ints)
+            if i == len(ints) or ints[i] != num:
+                return False
+            del ints[i]
+            self._account(-8)
+            return True
+        if member not in self.members:
+            return False
+        self.members.pop(member)
+        self._account(-(SET_MEMBER_OVERHEAD + len(member)))
+        return True
+
+    def random_member(self) -> bytes:
+        if self.encoding == 'intset':
+            return b"%d" % self.members[random.randrange(len(self.members))]
+        return self.members.random_key()
+
+    def random_members(self, count: int) -> List[bytes]:
+        """count distinct members drawn at random, 0 <= count <= len."""
+        if self.encoding == 'intset':
+            ints = self.members
+            return [b"%d" % ints[i] for i in random.sample(range(len(ints)), count)]
+        if count * 2 > len(self.members):
+            return random.sample(list(self.members), count)
+        # Few of many: draw until there are enough distinct ones
+        picked = set()
+        while len(picked) < count:
+            picked.add(self.members.random_key())
+        return list(picked)
+
+    def scan(self, cursor: int, count: int) -> Tuple[int, List[bytes]]:
+        """Members from cursor on; an intset is returned whole with cursor 0, as in Redis."""
+        if self.encoding == 'intset':
+            return 0, list(self)
+        cursor, pairs = self.members.scan(cursor, count)
+        return cursor, [member for member, _ in pairs]
+
+# Set algebra. Intermediate results are either a sorted array('q') of ints,
+# while every set involved so far is an intset, or a set of members.
+
+def _intersect_ints(ints: array, s: Redis_Set) -> array:
+    if s.encoding == 'hashtable':
+        return array('q', compress(ints, map(s.members.keys().__contains__, map(_int_to_bytes, ints))))
+    other = s.members
+    if len(ints) * INTSET_GALLOP_RATIO < len(other):
+        out = array('q')
+        lo, n = 0, len(other)
+        for num in ints:
+            lo = bisect_left(other, num, lo)
+            if lo == n:
+                break
+            if other[lo] == num:
+                out.append(num)
+        return out
+    # Scanning the sorted other side keeps the result sorted
+    return array('q', filter(set(ints).__contains__, other))
+
+def _intersect_members(members, s: Redis_Set):
+    if s.encoding == 'hashtable':
+        # A dict view iterates the smaller side and probes the other
+        return s.members.keys() & members
+    if len(members) * INTSET_GALLOP_RATIO < len(s):
+        return {m for m in members if m in s}
+    return set(members).intersection(s)
+
+def intersect(sets: List[Optional[Redis_Set]]):
+    """Members of all the sets, with None for a missing key; the smallest set is walked first."""
+    if any(s is None for s in sets):
+        return array('q')
+    sets = sorted(sets, key=len)
+    first = sets[0]
+    if first.encoding == 'intset':
+        result = array('q', first.members)
+        for s in sets[1:]:
+            if not result:
+                break
+            result = _intersect_ints(result, s)
+        return result
+    result = first.members.keys()
+    for s in sets[1:]:
+        if not result:
+            break
+        result = _intersect_members(result, s)
+    return set(result)
+
+def union(sets: List[Optional[Redis_Set]]):
+    sets = [s for s in sets if s is not None]
+    if all(s.encoding == 'intset' for s in sets):
+        return array('q', sorted(set().union(*(s.members for s in sets))))
+    return set().union(*sets)
+
+def difference(sets: List[Optional[Redis_Set]]):
+    """Members of the first set that are in none of the others."""
+    first = sets[0]
+    if first is None:
+        return array('q')
+    others = [s for s in sets[1:] if s is not None]
+    if first.encoding == 'intset':
+        result = array('q', first.members)
+        for s in others:
+            if not result:
+                break
+            if s.encoding == 'intset':
+                result = array('q', filterfalse(set(s.members).__contains__, result))
+            else:
+                found = map(s.members.keys().__contains__, map(_int_to_bytes, result))
+                result = array('q', compress(result, map(not_, found)))
+        return result
+    result = set(first.members.keys())
+    for s in others:
+        if not result:
+            break
+        if len(s) > len(result) * INTSET_GALLOP_RATIO:
+            result = {m for m in result if m not in s}
+        else:
+            result.difference_update(s)
+    return result
+
+def result_members(result) -> List[bytes]:
+    if isinstance(result, array):
+        return list(map(_int_to_bytes, result))
+    return list(result)
+
+# convenience API
+def get_set(key: bytes, create: bool = False) -> Optional[Redis_Set]:
+    """The set at key; None if missing unless create. Raises WrongTypeError for other types."""
+    s = lookup_value(key, 'set')
+    if s is None and create:
+        s = Redis_Set(key)
+        store(key, 'set', s)
+    return s
+
+def sadd(key: bytes, members: List[bytes]) -> int:
+    return get_set(key, create=True).update(members)
+
+def srem(key: bytes, members: List[bytes]) -> int:
+    s = get_set(key)
+    if s is None:
+        return 0
+    removed = sum(s.remove(m) for m in members)
+    if not len(s):
+        # Empty sets are removed, as in Redis
+        delete(key)
+    return removed
+
+def sismember(key: bytes, member: bytes) -> bool:
+    s = get_set(key)
+    return s is not None and member in s
+
+def smismember(key: bytes, members: List[bytes]) -> List[bool]:
+    s = get_set(key)
+    return [s is not None and m in s for m in members]
+
+def scard(key: bytes) -> int:
+    s = get_set(key)
+    return len(s) if s is not None else 0
+
+def smembers(key: bytes) -> List[bytes]:
+    s = get_set(key)
+    return list(s) if s is not None else []
+
+def srandmember(key: bytes, count: int) -> List[bytes]:
+    """count distinct members, or -count members that may repeat when count is negative."""
+    s = get_set(key)
+    if s is None:
+        return []
+    if count < 0:
+        return [s.random_member() for _ in range(-count)]
+    if count >= len(s):
+        return list(s)
+    return s.random_members(count)
+
+def spop(key: bytes, count: int) -> List[bytes]:
+    """Remove and return up to count members drawn at random."""
+    s = get_set(key)
+    if s is None:
+        return []
+    if count >= len(s):
+        popped = list(s)
+        delete(key)
+        return popped
+    popped = s.random_members(count)
+    for member in popped:
+        s.remove(member)
+    return popped
+
+def sscan(key: bytes, cursor: int, count: int) -> Tuple[int, List[bytes]]:
+    s = get_set(key)
+    return s.scan(cursor, count) if s is not None else (0, [])
+
+def set_algebra(op: str, keys: List[bytes]) -> List[bytes]:
+    """SINTER, SUNION or SDIFF ('inter', 'union' or 'diff') of the sets at keys."""
+    return result_members(_combine(op, keys))
+
+def set_algebra_store(op: str, dest: bytes, keys: List[bytes]) -> int:
+    """The STORE variants: dest is replaced by the result, or deleted if it is empty."""
+    result = _combine(op, keys)
+    delete(dest)
+    if not len(result):
+        return 0
+    if isinstance(result, array) and len(result) <= max_intset_entries:
+        s = Redis_Set(dest)
+        s.members = result
+        s.mem += 8 * len(result)
+        store(dest, 'set', s)
+    else:
+        s = get_set(dest, create=True)
+        s.update(result_members(result))
+    return len(s)
+
+def _combine(op: str, keys: List[bytes]):
+    sets = [get_set(k) for k in keys]
+    if op == 'inter':
+        return intersect(sets)
+    if op == 'union':
+        return union(sets)
+    return difference(sets)
@@ -1,237 +1,822 @@
-from datetime import datetime
-from typing import Dict, List, Optional
-import asyncio
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+import resp
+from data_type.keyspace import lookup_value, store, db, BYTES_OVERHEAD, WrongTypeError
+from data_type.expires import now_ms
+import data_type.blocking as blocking
+from data_type import listpack
+
+# An entry's fields are packed into one listpack unless it has more than
+# STREAM_MAX_PACKED_FIELDS of them or one longer than STREAM_MAX_PACKED_VALUE
+STREAM_MAX_PACKED_FIELDS = 128
+STREAM_MAX_PACKED_VALUE = 64
+# Estimated bytes of an empty stream, per entry, and per field or value of an unpacked entry
+STREAM_OVERHEAD = 400
+STREAM_NODE_OVERHEAD = 200
+STREAM_ENTRY_OVERHEAD = 60
+STREAM_DICT_OVERHEAD = 100
+STREAM_FIELD_OVERHEAD = BYTES_OVERHEAD
+
+# Estimated bytes of a consumer group, of a consumer on top of its name, and of a pending entry
+STREAM_GROUP_OVERHEAD = 400
+STREAM_CONSUMER_OVERHEAD = 300
+STREAM_PEL_ENTRY_OVERHEAD = 200
+# Acknowledged IDs are dropped from a group's ordered PEL index lazily, once they are
+# more than half of it and at least this many
+STREAM_PEL_MIN_COMPACT = 1024
+# XAUTOCLAIM examines at most COUNT times this many pending entries per call
+STREAM_AUTOCLAIM_ATTEMPTS_FACTOR = 10
+
+Fields = Union[bytes, Dict[bytes, bytes]]   # a packed listpack, or a dict for large entries
+
+def pack_fields(fields: Dict[bytes, bytes]) -> Fields:
+    if len(fields) > STREAM_MAX_PACKED_FIELDS or any(
+            len(f) > STREAM_MAX_PACKED_VALUE or len(v) > STREAM_MAX_PACKED_VALUE for f, v in fields.items()):
+        return fields
+    return listpack.encode(e for pair in fields.items() for e in pair)
+
+def field_pairs(fields: Fields):
+    """The (field, value) pairs of a stored entry, whatever its encoding."""
+    if isinstance(fields, dict):
+        return list(fields.items())
+    items = [listpack.as_bytes(e) for e in listpack.iter_elements(fields)]
+    return list(zip(items[::2], items[1::2]))
+
+def fields_size(fields: Fields) -> int:
+    if isinstance(fields, dict):
+        return STREAM_DICT_OVERHEAD + sum(2 * STREAM_FIELD_OVERHEAD + len(f) + len(v) for f, v in fields.items())
+    return BYTES_OVERHEAD + len(fields)
+
+# Entries per index node, as with Redis' stream-node-max-entries
+STREAM_NODE_MAX_ENTRIES = 100
+STREAM_ID_MAX_SEQ = (1 << 64) - 1
+STREAM_ID_MAX = (1 << 128) - 1
+
+def pack_id(ms: int, seq: int) -> int:
+    """Stream IDs are kept as one int, ms << 64 | seq, so they compare and bisect directly."""
+    return ms << 64 | seq
+
+def unpack_id(sid: int):
+    return sid >> 64, sid & STREAM_ID_MAX_SEQ
+
+def format_id(sid: int) -> bytes:
+    return b"%d-%d" % (sid >> 64, sid & STREAM_ID_MAX_SEQ)
+
+def parse_id(text, missing_seq: int = 0) -> int:
+    """Parse ms-seq, or just ms with seq = missing_seq. Raises ValueError."""
+    if isinstance(text, bytes):
+        text = text.decode()
+    ms, sep, seq = text.partition("-")
+    if not ms.isdigit() or (sep and not seq.isdigit()):
+        raise ValueError("Invalid stream ID specified as stream command argument")
+    ms, seq = int(ms), int(seq) if sep else missing_seq
+    if ms > STREAM_ID_MAX_SEQ or seq > STREAM_ID_MAX_SEQ:
+        raise ValueError("Invalid stream ID specified as stream command argument")
+    return pack_id(ms, seq)
+
+
+class StreamNode:
+    """Up to STREAM_NODE_MAX_ENTRIES consecutive entries: sorted packed IDs and their fields."""
+    __slots__ = ('ids', 'fields')
+
+    def __init__(self):
+        self.ids: List[int] = []
+        self.fields: List[Fields] = []
+
+
+class StreamError(ValueError):
+    """An error reply with its own code (NOGROUP, BUSYGROUP) rather than ERR."""
+
+
+class PendingEntry:
+    """An entry delivered to a consumer of a group and not acknowledged yet."""
+    __slots__ = ('consumer', 'delivery_time', 'delivery_count')
+
+    def __init__(self, consumer: 'Consumer', delivery_time: int, delivery_count: int = 1):
+        self.consumer = consumer
+        self.delivery_time = delivery_time
+        self.delivery_count = delivery_count
+
+
+class Consumer:
+    __slots__ = ('name', 'seen_time', 'active_time', 'pel')
+
+    def __init__(self, name: bytes, now: int):
+        self.name = name
+        self.seen_time = now      # last attempted interaction
+        self.active_time = -1     # last successful one (something read or claimed)
+        self.pel: Dict[int, PendingEntry] = {}   # this consumer's pending entries, by packed ID
+
+
+class ConsumerGroup:
+    """
+    A group's pending entries are indexed twice: `pel` maps packed ID to entry
+    for O(1) lookup and XACK, and `pel_ids` keeps the IDs sorted so XPENDING and
+    XAUTOCLAIM start with a bisect instead of walking the whole PEL. Acknowledged
+    IDs stay in `pel_ids` until compaction and readers skip IDs no longer in
+    `pel`; as entries are usually acknowledged oldest first, `pel_head` moves
+    past acknowledged IDs at the front so they are not skipped over and over.
+    Each consumer also has its own `pel`, so per-consumer reads and counts do not
+    touch the rest of the group.
+    """
+    __slots__ = ('stream', 'name', 'last_id', 'entries_read', 'pel', 'pel_ids', 'pel_head', 'stale', 'consumers')
+
+    def __init__(self, stream: 'Redis_Stream', name: bytes, last_id: int, entries_read: int = -1):
+        self.stream = stream
+        self.name = name
+        self.last_id = last_id              # last ID delivered with >
+        self.entries_read = entries_read    # -1 when unknown
+        self.pel: Dict[int, PendingEntry] = {}
+        self.pel_ids: List[int] = []
+        self.pel_head = 0       # pel_ids before this index are all acknowledged
+        self.stale = 0          # acknowledged IDs still in pel_ids
+        self.consumers: Dict[bytes, Consumer] = {}
+
+    def consumer(self, name: bytes, now: int, create: bool = True) -> Optional[Consumer]:
+        consumer = self.consumers.get(name)
+        if consumer is None and create:
+            consumer = self.consumers[name] = Consumer(name, now)
+            self.stream._account(STREAM_CONSUMER_OVERHEAD + len(name))
+        if consumer is not None:
+            consumer.seen_time = now
+        return consumer
+
+    def delete_consumer(self, name: bytes) -> int:
+        """Remove a consumer, dropping its pending entries. Returns how many it had."""
+        consumer = self.consumers.pop(name)
+        pending = list(consumer.pel)
+        for sid in pending:
+            self.ack(sid)
+        self.stream._account(-(STREAM_CONSUMER_OVERHEAD + len(name)))
+        return len(pending)
+
+    def add_pending(self, sid: int, consumer: Consumer, delivery_time: int, delivery_count: int = 1) -> PendingEntry:
+        """Make sid pending for consumer, moving it from another consumer if needed."""
+        pe = self.pel.get(sid)
+        if pe is not None:
+            del pe.consumer.pel[sid]
+            pe.consumer = consumer
+            pe.delivery_time, pe.delivery_count = delivery_time, delivery_count
+        else:
+            pe = self.pel[sid] = PendingEntry(consumer, delivery_time, delivery_count)
+            ids = self.pel_ids
+            if not ids or sid > ids[-1]:
+                ids.append(sid)
+            else:
+                pos = bisect_left(ids, sid)
+                if pos < len(ids) and ids[pos] == sid:
+                    self.stale -= 1     # acknowledged earlier and still in the index
+                else:
+                    ids.insert(pos, sid)
+                self.pel_head = min(self.pel_head, pos)
+            self.stream._account(STREAM_PEL_ENTRY_OVERHEAD)
+        consumer.pel[sid] = pe
+        return pe
+
+    def ack(self, sid: int) -> bool:
+        pe = self.pel.pop(sid, None)
+        if pe is None:
+            return False
+        del pe.consumer.pel[sid]
+        self.stale += 1
+        ids, head = self.pel_ids, self.pel_head
+        while head < len(ids) and ids[head] not in self.pel:
+            head += 1
+        self.pel_head = head
+        if self.stale > STREAM_PEL_MIN_COMPACT and self.stale * 2 > len(ids):
+            self.pel_ids = [i for i in ids[head:] if i in self.pel]
+            self.pel_head = self.stale = 0
+        self.stream._account(-STREAM_PEL_ENTRY_OVERHEAD)
+        return True
+
+    def pending_ids(self, start: int, end: int = STREAM_ID_MAX) -> Iterator[int]:
+        """Pending IDs with start <= ID <= end, in ID order. The PEL must not change meanwhile."""
+        ids, pel = self.pel_ids, self.pel
+        for i in range(max(self.pel_head, bisect_left(ids, start)), len(ids)):
+            sid = ids[i]
+            if sid > end:
+                return
+            if sid in pel:
+                yield sid
+
+    def last_pending_id(self) -> int:
+        ids, pel = self.pel_ids, self.pel
+        for i in range(len(ids) - 1, -1, -1):
+            if ids[i] in pel:
+                return ids[i]
+        return 0
+
+    def read_new(self, consumer: Consumer, count: Optional[int], noack: bool, now: int) -> List[Tuple[int, Fields]]:
+        """Deliver entries after last_id (XREADGROUP >), adding them to the PEL unless noack."""
+        entries = list(self.stream.range(self.last_id + 1, STREAM_ID_MAX, count))
+        if not entries:
+            return entries
+        self.last_id = entries[-1][0]
+        if self.entries_read >= 0:
+            self.entries_read += len(entries)
+        elif self.last_id == self.stream.last_id:
+            self.entries_read = self.stream.entries_added
+        consumer.active_time = now
+        if not noack:
+            for sid, _ in entries:
+                self.add_pending(sid, consumer, now)
+        return entries
+
+    def read_history(self, consumer: Consumer, after: int, count: Optional[int],
+                     now: int) -> List[Tuple[int, Optional[Fields]]]:
+        """The consumer's own pending entries after `after`; fields are None for deleted entries."""
+        ids = sorted(sid for sid in consumer.pel if sid > after)
+        if count is not None:
+            ids = ids[:count]
+        entries = []
+        for sid in ids:
+            pe = consumer.pel[sid]
+            pe.delivery_time = now
+            pe.delivery_count += 1
+            entries.append((sid, self.stream.lookup_entry(sid)))
+        return entries
+
 
 class Redis_Stream:
-    def __init__(self, key: str):
+    """
+    Entries are kept in ID order in a list of fixed-size nodes, with the first
+    ID of every node in `firsts`. Appending only touches the last node, so XADD
+    is O(1) amortized; a range lookup bisects `firsts` and then the node, so
+    XRANGE and XREAD cost O(log n + k). The last ID and the length are kept up
+    to date rather than computed.
+    """
+    __slots__ = ('key', 'nodes', 'firsts', 'length', 'last_id', 'max_deleted_id', 'entries_added', 'groups', 'mem')
+    encoding = 'stream'
+
+    def __init__(self, key: bytes):
         self.key = key
-        self.data: Dict[int, Dict[int, Dict[str, str]]] = {}  # {timestamp: {seq_no: fields}}
-        self.timestamp_list: List[int] = []  # Ordered list of timestamps
-        self._update_event = asyncio.Event()
-        
-    def clear_update(self) -> None:
-        self._update_event.clear()
+        self.nodes: List[StreamNode] = []
+        self.firsts: List[int] = []      # first ID of each node
+        self.length = 0
+        self.last_id = 0                 # packed ID of the newest entry ever added
+        self.max_deleted_id = 0
+        self.entries_added = 0
+        self.groups: Dict[bytes, ConsumerGroup] = {}
+        self.mem = STREAM_OVERHEAD  # estimated size, kept up to date for maxmemory
 
     def __len__(self) -> int:
-        return sum(len(seqs) for seqs in self.data.values())
-
-    def xadd(self, timestamp: int, seq_no: int, fields: Dict[str, str]) -> str:
-        if timestamp not in self.data:
-            self.data[timestamp] = {}
-            self.timestamp_list.append(timestamp)
-        self.data[timestamp][seq_no] = fields
-        self._update_event.set()
-        return f"{timestamp}-{seq_no}"
+        return self.length
 
-    def timestamp_index(self, timestamp: int) -> int:
-        try:
-            return self.timestamp_list.index(timestamp)
-        except ValueError:
-            return -1
-
-streams: Dict[str, Redis_Stream] = {}
-
-def timestamp_generation(stream_data, time):
-    if time == "*":
-        ms_time = int(datetime.now().timestamp() * 1000)
-        seq_no = max(stream_data.get(ms_time, {}).keys(), default=-1) + 1
-        if ms_time == 0 and seq_no == 0:
-            seq_no = 1 
-    else:
-        ms_time, seq_no = time.split("-", 1) + ["empty"] * (2 - len(time.split("-", 1)))
-        ms_time = int(ms_time)
-        if seq_no == "empty":
-            seq_no = -1
-        elif seq_no == "*":
-            seq_no = max(stream_data.get(ms_time, {}).keys(), default=-1) + 1
-            if ms_time == 0 and seq_no == 0:
-                seq_no = 1 
+    @property
+    def first_id(self) -> int:
+        return self.firsts[0] if self.firsts else 0
+
+    def _account(self, delta: int) -> None:
+        self.mem += delta
+        db.grow(self.encoding, delta)
+
+    def append(self, sid: int, fields: Dict[bytes, bytes]) -> None:
+        """Add an entry; sid must be greater than last_id."""
+        if not self.nodes or len(self.nodes[-1].ids) >= STREAM_NODE_MAX_ENTRIES:
+            self.nodes.append(StreamNode())
+            self.firsts.append(sid)
+            size = STREAM_NODE_OVERHEAD
         else:
-            seq_no = int(seq_no) 
+            size = 0
+        fields = pack_fields(fields)
+        node = self.nodes[-1]
+        node.ids.append(sid)
+        node.fields.append(fields)
+        self.length += 1
+        self.entries_added += 1
+        self.last_id = sid
+        self._account(size + STREAM_ENTRY_OVERHEAD + fields_size(fields))
 
-    return ms_time, seq_no
+    def _find(self, sid: int) -> Optional[Tuple[int, int]]:
+        """(node index, position) of the entry with ID sid, None if there is none."""
+        n = bisect_right(self.firsts, sid) - 1
+        if n < 0:
+            return None
+        node = self.nodes[n]
+        pos = bisect_left(node.ids, sid)
+        if pos == len(node.ids) or node.ids[pos] != sid:
+            return None
+        return n, pos
 
-def get_stream(key: str) -> Redis_Stream:
-    return streams.setdefault(key, Redis_Stream(key))
+    def lookup_entry(self, sid: int) -> Optional[Fields]:
+        found = self._find(sid)
+        return self.nodes[found[0]].fields[found[1]] if found else None
 
-def check_if_stream(key: str) -> bool:
-    return key in streams
+    def delete(self, sid: int) -> bool:
+        """Remove the entry with ID sid, if there is one."""
+        found = self._find(sid)
+        if found is None:
+            return False
+        n, pos = found
+        node = self.nodes[n]
+        del node.ids[pos]
+        size = STREAM_ENTRY_OVERHEAD + fields_size(node.fields.pop(pos))
+        if not node.ids:
+            del self.nodes[n]
+            del self.firsts[n]
+            size += STREAM_NODE_OVERHEAD
+        elif pos == 0:
+            self.firsts[n] = node.ids[0]
+        self.length -= 1
+        self.max_deleted_id = max(self.max_deleted_id, sid)
+        self._account(-size)
+        return True
 
-def xadd(key: str, data_id: str, fields: Dict[str, str]) -> str:
-    stream = get_stream(key)
-    stream_data = stream.data
+    def trim(self, maxlen: Optional[int] = None, minid: Optional[int] = None, approx: bool = False,
+             limit: Optional[int] = None) -> int:
+        """
+        Remove the oldest entries until at most maxlen are left, or until none is
+        older than minid. Returns how many were removed. With approx only whole
+        nodes are dropped, so a few more entries than asked for may stay, and at
+        most limit entries are removed.
+        """
+        removed = size = drop = 0
+        while drop < len(self.nodes):
+            node = self.nodes[drop]
+            if maxlen is not None:
+                excess = self.length - removed - maxlen
+            else:
+                excess = bisect_left(node.ids, minid)
+            if excess <= 0:
+                break
+            if excess < len(node.ids):
+                if not approx:
+                    # Cut the front of this node
+                    size += sum(STREAM_ENTRY_OVERHEAD + fields_size(f) for f in node.fields[:excess])
+                    self.max_deleted_id = max(self.max_deleted_id, node.ids[excess - 1])
+                    del node.ids[:excess]
+                    del node.fields[:excess]
+                    self.firsts[drop] = node.ids[0]
+                    removed += excess
+                break
+            if limit is not None and removed + len(node.ids) > limit:
+                break
+            size += STREAM_NODE_OVERHEAD + sum(STREAM_ENTRY_OVERHEAD + fields_size(f) for f in node.fields)
+            self.max_deleted_id = max(self.max_deleted_id, node.ids[-1])
+            removed += len(node.ids)
+            drop += 1
+        del self.nodes[:drop]
+        del self.firsts[:drop]
+        self.length -= removed
+        self._account(-size)
+        return removed
 
-    ms_time, seq_no = timestamp_generation(stream_data, data_id)
+    def xadd(self, timestamp: int, seq_no: int, fields: Dict[bytes, bytes]) -> str:
+        self.append(pack_id(timestamp, seq_no), fields)
+        return f"{timestamp}-{seq_no}"
 
-    # Check for invalid timestamp or sequence number
-    if ms_time < 0 or seq_no < 0:
-        return "Error code 01"
-    
-    if ms_time == 0 and seq_no == 0:
-        return "Error code 01"
+    def _locate(self, sid: int):
+        """(node index, position) of the first entry with an ID >= sid."""
+        n = bisect_right(self.firsts, sid) - 1
+        if n < 0:
+            return 0, 0
+        pos = bisect_left(self.nodes[n].ids, sid)
+        if pos == len(self.nodes[n].ids):
+            return n + 1, 0
+        return n, pos
+
+    def range(self, start: int, end: int, count: Optional[int] = None) -> Iterator[Tuple[int, Fields]]:
+        """Entries with start <= ID <= end in ID order, at most count of them."""
+        n, pos = self._locate(start)
+        left = count if count is not None else -1
+        while n < len(self.nodes) and left:
+            node = self.nodes[n]
+            ids = node.ids
+            while pos < len(ids) and left:
+                if ids[pos] > end:
+                    return
+                yield ids[pos], node.fields[pos]
+                pos += 1
+                left -= 1
+            n, pos = n + 1, 0
+
+    def revrange(self, start: int, end: int, count: Optional[int] = None) -> Iterator[Tuple[int, Fields]]:
+        """Entries with start <= ID <= end from the newest down, at most count of them."""
+        n = bisect_right(self.firsts, end) - 1
+        if n < 0:
+            return
+        pos = bisect_right(self.nodes[n].ids, end) - 1
+        left = count if count is not None else -1
+        while n >= 0 and left:
+            node = self.nodes[n]
+            ids = node.ids
+            while pos >= 0 and left:
+                if ids[pos] < start:
+                    return
+                yield ids[pos], node.fields[pos]
+                pos -= 1
+                left -= 1
+            n -= 1
+            pos = len(self.nodes[n].ids) - 1
+
+    @property
+    def top_id(self) -> int:
+        """ID of the newest entry still in the stream, 0 if it is empty."""
+        return self.nodes[-1].ids[-1] if self.nodes else 0
 
-    # Check if the ID is in the past
-    for existing_ts in stream_data:
-        if existing_ts > ms_time:
-            return "Error code 02"
-        if existing_ts == ms_time and max(stream_data[existing_ts].keys(), default=0) >= seq_no:
-            return "Error code 02"
+    def entries(self) -> Iterator[Tuple[int, Fields]]:
+        for node in self.nodes:
+            yield from zip(node.ids, node.fields)
 
-    return stream.xadd(ms_time, seq_no, fields)
+    def create_group(self, name: bytes, last_id: int, entries_read: int = -1) -> ConsumerGroup:
+        group = self.groups[name] = ConsumerGroup(self, name, last_id, entries_read)
+        self._account(STREAM_GROUP_OVERHEAD + len(name))
+        return group
 
-def xrange(key: str, start_time: str, end_time: Optional[str] = None) -> str:
+    def destroy_group(self, name: bytes) -> None:
+        group = self.groups.pop(name)
+        self._account(-(STREAM_GROUP_OVERHEAD + len(name) + len(group.pel) * STREAM_PEL_ENTRY_OVERHEAD
+                        + sum(STREAM_CONSUMER_OVERHEAD + len(c) for c in group.consumers)))
+
+
+def next_id(stream: Redis_Stream, data_id: str) -> Optional[int]:
+    """
+    The ID XADD assigns for data_id (*, ms-*, ms or ms-seq), or None when it
+    would not be greater than the stream's last ID. Raises ValueError if malformed.
+    """
+    last_ms, last_seq = unpack_id(stream.last_id)
+    if data_id == "*":
+        ms = max(now_ms(), last_ms)
+        if ms > last_ms:
+            return pack_id(ms, 0)
+        return stream.last_id + 1 if last_seq < STREAM_ID_MAX_SEQ else pack_id(ms + 1, 0)
+    if data_id.endswith("-*"):
+        ms = unpack_id(parse_id(data_id[:-2]))[0]
+        if ms > last_ms or not stream.last_id:
+            return pack_id(ms, 1 if ms == 0 else 0)
+        if ms < last_ms or last_seq == STREAM_ID_MAX_SEQ:
+            return None
+        return stream.last_id + 1
+    sid = parse_id(data_id)
+    return sid if sid > stream.last_id else None
+
+def parse_range_id(text: str, missing_seq: int) -> Optional[int]:
+    """An XRANGE bound: -, +, ms, ms-seq, or (id for an exclusive one. None if it excludes everything."""
+    if text == "-":
+        return 0
+    if text == "+":
+        return STREAM_ID_MAX
+    if text.startswith("("):
+        sid = parse_id(text[1:], missing_seq)
+        if missing_seq:
+            return sid - 1 if sid > 0 else None
+        return sid + 1 if sid < STREAM_ID_MAX else None
+    return parse_id(text, missing_seq)
+
+def write_entry(res: resp.ReplyBuilder, entry_id, fields: Fields) -> None:
+    """Append one stream entry as [ id, [ field, value, ... ] ]."""
+    pairs = field_pairs(fields)
+    res.array(2).bulk(entry_id).array(len(pairs) * 2)
+    for fname, fval in pairs:
+        res.bulk(fname).bulk(fval)
+
+def write_entries(res: resp.ReplyBuilder, entries: List[Tuple[int, Fields]]) -> None:
+    res.array(len(entries))
+    for sid, fields in entries:
+        write_entry(res, format_id(sid), fields)
+
+def get_stream(key: bytes, create: bool = False) -> Optional[Redis_Stream]:
+    """The stream at key; None if missing unless create. Raises WrongTypeError for other types."""
+    stream = lookup_value(key, 'stream')
+    if stream is None and create:
+        stream = Redis_Stream(key)
+        store(key, 'stream', stream)
+    return stream
+
+def xadd(key: bytes, data_id: str, fields: Dict[bytes, bytes], nomkstream: bool = False,
+         trim: Optional[dict] = None) -> Optional[str]:
+    """
+    Add an entry and return its ID; None if the key is missing and nomkstream.
+    trim holds Redis_Stream.trim arguments, applied once the entry is added.
+    """
     stream = get_stream(key)
-    stream_data = stream.data
+    # The key is only created once the ID has been accepted
+    created = stream is None
+    if created:
+        if nomkstream:
+            return None
+        stream = Redis_Stream(key)
+
+    if data_id != "*" and not data_id.endswith("-*") and parse_id(data_id) == 0:
+        return "Error code 01"
+    sid = next_id(stream, data_id)
+    if sid is None:
+        return "Error code 02"
+
+    if created:
+        store(key, 'stream', stream)
+    stream.append(sid, fields)
+    if trim:
+        stream.trim(**trim)
+    blocking.signal(key)
+    return format_id(sid).decode()
+
+def xrange(key: bytes, start_time: str, end_time: Optional[str] = None, count: Optional[int] = None,
+           rev: bool = False) -> bytes:
+    """XRANGE, or XREVRANGE with rev: the bounds are still given as start, end."""
     if not end_time:
         end_time = start_time
+    start = parse_range_id(start_time, 0)
+    end = parse_range_id(end_time, STREAM_ID_MAX_SEQ)
+    stream = get_stream(key)
+    if stream is None or start is None or end is None or count == 0:
+        return resp.EMPTY_ARRAY
+    entries = stream.revrange(start, end, count) if rev else stream.range(start, end, count)
+    res = resp.ReplyBuilder()
+    write_entries(res, list(entries))
+    return res.getvalue()
+
+def xlen(key: bytes) -> int:
+    stream = get_stream(key)
+    return len(stream) if stream is not None else 0
 
-    # Handle empty stream
-    if not stream.timestamp_list:
-        return "*0\r\n"
+def xdel(key: bytes, ids: List[int]) -> int:
+    stream = get_stream(key)
+    if stream is None:
+        return 0
+    return sum(stream.delete(sid) for sid in ids)
 
-    try:
-        if start_time == "-":
-            start_timestamp, start_seq_no = int(stream.timestamp_list[0]), 0
-        else:
-            start_timestamp, start_seq_no = timestamp_generation(stream_data, start_time)
-            start_seq_no = 0 if start_seq_no == -1 else start_seq_no
+def xtrim(key: bytes, trim: dict) -> int:
+    stream = get_stream(key)
+    return stream.trim(**trim) if stream is not None else 0
 
-        if end_time == "+":
-            end_timestamp, end_seq_no = int(stream.timestamp_list[-1]), float("inf")
-        else:
-            end_timestamp, end_seq_no = timestamp_generation(stream_data, end_time)
-            end_seq_no = float("inf") if end_seq_no == -1 else end_seq_no
-        
-        print(f"XRANGE: key={key}, start={start_timestamp}-{start_seq_no}, end={end_timestamp}-{end_seq_no}")
-        start_idx = stream.timestamp_index(start_timestamp)
-        end_idx = stream.timestamp_index(end_timestamp)
+def xsetid(key: bytes, last_id: int, entries_added: Optional[int] = None,
+           max_deleted_id: Optional[int] = None) -> None:
+    """Set a stream's last ID and counters, as an AOF rewrite does. Raises ValueError."""
+    stream = get_stream(key)
+    if stream is None:
+        raise ValueError("no such key")
+    if last_id < stream.top_id:
+        raise ValueError("The ID specified in XSETID is smaller than the target stream top item")
+    if entries_added is not None and entries_added < len(stream):
+        raise ValueError("The entries_added specified in XSETID is smaller than the target stream length")
+    if max_deleted_id is not None and max_deleted_id > last_id:
+        raise ValueError("The ID specified in XSETID is smaller than the provided max_deleted_entry_id")
+    stream.last_id = last_id
+    if entries_added is not None:
+        stream.entries_added = entries_added
+    if max_deleted_id is not None:
+        stream.max_deleted_id = max_deleted_id
 
-        if start_idx == -1 or end_idx == -1:
-            return "*0\r\n"  # Timestamps not found
+def _read_after(key: bytes, sid: int, count: Optional[int]) -> Optional[List[Tuple[int, Fields]]]:
+    """Entries of the stream at key after sid, None if there are none."""
+    stream = get_stream(key)
+    if stream is None or stream.last_id <= sid or sid == STREAM_ID_MAX:
+        return None
+    return list(stream.range(sid + 1, STREAM_ID_MAX, count)) or None
 
-        # Collect all entries in the range
-        entries = []
-        for i in range(start_idx, end_idx + 1):
-            timestamp = stream.timestamp_list[i]
-            start_seq = start_seq_no if i == start_idx else 0
-            end_seq = end_seq_no if i == end_idx else float("inf")
-
-            for seq_no in sorted(stream_data.get(timestamp, {}).keys()):
-                if start_seq <= seq_no <= end_seq:
-                    entries.append((timestamp, seq_no))
-
-        # Build RESP array
-        res = f"*{len(entries)}\r\n"
-        for timestamp, seq_no in entries:
-            message_id = f"{timestamp}-{seq_no}"
-            fields = stream_data[timestamp][seq_no]
-            res += f"*2\r\n${len(message_id)}\r\n{message_id}\r\n*{len(fields)*2}\r\n"
-            for key, value in fields.items():
-                res += f"${len(key)}\r\n{key}\r\n${len(value)}\r\n{value}\r\n"
-
-        return res
-    except Exception as e:
-        print(f"Error in xrange: {str(e)}")
-        raise
-
-async def xread(keys: List[str], data_ids: List[str], block_ms: Optional[int] = None) -> str:
-    async def check_stream(key, data_id):
-        stream = get_stream(key)
-        stream_data = stream.data
-        # Parse the last-seen ID
-        if data_id == "$":
-            if stream.timestamp_list:
-                last_ts = stream.timestamp_list[-1]
-                last_seq = max(stream_data.get(last_ts, {}).keys(), default=0)
-                ms_time, seq_no_int = last_ts, last_seq
+def _write_streams(found: List[Tuple[bytes, list]]) -> bytes:
+    """[ [ key, entries ], ... ]; fields are None for entries deleted while pending."""
+    res = resp.ReplyBuilder().array(len(found))
+    for key, entries in found:
+        res.array(2).bulk(key).array(len(entries))
+        for sid, fields in entries:
+            if fields is None:
+                res.array(2).bulk(format_id(sid)).array(-1)
             else:
-                ms_time, seq_no_int = 0, 0
+                write_entry(res, format_id(sid), fields)
+    return res.getvalue()
+
+async def xread(keys: List[bytes], data_ids: List[str], block_ms: Optional[int] = None,
+                count: Optional[int] = None) -> bytes:
+    # $ means entries added after the call, so it is resolved once, before blocking
+    after = {}
+    for key, data_id in zip(keys, data_ids):
+        if data_id == "$":
+            stream = get_stream(key)
+            after[key] = stream.last_id if stream is not None else 0
         else:
-            try:
-                ms_str, seq_str = data_id.split("-", 1)
-                ms_time = int(ms_str)
-                seq_no_int = int(seq_str)
-            except (ValueError, IndexError):
-                ms_time, seq_no_int = 0, 0
-        # Collect only the next message for this stream
-        stream_entries: list[tuple[str, dict[str, str]]] = []
-        if ms_time in stream_data:
-            seqs = sorted(stream_data[ms_time].keys())
-            # Next seq in same timestamp
-            next_seq = next((s for s in seqs if s > seq_no_int), None)
-            if next_seq is not None:
-                stream_entries.append((f"{ms_time}-{next_seq}", stream_data[ms_time][next_seq]))
-            else:
-                # Try the first message in the next timestamp
-                idx = stream.timestamp_index(ms_time)
-                if 0 <= idx + 1 < len(stream.timestamp_list):
-                    nxt_ts = stream.timestamp_list[idx + 1]
-                    nxt_seqs = sorted(stream_data.get(nxt_ts, {}).keys())
-                    if nxt_seqs:
-                        s = nxt_seqs[0]
-                        stream_entries.append((f"{nxt_ts}-{s}", stream_data[nxt_ts][s]))
-                        
-        return key, stream_entries
-
-    if block_ms == 0:
-        for i, did in enumerate(data_ids):
-            if did == "$":
-                stream = get_stream(keys[i])
-                if stream.timestamp_list:
-                    last_ts = stream.timestamp_list[-1]
-                    last_seq = max(stream.data.get(last_ts, {}).keys(), default=0)
-                else:
-                    last_ts, last_seq = 0, 0
-                data_ids[i] = f"{last_ts}-{last_seq}"    
-    
-    start_time = asyncio.get_event_loop().time() * 1000
+            after[key] = parse_id(data_id)
+
+    found = [(key, entries) for key in after if (entries := _read_after(key, after[key], count))]
+    if found:
+        # Only streams with new entries are in the reply
+        return _write_streams(found)
+    if block_ms is None:
+        return resp.NIL_ARRAY
+
+    def serve(key: bytes) -> Optional[bytes]:
+        entries = _read_after(key, after[key], count)
+        return _write_streams([(key, entries)]) if entries else None
+
+    reply = await blocking.block(list(after), block_ms / 1000.0 if block_ms else None, serve, blocking.XREAD)
+    return reply if reply is not None else resp.NIL_ARRAY
+
+def no_group(key: bytes, group: bytes) -> StreamError:
+    return StreamError(f"NOGROUP No such key '{key.decode(errors='replace')}' or consumer group "
+                       f"'{group.decode(errors='replace')}'")
+
+def get_group(key: bytes, group: bytes) -> ConsumerGroup:
+    """The consumer group of the stream at key. Raises StreamError (NOGROUP) or WrongTypeError."""
+    stream = get_stream(key)
+    cg = stream.groups.get(group) if stream is not None else None
+    if cg is None:
+        raise no_group(key, group)
+    return cg
+
+def group_start_id(stream: Redis_Stream, text: bytes) -> int:
+    """The last-delivered ID given to XGROUP CREATE or SETID: an ID, or $ for the stream's last one."""
+    return stream.last_id if text == b"$" else parse_id(text)
+
+def xgroup_create(key: bytes, group: bytes, id_text: bytes, mkstream: bool = False,
+                  entries_read: Optional[int] = None) -> None:
+    stream = get_stream(key, create=mkstream)
+    if stream is None:
+        raise ValueError("The XGROUP subcommand requires the key to exist. Note that for CREATE you may "
+                         "want to use the MKSTREAM option to create an empty stream automatically.")
+    if group in stream.groups:
+        raise StreamError("BUSYGROUP Consumer Group name already exists")
+    last_id = group_start_id(stream, id_text)
+    if entries_read is None:
+        entries_read = stream.entries_added if id_text == b"$" else (0 if last_id == 0 else -1)
+    stream.create_group(group, last_id, entries_read)
+
+def xgroup_setid(key: bytes, group: bytes, id_text: bytes, entries_read: Optional[int] = None) -> None:
+    cg = get_group(key, group)
+    cg.last_id = group_start_id(cg.stream, id_text)
+    if entries_read is None:
+        entries_read = cg.stream.entries_added if id_text == b"$" else -1
+    cg.entries_read = entries_read
+
+def xgroup_destroy(key: bytes, group: bytes) -> bool:
+    stream = get_stream(key)
+    if stream is None or group not in stream.groups:
+        return False
+    stream.destroy_group(group)
+    # Blocked readers find the group gone and fail with NOGROUP
+    blocking.signal(key)
+    return True
+
+def xgroup_createconsumer(key: bytes, group: bytes, consumer: bytes) -> bool:
+    cg = get_group(key, group)
+    if consumer in cg.consumers:
+        return False
+    cg.consumer(consumer, now_ms())
+    return True
+
+def xgroup_delconsumer(key: bytes, group: bytes, consumer: bytes) -> int:
+    cg = get_group(key, group)
+    return cg.delete_consumer(consumer) if consumer in cg.consumers else 0
+
+async def xreadgroup(group: bytes, consumer: bytes, keys: List[bytes], data_ids: List[bytes],
+                     block_ms: Optional[int] = None, count: Optional[int] = None, noack: bool = False):
+    """
+    > reads entries never delivered to the group and adds them to the PEL; any
+    other ID reads back the consumer's own pending entries after it, and never blocks.
+    Returns the reply and whether it was served after blocking, in which case
+    the read has been propagated already. A read that timed out changed nothing
+    but the consumer list, and is propagated like a non-blocking one.
+    """
+    after = [None if d == b">" else parse_id(d) for d in data_ids]
+    for key in keys:
+        get_group(key, group)
+
+    now = now_ms()
+    found = []
+    for key, since in zip(keys, after):
+        cg = get_group(key, group)
+        reader = cg.consumer(consumer, now)
+        if since is None:
+            entries = cg.read_new(reader, count, noack, now)
+        else:
+            entries = cg.read_history(reader, since, count, now)
+        if entries or since is not None:
+            found.append((key, entries))
+    if found:
+        return _write_streams(found), False
     if block_ms is None:
-        timeout = 0.0
-    elif block_ms == 0:
-        timeout = None
+        return resp.NIL_ARRAY, False
+
+    def serve(key: bytes) -> Optional[bytes]:
+        try:
+            cg = get_group(key, group)
+        except (StreamError, WrongTypeError):
+            return resp.error(str(no_group(key, group)))
+        now = now_ms()
+        entries = cg.read_new(cg.consumer(consumer, now), count, noack, now)
+        if not entries:
+            return None
+        blocking.propagate("xreadgroup", [b"GROUP", group, consumer] + ([b"COUNT", b"%d" % count] if count else [])
+                           + ([b"NOACK"] if noack else []) + [b"STREAMS", key, b">"])
+        return _write_streams([(key, entries)])
+
+    reply = await blocking.block(keys, block_ms / 1000.0 if block_ms else None, serve, group)
+    if reply is None:
+        return resp.NIL_ARRAY, False
+    return reply, True
+
+def xack(key: bytes, group: bytes, ids: List[int]) -> int:
+    stream = get_stream(key)
+    cg = stream.groups.get(group) if stream is not None else None
+    if cg is None:
+        return 0
+    return sum(cg.ack(sid) for sid in ids)
+
+def xpending_summary(key: bytes, group: bytes) -> bytes:
+    """[count, smallest ID, greatest ID, [[consumer, count], ...]]"""
+    cg = get_group(key, group)
+    if not cg.pel:
+        return resp.ReplyBuilder().array(4).integer(0).bulk(None).bulk(None).raw(resp.NIL_ARRAY).getvalue()
+    first = next(cg.pending_ids(0))
+    res = resp.ReplyBuilder().array(4).integer(len(cg.pel))
+    res.bulk(format_id(first)).bulk(format_id(cg.last_pending_id()))
+    busy = [c for c in cg.consumers.values() if c.pel]
+    res.array(len(busy))
+    for c in busy:
+        res.array(2).bulk(c.name).bulk(len(c.pel))
+    return res.getvalue()
+
+def xpending_range(key: bytes, group: bytes, start: int, end: int, count: int,
+                   consumer: Optional[bytes] = None, min_idle: int = 0) -> bytes:
+    """[[id, consumer, idle ms, delivery count], ...] for up to count pending entries in the range."""
+    cg = get_group(key, group)
+    now = now_ms()
+    if consumer is not None:
+        owner = cg.consumers.get(consumer)
+        ids = iter(sorted(sid for sid in owner.pel if start <= sid <= end)) if owner else iter(())
     else:
-        timeout = block_ms / 1000.0
-        
-    streams = [get_stream(key) for key in keys]
-    for stream in streams:
-        stream.clear_update()
-    
-    while True:
-        resp = f"*{len(keys)}\r\n"
-        has_data = False
-        for key, data_id in zip(keys, data_ids):    
-            key, stream_entries = await check_stream(key, data_id)     
-            # Serialize this stream’s block
-            resp += f"*2\r\n"                     # [ key, entries ]
-            resp += f"${len(key)}\r\n{key}\r\n"
-            resp += f"*{len(stream_entries)}\r\n"
-            for msg_id, fields in stream_entries:
-                has_data = True
-                resp += f"*2\r\n"               # [ id, [ field, value... ] ]
-                resp += f"${len(msg_id)}\r\n{msg_id}\r\n"
-                resp += f"*{len(fields) * 2}\r\n"
-                for fname, fval in fields.items():
-                    resp += f"${len(fname)}\r\n{fname}\r\n"
-                    resp += f"${len(fval)}\r\n{fval}\r\n"
-
-        if has_data:
-            return resp
-        if block_ms is None:
-            return "$-1\r\n"
-        # If timed out, return nil
-        tasks = [asyncio.create_task(s._update_event.wait()) for s in streams]
-        done, pending = await asyncio.wait(
-            tasks,
-            return_when=asyncio.FIRST_COMPLETED,
-            timeout=timeout
-        )
-        # Cancel any still-pending waits
-        for t in pending:
-            t.cancel()
-        # Clear events on streams that actually fired
-        for s in streams:
-            if s._update_event.is_set():
-                s.clear_update()
-        # If we timed out (no tasks done), return nil bulk
-        if not done:
-            return "$-1\r\n"   
\ No newline at end of file
+        ids = cg.pending_ids(start, end)
+    rows = []
+    for sid in ids:
+        if len(rows) >= count:
+            break
+        pe = cg.pel[sid]
+        idle = max(0, now - pe.delivery_time)
+        if idle >= min_idle:
+            rows.append((sid, pe.consumer.name, idle, pe.delivery_count))
+    res = resp.ReplyBuilder().array(len(rows))
+    for sid, name, idle, deliveries in rows:
+        res.array(4).bulk(format_id(sid)).bulk(name).integer(idle).integer(deliveries)
+    return res.getvalue()
+
+def xclaim(key: bytes, group: bytes, consumer: bytes, min_idle: int, ids: List[int],
+           delivery_time: Optional[int] = None, retry_count: Optional[int] = None, force: bool = False,
+           justid: bool = False, last_id: Optional[int] = None, now: Optional[int] = None):
+    """
+    Move pending entries idle for at least min_idle ms to consumer. Entries no longer
+    in the stream are dropped from the PEL.
+    Returns (claimed (ID, fields) pairs, IDs dropped as deleted).
+    """
+    cg = get_group(key, group)
+    stream = cg.stream
+    now = now if now is not None else now_ms()
+    if last_id is not None and last_id > cg.last_id:
+        cg.last_id = last_id
+    claimer = cg.consumer(consumer, now)
+    claimed, deleted = [], []
+    for sid in ids:
+        fields = stream.lookup_entry(sid)
+        pe = cg.pel.get(sid)
+        if pe is None:
+            if not force or fields is None:
+                continue
+            pe = cg.add_pending(sid, claimer, now, 0)
+        elif fields is None:
+            cg.ack(sid)
+            deleted.append(sid)
+            continue
+        elif min_idle and now - pe.delivery_time < min_idle:
+            continue
+        count = retry_count if retry_count is not None else pe.delivery_count + (0 if justid else 1)
+        cg.add_pending(sid, claimer, delivery_time if delivery_time is not None else now, count)
+        claimed.append((sid, fields))
+    if claimed:
+        claimer.active_time = now
+    return claimed, deleted
+
+def xautoclaim(key: bytes, group: bytes, consumer: bytes, min_idle: int, start: int, count: int,
+               justid: bool = False, now: Optional[int] = None):
+    """
+    Claim up to count entries idle for min_idle ms, scanning the PEL from start and
+    examining at most count * STREAM_AUTOCLAIM_ATTEMPTS_FACTOR of them.
+    Returns (next cursor, claimed (ID, fields) pairs, IDs dropped as deleted).
+    """
+    cg = get_group(key, group)
+    stream = cg.stream
+    now = now if now is not None else now_ms()
+    claimer = cg.consumer(consumer, now)
+    attempts = count * STREAM_AUTOCLAIM_ATTEMPTS_FACTOR
+    scanned, cursor = [], 0
+    for sid in cg.pending_ids(start):
+        if len(scanned) >= attempts:
+            cursor = sid
+            break
+        scanned.append(sid)
+    claimed, deleted = [], []
+    for i, sid in enumerate(scanned):
+        if len(claimed) >= count:
+            cursor = sid
+            break
+        pe = cg.pel[sid]
+        fields = stream.lookup_entry(sid)
+        if fields is None:
+            cg.ack(sid)
+            deleted.append(sid)
+            continue
+        if min_idle and now - pe.delivery_time < min_idle:
+            continue
+        cg.add_pending(sid, claimer, now, pe.delivery_count + (0 if justid else 1))
+        claimed.append((sid, fields))
+    if claimed:
+        claimer.active_time = now
+    return cursor, claimed, deleted
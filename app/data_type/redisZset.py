@@ -0,0 +1,335 @@
+import math
+from bisect import bisect_left, bisect_right
+from typing import List, Optional, Tuple
+from data_type.keyspace import lookup_value, store, delete, db, BYTES_OVERHEAD
+from data_type.listpack import Listpack
+from data_type.sortedindex import SortedIndex, TOP
+import data_type.blocking as blocking
+
+# Small sorted sets are one listpack of member, score pairs in score order and
+# become a skiplist once they pass either limit, as with Redis'
+# zset-max-listpack-entries and zset-max-listpack-value. Both can be changed
+# with configure(). The skiplist encoding is a member -> score dict next to a
+# SortedIndex of (score, member); it keeps Redis' name for OBJECT ENCODING.
+ZSET_MAX_LISTPACK_ENTRIES = 128
+ZSET_MAX_LISTPACK_VALUE = 64
+# Estimated bytes of an empty sorted set in each encoding, and per skiplist member on top of its bytes
+ZSET_LISTPACK_OVERHEAD = 150
+ZSET_OVERHEAD = 700
+ZSET_MEMBER_OVERHEAD = 190 + BYTES_OVERHEAD
+
+max_listpack_entries = ZSET_MAX_LISTPACK_ENTRIES
+max_listpack_value = ZSET_MAX_LISTPACK_VALUE
+
+def configure(entries: int, value: int) -> None:
+    global max_listpack_entries, max_listpack_value
+    max_listpack_entries, max_listpack_value = entries, value
+
+def parse_score(text: bytes) -> float:
+    """A score as Redis' strtod reads it: a float, inf, +inf or -inf. Raises ValueError."""
+    try:
+        if text.strip() != text or b"_" in text:
+            raise ValueError
+        score = float(text)
+    except ValueError:
+        raise ValueError("value is not a valid float")
+    if math.isnan(score):
+        raise ValueError("value is not a valid float")
+    return score
+
+def format_score(score: float) -> bytes:
+    """The shortest text that reads back as score, the way Redis replies with scores."""
+    if math.isinf(score):
+        return b"inf" if score > 0 else b"-inf"
+    if score.is_integer() and abs(score) < 1e17:
+        return b"%d" % score
+    return repr(score).encode()
+
+
+class Redis_ZSet:
+    __slots__ = ('name', 'entries', 'scores', 'encoding', 'mem')
+
+    def __init__(self, name: bytes):
+        self.name = name
+        self.entries = Listpack()     # member, score, member, score... or a SortedIndex once converted
+        self.scores = None            # member -> score, for the skiplist encoding
+        self.encoding = 'listpack'
+        self.mem = ZSET_LISTPACK_OVERHEAD + self.entries.nbytes   # estimated size, kept up to date for maxmemory
+
+    def __len__(self) -> int:
+        if self.encoding == 'listpack':
+            return len(self.entries) // 2
+        return len(self.scores)
+
+    def _account(self, delta: int) -> None:
+        self.mem += delta
+        db.grow(self.encoding, delta)
+
+    def _pairs(self) -> List[Tuple[float, bytes]]:
+        """The (score, member) items of a listpack, in order."""
+        it = iter(self.entries)
+        return [(float(score), member) for member, score in zip(it, it)]
+
+    def _convert(self) -> None:
+        old_mem = self.mem
+        items = self._pairs()
+        self.entries = SortedIndex(items)
+        self.scores = {member: score for score, member in items}
+        self.encoding = 'skiplist'
+        self.mem = ZSET_OVERHEAD + sum(ZSET_MEMBER_OVERHEAD + len(m) for m in self.scores)
+        db.convert('listpack', old_mem, 'skiplist', self.mem)
+
+    def score(self, member: bytes) -> Optional[float]:
+        if self.encoding == 'listpack':
+            i = self.entries.find(member, skip=1)
+            return float(self.entries[i + 1]) if i >= 0 else None
+        return self.scores.get(member)
+
+    def add(self, member: bytes, score: float) -> None:
+        """Add member, or move it to score."""
+        if self.encoding == 'listpack':
+            lp = self.entries
+            i = lp.find(member, skip=1)
+            if i < 0 and (len(lp) // 2 >= max_listpack_entries or len(member) > max_listpack_value):
+                self._convert()
+            else:
+                before = lp.nbytes
+                if i >= 0:
+                    lp.delete_range(i, 2)
+                pos = 2 * bisect_left(self._pairs(), (score, member))
+                lp.insert(pos, member)
+                lp.insert(pos + 1, format_score(score))
+                self._account(lp.nbytes - before)
+                return
+        old = self.scores.get(member)
+        if old is not None:
+            self.entries.remove((old, member))
+        else:
+            self._account(ZSET_MEMBER_OVERHEAD + len(member))
+        self.scores[member] = score
+        self.entries.add((score, member))
+
+    def extend(self, pairs) -> None:
+        """Add many (member, score) pairs at once, as when loading a snapshot."""
+        pairs = list(pairs)
+        if self.encoding == 'listpack' and (len(self) + len(pairs) > max_listpack_entries
+                                            or any(len(member) > max_listpack_value for member, _ in pairs)):
+            self._convert()
+        if self.encoding == 'listpack':
+            for member, score in pairs:
+                self.add(member, score)
+            return
+        self.scores.update(pairs)
+        self.entries = SortedIndex(sorted((score, member) for member, score in self.scores.items()))
+        self._account(ZSET_OVERHEAD + sum(ZSET_MEMBER_OVERHEAD + len(m) for m in self.scores) - self.mem)
+
+    def remove(self, member: bytes) -> bool:
+        if self.encoding == 'listpack':
+            lp = self.entries
+            i = lp.find(member, skip=1)
+            if i < 0:
+                return False
+            before = lp.nbytes
+            lp.delete_range(i, 2)
+            self._account(lp.nbytes - before)
+            return True
+        score = self.scores.pop(member, None)
+        if score is None:
+            return False
+        self.entries.remove((score, member))
+        self._account(-(ZSET_MEMBER_OVERHEAD + len(member)))
+        return True
+
+    def bisect(self, item, right: bool = False) -> int:
+        """Rank of the first item >= item, or > item if right. item may use TOP as the member."""
+        if self.encoding == 'listpack':
+            return (bisect_right if right else bisect_left)(self._pairs(), item)
+        return self.entries.bisect_right(item) if right else self.entries.bisect_left(item)
+
+    def range(self, start: int, stop: int) -> List[Tuple[float, bytes]]:
+        """Items of rank start to stop - 1, with 0 <= start <= stop <= len."""
+        if self.encoding == 'listpack':
+            return self._pairs()[start:stop]
+        return self.entries.slice(start, stop)
+
+    def remove_range(self, start: int, stop: int) -> List[Tuple[float, bytes]]:
+        """Remove and return the items of rank start to stop - 1."""
+        if self.encoding == 'listpack':
+            lp = self.entries
+            removed = self._pairs()[start:stop]
+            before = lp.nbytes
+            lp.delete_range(2 * start, 2 * len(removed))
+            self._account(lp.nbytes - before)
+            return removed
+        removed = self.entries.delete_slice(start, stop)
+        for score, member in removed:
+            del self.scores[member]
+        self._account(-sum(ZSET_MEMBER_OVERHEAD + len(member) for score, member in removed))
+        return removed
+
+    def items(self):
+        """(member, score) pairs in order."""
+        items = self._pairs() if self.encoding == 'listpack' else self.entries
+        for score, member in items:
+            yield member, score
+
+# Score and lex ranges, as parsed from ZRANGE-style arguments
+
+def parse_score_bound(text: bytes) -> Tuple[float, bool]:
+    """(score, exclusive) for a min or max like 1.5, (1.5, -inf or +inf. Raises ValueError."""
+    exclusive = text.startswith(b"(")
+    try:
+        return parse_score(text[1:] if exclusive else text), exclusive
+    except ValueError:
+        raise ValueError("min or max is not a float")
+
+def parse_lex_bound(text: bytes):
+    """(member, exclusive) for [a or (a; '-' and '+' stay as they are. Raises ValueError."""
+    if text in (b"-", b"+"):
+        return text
+    if text[:1] in (b"[", b"("):
+        return text[1:], text[:1] == b"("
+    raise ValueError("min or max not valid string range item")
+
+def score_range(z: Redis_ZSet, lo, hi) -> Tuple[int, int]:
+    """Ranks [start, stop) of the items with lo <= score <= hi, bounds as from parse_score_bound."""
+    (low, low_ex), (high, high_ex) = lo, hi
+    start = z.bisect((low, TOP), right=True) if low_ex else z.bisect((low, b""))
+    stop = z.bisect((high, b"")) if high_ex else z.bisect((high, TOP), right=True)
+    return start, max(start, stop)
+
+def lex_range(z: Redis_ZSet, lo, hi) -> Tuple[int, int]:
+    """
+    Ranks [start, stop) of the members between lo and hi, bounds as from
+    parse_lex_bound. Like Redis this assumes all members have the same score.
+    """
+    if not len(z):
+        return 0, 0
+    score = z.range(0, 1)[0][0]
+
+    def position(bound, is_low: bool) -> int:
+        if bound == b"-":
+            return 0
+        if bound == b"+":
+            return len(z)
+        member, exclusive = bound
+        # Past the bound's member when it is excluded from below or included from above
+        return z.bisect((score, member), right=exclusive == is_low)
+
+    start, stop = position(lo, True), position(hi, False)
+    return start, max(start, stop)
+
+# convenience API
+def get_zset(key: bytes, create: bool = False) -> Optional[Redis_ZSet]:
+    """The sorted set at key; None if missing unless create. Raises WrongTypeError for other types."""
+    z = lookup_value(key, 'zset')
+    if z is None and create:
+        z = Redis_ZSet(key)
+        store(key, 'zset', z)
+    return z
+
+def zadd(key: bytes, pairs: List[Tuple[float, bytes]], nx: bool = False, xx: bool = False,
+         gt: bool = False, lt: bool = False, ch: bool = False, incr: bool = False):
+    """
+    ZADD with its flags. Returns the number of members added (and changed with
+    ch), or with incr the new score, None if the flags stopped the update.
+    Raises ValueError if an increment makes the score NaN.
+    """
+    z = get_zset(key)
+    if z is None:
+        if xx:
+            return None if incr else 0
+        z = get_zset(key, create=True)
+    added = changed = 0
+    result = None
+    for score, member in pairs:
+        current = z.score(member)
+        if current is None:
+            if xx:
+                continue
+            z.add(member, score)
+            added += 1
+            result = score
+            continue
+        if nx:
+            continue
+        if incr:
+            score += current
+            if math.isnan(score):
+                raise ValueError("resulting score is not a number (NaN)")
+        if (gt and score <= current) or (lt and score >= current):
+            continue
+        result = score
+        if score != current:
+            z.add(member, score)
+            changed += 1
+    if not len(z):
+        delete(key)
+    elif added:
+        blocking.signal(key)
+    if incr:
+        return result
+    return added + changed if ch else added
+
+def zincrby(key: bytes, increment: float, member: bytes) -> float:
+    return zadd(key, [(increment, member)], incr=True)
+
+def zscore(key: bytes, member: bytes) -> Optional[float]:
+    z = get_zset(key)
+    return z.score(member) if z is not None else None
+
+def zrank(key: bytes, member: bytes, rev: bool = False) -> Optional[Tuple[int, float]]:
+    """(rank, score) of member, None if it is not there."""
+    z = get_zset(key)
+    if z is None:
+        return None
+    score = z.score(member)
+    if score is None:
+        return None
+    rank = z.bisect((score, member))
+    return (len(z) - 1 - rank if rev else rank), score
+
+def zrem(key: bytes, members: List[bytes]) -> int:
+    z = get_zset(key)
+    if z is None:
+        return 0
+    removed = sum(z.remove(m) for m in members)
+    if not len(z):
+        # Empty sorted sets are removed, as in Redis
+        delete(key)
+    return removed
+
+def zcard(key: bytes) -> int:
+    z = get_zset(key)
+    return len(z) if z is not None else 0
+
+def zcount(key: bytes, lo, hi) -> int:
+    z = get_zset(key)
+    if z is None:
+        return 0
+    start, stop = score_range(z, lo, hi)
+    return stop - start
+
+def zpop(key: bytes, count: int, where: str = 'min') -> List[Tuple[bytes, float]]:
+    """Pop up to count (member, score) pairs from the 'min' or 'max' end."""
+    z = get_zset(key)
+    if z is None:
+        return []
+    n = min(count, len(z))
+    if where == 'min':
+        popped = z.remove_range(0, n)
+    else:
+        popped = z.remove_range(len(z) - n, len(z))[::-1]
+    if not len(z):
+        delete(key)
+    return [(member, score) for score, member in popped]
+
+def zremrangebyscore(key: bytes, lo, hi) -> int:
+    z = get_zset(key)
+    if z is None:
+        return 0
+    start, stop = score_range(z, lo, hi)
+    removed = len(z.remove_range(start, stop))
+    if not len(z):
+        delete(key)
+    return removed
@@ -0,0 +1,117 @@
+"""
+SlotDict: the dict encoding of hashes and sets, with cursors for HSCAN and SSCAN.
+
+A Python dict cannot resume an iteration after it was modified, so next to
+the dict from member to slot we keep the members and values in slot lists in
+the order they were added, each slot tagged with an increasing sequence
+number, the same scheme as the keyspace uses for SCAN. A cursor is a sequence
+number: a scan resumes with a binary search and visits COUNT slots. Deleted
+members leave holes that are squeezed out once they make up half the slots;
+compaction keeps the order and the sequence numbers, so a member present
+for the whole scan is returned exactly once.
+"""
+import random
+from array import array
+from bisect import bisect_left
+from typing import List, Optional, Tuple
+
+SLOTDICT_MIN_COMPACT_HOLES = 64
+
+_MISSING = object()
+
+
+class SlotDict:
+    __slots__ = ('_index', '_keys', '_values', '_seqs', '_next_seq', '_holes')
+
+    def __init__(self, items=()):
+        self._index = {}            # member -> slot
+        self._keys = []             # members by slot, None where one was deleted
+        self._values = []
+        self._seqs = array('q')     # scan sequence number of each slot, ascending
+        self._next_seq = 1          # 0 is the cursor that starts a scan
+        self._holes = 0
+        for key, value in items:
+            self[key] = value
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key) -> bool:
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def get(self, key, default=None):
+        slot = self._index.get(key)
+        return default if slot is None else self._values[slot]
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def __setitem__(self, key, value) -> None:
+        slot = self._index.get(key)
+        if slot is not None:
+            self._values[slot] = value
+            return
+        self._index[key] = len(self._keys)
+        self._keys.append(key)
+        self._values.append(value)
+        self._seqs.append(self._next_seq)
+        self._next_seq += 1
+
+    def add_new(self, keys, value=None) -> None:
+        """Add keys that are not in the dict yet, all with value, in one go."""
+        keys = list(keys)
+        start = len(self._keys)
+        self._index.update(zip(keys, range(start, start + len(keys))))
+        self._keys += keys
+        self._values += [value] * len(keys)
+        self._seqs.extend(range(self._next_seq, self._next_seq + len(keys)))
+        self._next_seq += len(keys)
+
+    def pop(self, key, default=_MISSING):
+        slot = self._index.pop(key, None)
+        if slot is None:
+            if default is _MISSING:
+                raise KeyError(key)
+            return default
+        value = self._values[slot]
+        self._keys[slot] = self._values[slot] = None
+        self._holes += 1
+        if self._holes > SLOTDICT_MIN_COMPACT_HOLES and self._holes * 2 > len(self._keys):
+            self._compact()
+        return value
+
+    def _compact(self) -> None:
+        keys, values, seqs = [], [], array('q')
+        for key, value, seq in zip(self._keys, self._values, self._seqs):
+            if key is not None:
+                self._index[key] = len(keys)
+                keys.append(key)
+                values.append(value)
+                seqs.append(seq)
+        self._keys, self._values, self._seqs, self._holes = keys, values, seqs, 0
+
+    def keys(self):
+        return self._index.keys()
+
+    def items(self):
+        values = self._values
+        for key, slot in self._index.items():
+            yield key, values[slot]
+
+    def random_key(self):
+        """A member drawn uniformly at random, for SRANDMEMBER and SPOP. The dict must not be empty."""
+        while True:
+            # Holes are at most half of the slots (or few), so this rarely loops
+            key = self._keys[random.randrange(len(self._keys))]
+            if key is not None:
+                return key
+
+    def scan(self, cursor: int, count: int) -> Tuple[int, List[Tuple[bytes, Optional[bytes]]]]:
+        """Visit up to count slots from cursor. Returns the next cursor (0 when done) and the items seen."""
+        i = bisect_left(self._seqs, cursor)
+        end = min(i + count, len(self._keys))
+        found = [(key, value) for key, value in zip(self._keys[i:end], self._values[i:end]) if key is not None]
+        return (self._seqs[end] if end < len(self._keys) else 0), found
@@ -0,0 +1,218 @@
+"""
+SortedIndex: the ordered half of a large sorted set.
+
+Items are (score, member) tuples kept in ascending order in a list of sorted
+blocks of about SORTEDINDEX_LOAD items each, with the last item of every block
+in `maxes`, so an item's block is found with a bisect and then placed with a
+bisect inside it. Inserting or deleting moves at most one block's worth of
+pointers, and a block splits when it doubles and merges into a neighbour when
+it drops under a quarter.
+
+For ranks a Fenwick tree over the block lengths gives the number of items
+before a block, and the block holding rank r, in O(log blocks). Adds and
+deletes that keep the number of blocks update it in place; a split or merge
+only marks it stale and it is rebuilt in O(blocks) when next needed, which
+is amortized over the hundreds of changes it takes to split or merge again.
+Rank, bisect and indexing all cost O(log n), and a range of k items
+O(log n + k), which is what Redis gets from its skiplist with spans.
+"""
+from bisect import bisect_left, bisect_right, insort
+from typing import List, Optional, Tuple
+
+SORTEDINDEX_LOAD = 512
+
+Item = Tuple[float, bytes]
+
+
+class Top:
+    """Sorts after every member: (score, TOP) bounds all the items with that score from above."""
+    __slots__ = ()
+
+    def __lt__(self, other) -> bool:
+        return False
+
+    def __gt__(self, other) -> bool:
+        return other is not self
+
+TOP = Top()
+
+
+class SortedIndex:
+    __slots__ = ('blocks', 'maxes', 'count', '_tree')
+
+    def __init__(self, items=()):
+        """items must already be in ascending order."""
+        items = list(items)
+        self.blocks: List[List[Item]] = [items[i:i + SORTEDINDEX_LOAD]
+                                         for i in range(0, len(items), SORTEDINDEX_LOAD)]
+        self.maxes: List[Item] = [block[-1] for block in self.blocks]
+        self.count = len(items)
+        self._tree: Optional[List[int]] = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self):
+        for block in self.blocks:
+            yield from block
+
+    # Fenwick tree over the block lengths
+
+    def _build_tree(self) -> List[int]:
+        tree = [len(block) for block in self.blocks]
+        n = len(tree)
+        for i in range(n):
+            j = i | (i + 1)
+            if j < n:
+                tree[j] += tree[i]
+        self._tree = tree
+        return tree
+
+    def _grew(self, i: int, delta: int) -> None:
+        tree = self._tree
+        if tree is None:
+            return
+        n = len(tree)
+        while i < n:
+            tree[i] += delta
+            i |= i + 1
+
+    def _before(self, i: int) -> int:
+        """Number of items in blocks 0 to i - 1."""
+        tree = self._tree if self._tree is not None else self._build_tree()
+        total = 0
+        while i > 0:
+            total += tree[i - 1]
+            i &= i - 1
+        return total
+
+    def _locate(self, rank: int) -> Tuple[int, int]:
+        """(block, offset) of the item at rank, 0 <= rank <= count; rank count gives (len(blocks), 0)."""
+        tree = self._tree if self._tree is not None else self._build_tree()
+        n = len(tree)
+        pos = 0
+        bit = 1 << (n.bit_length() - 1) if n else 0
+        while bit:
+            nxt = pos + bit
+            if nxt <= n and tree[nxt - 1] <= rank:
+                pos = nxt
+                rank -= tree[nxt - 1]
+            bit >>= 1
+        return pos, rank
+
+    # Queries
+
+    def bisect_left(self, item) -> int:
+        """Rank of the first item >= item."""
+        i = bisect_left(self.maxes, item)
+        if i == len(self.maxes):
+            return self.count
+        return self._before(i) + bisect_left(self.blocks[i], item)
+
+    def bisect_right(self, item) -> int:
+        """Rank of the first item > item."""
+        i = bisect_right(self.maxes, item)
+        if i == len(self.maxes):
+            return self.count
+        return self._before(i) + bisect_right(self.blocks[i], item)
+
+    def __getitem__(self, rank: int) -> Item:
+        i, offset = self._locate(rank)
+        return self.blocks[i][offset]
+
+    def slice(self, start: int, stop: int) -> List[Item]:
+        """Items of rank start to stop - 1, with 0 <= start <= stop <= count."""
+        out = []
+        if start >= stop:
+            return out
+        i, offset = self._locate(start)
+        remaining = stop - start
+        while remaining:
+            block = self.blocks[i]
+            take = block[offset:offset + remaining]
+            out += take
+            remaining -= len(take)
+            i += 1
+            offset = 0
+        return out
+
+    # Updates
+
+    def add(self, item: Item) -> None:
+        blocks, maxes = self.blocks, self.maxes
+        self.count += 1
+        if not blocks:
+            blocks.append([item])
+            maxes.append(item)
+            self._tree = None
+            return
+        i = bisect_left(maxes, item)
+        if i == len(maxes):
+            i -= 1
+            blocks[i].append(item)
+            maxes[i] = item
+        else:
+            insort(blocks[i], item)
+        block = blocks[i]
+        if len(block) > 2 * SORTEDINDEX_LOAD:
+            blocks[i:i + 1] = [block[:SORTEDINDEX_LOAD], block[SORTEDINDEX_LOAD:]]
+            maxes[i:i + 1] = [block[SORTEDINDEX_LOAD - 1], block[-1]]
+            self._tree = None
+        else:
+            self._grew(i, 1)
+
+    def remove(self, item: Item) -> None:
+        """Remove an item that is in the index."""
+        i = bisect_left(self.maxes, item)
+        block = self.blocks[i]
+        del block[bisect_left(block, item)]
+        self.count -= 1
+        self._shrunk(i, 1)
+
+    def _shrunk(self, i: int, removed: int) -> None:
+        """Block i lost removed items: drop it if empty, merge it if small, else fix its max."""
+        blocks, maxes = self.blocks, self.maxes
+        block = blocks[i]
+        if not block:
+            del blocks[i]
+            del maxes[i]
+            self._tree = None
+        elif len(block) < SORTEDINDEX_LOAD // 4 and len(blocks) > 1:
+            j = i - 1 if i > 0 else i
+            merged = blocks[j] + blocks[j + 1]
+            if len(merged) > 2 * SORTEDINDEX_LOAD:
+                half = len(merged) // 2
+                blocks[j:j + 2] = [merged[:half], merged[half:]]
+                maxes[j:j + 2] = [merged[half - 1], merged[-1]]
+            else:
+                blocks[j:j + 2] = [merged]
+                maxes[j:j + 2] = [merged[-1]]
+            self._tree = None
+        else:
+            maxes[i] = block[-1]
+            self._grew(i, -removed)
+
+    def delete_slice(self, start: int, stop: int) -> List[Item]:
+        """Remove and return the items of rank start to stop - 1."""
+        removed = self.slice(start, stop)
+        if not removed:
+            return removed
+        i, offset = self._locate(start)
+        j, end = self._locate(stop)
+        blocks, maxes = self.blocks, self.maxes
+        self.count -= len(removed)
+        if i == j:
+            del blocks[i][offset:end]
+            self._shrunk(i, len(removed))
+            return removed
+        # Whole blocks between the two ends go at once
+        del blocks[i][offset:]
+        if j < len(blocks):
+            del blocks[j][:end]
+        del blocks[i + 1:j]
+        del maxes[i + 1:j]
+        self._tree = None
+        for k in (i + 1, i):
+            if k < len(blocks):
+                self._shrunk(k, 0)
+        return removed
@@ -1,11 +1,80 @@
 import argparse
-import inspect
 from commands import redis_command,write_commands
-from persistence import load_rdb, load_from_aof, save_rdb
-from data_type.redisKey import rkey
+from persistence import load_rdb, load_rdb_from_master, load_from_aof, aof, rdb, APPENDFSYNC_POLICIES
 import asyncio
-from convert_commands import convert_resp
-from router import execute_command, handle_replication_handshake
+import contextlib
+import inspect
+import os
+import secrets
+from convert_commands import RespParser, ProtocolError, build_resp_array
+from router import execute_command, handle_replication_handshake, propagation, propagate
+import data_type.expires as expiry
+import data_type.evict as evict
+import data_type.blocking as blocking
+import data_type.redisSet as redisSet
+import data_type.redisHash as redisHash
+import data_type.redisZset as redisZset
+from registry import COMMAND_REGISTRY
+from replication import ReplicaLink, backlog
+import resp
+
+READ_CHUNK = 64 * 1024
+REPL_RECONNECT_DELAY = 1
+REPL_ACK_INTERVAL = 1
+SIZE_UNITS = {'b': 1, 'k': 1000, 'kb': 1024, 'm': 1000 ** 2, 'mb': 1024 ** 2, 'g': 1000 ** 3, 'gb': 1024 ** 3}
+
+def parse_size(text: str) -> int:
+    """Parse a Redis-style memory size such as 100, 64mb or 1gb."""
+    text = text.strip().lower()
+    digits = text.rstrip('abcdefghijklmnopqrstuvwxyz')
+    unit = text[len(digits):] or 'b'
+    if unit not in SIZE_UNITS or not digits:
+        raise argparse.ArgumentTypeError(f"invalid size: {text}")
+    return int(digits) * SIZE_UNITS[unit]
+
+def parse_output_buffer_limit(text: str):
+    """Parse '<class> <hard> <soft> <soft seconds>'; only the replica class applies here."""
+    parts = text.split()
+    if len(parts) != 4 or parts[0].lower() not in ('replica', 'slave') or not parts[3].isdigit():
+        raise argparse.ArgumentTypeError(f"expected 'replica <hard> <soft> <seconds>', got: {text}")
+    return parse_size(parts[1]), parse_size(parts[2]), int(parts[3])
+
+async def send_replies(writer, replies) -> None:
+    # Under appendfsync always the log must reach the disk before any reply goes out
+    if aof.fsync_policy == 'always':
+        propagation.flush()
+    writer.writelines(replies)
+    await writer.drain()
+
+async def await_watching_client(reader, parser, client_state, coro):
+    """
+    Await a handler that can suspend (BLPOP, XREAD BLOCK, WAIT...) while watching the
+    connection. A client that goes away is cancelled out of the blocked registry before
+    a key can be served to it; requests that arrive meanwhile are kept for the parser.
+    Returns the reply, or None with client_state['closed'] set.
+    """
+    task = asyncio.ensure_future(coro)
+    while True:
+        read = asyncio.ensure_future(reader.read(READ_CHUNK))
+        await asyncio.wait((task, read), return_when=asyncio.FIRST_COMPLETED)
+        if not read.done():
+            # The read gives up without taking anything from the stream
+            read.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await read
+            return task.result()
+        try:
+            data = read.result()
+        except ConnectionError:
+            data = b""
+        if data:
+            parser.feed(data)
+            continue
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+        client_state['closed'] = True
+        return None
 
 async def handle_client(reader, writer, server_state):
     # Initialize client context
@@ -14,159 +83,174 @@ async def handle_client(reader, writer, server_state):
         'multi_event': asyncio.Event(), # For transactions
         'exec_event': [],               # For transactions
         'is_replica': False,            # Default role
-        'handshake_step': 0             # For replica handshake
+        'handshake_step': 0,            # For replica handshake
+        'writer': writer
     }
     client_state['multi_event'].set() 
 
+    parser = RespParser()
     while True:
-        data = await reader.read(1024)
+        data = await reader.read(READ_CHUNK)
         if not data: break
 
-        # 1. Parse Input
-        cmd_key, args, _ = convert_resp(data)
-        if not cmd_key: continue
+        # 1. Parse Input: pull every complete command out of the buffer
+        parser.feed(data)
+        replies = []
+        try:
+            for cmd_key, args, _ in parser:
+                # 2. Check for Replication Handshake (Special logic before standard routing)
+                # This handles PING, REPLCONF, PSYNC sequences for replicas
+                response, proceed = await handle_replication_handshake(
+                    cmd_key, args, client_state, server_state
+                )
+                if response:
+                    replies.append(response)
+
+                # 3. If it wasn't a handshake command, execute standard command
+                if proceed:
+                    # Handlers that can suspend (BLPOP, XREAD BLOCK, WAIT...) must not
+                    # hold back the replies to the commands pipelined before them
+                    may_block = inspect.iscoroutinefunction(COMMAND_REGISTRY.get(cmd_key))
+                    if replies and may_block:
+                        await send_replies(writer, replies)
+                        replies = []
+                    try:
+                        if may_block:
+                            response = await await_watching_client(
+                                reader, parser, client_state, execute_command(cmd_key, args, client_state))
+                            if client_state.get('closed'):
+                                break
+                        else:
+                            response = await execute_command(cmd_key, args, client_state)
+                    except Exception as e:
+                        # A failing command gets an error reply instead of dropping the client
+                        print(f"Error executing {cmd_key!r}: {e!r}")
+                        response = resp.error("ERR " + " ".join(str(e).split()))
+                    if response:
+                        replies.append(response)
+        except ProtocolError as e:
+            replies.append(f"-ERR Protocol error: {e}\r\n".encode())
+            await send_replies(writer, replies)
+            break
+
+        if client_state.get('closed'):
+            break
+
+        # 4. Answer the whole pipeline with one write and one drain
+        if replies:
+            await send_replies(writer, replies)
+
+    # Stop propagating to a replica whose link went away
+    for link in [r for r in server_state['replicas'] if r.writer is writer]:
+        link.close()
+    writer.close()
+
 
-        # 2. Check for Replication Handshake (Special logic before standard routing)
-        # This handles PING, REPLCONF, PSYNC sequences for replicas
-        response, stop_processing = await handle_replication_handshake(
-            cmd_key, args, client_state, server_state
-        )
-        
-        # Send handshake response if one exists
-        if response:
-            writer.write(response if isinstance(response, bytes) else response.encode())
-            await writer.drain()
-
-        # 3. If it wasn't a handshake command (or handshake continues), execute standard command
-        if not stop_processing:
-            response = await execute_command(cmd_key, args, client_state)
-            if response:
-                writer.write(response.encode())
-                await writer.drain()
-        
-        
 async def start_replication(master_host, master_port, server_state, local_port):
-    try:
-        reader, writer = await asyncio.open_connection(master_host, master_port)
-        print(f"Connected to master at {master_host}:{master_port}")
-        
-        # Replication handshake
-        writer.write(b"*1\r\n$4\r\nPING\r\n")
-        await writer.drain()
-        data = await reader.read(1024)
-        print(f"Master response to PING: {data.decode('utf-8', errors='replace')}")
-        
-        writer.write(f"*3\r\n$8\r\nREPLCONF\r\n$14\r\nlistening-port\r\n${len(str(local_port))}\r\n{local_port}\r\n".encode())
-        await writer.drain()
-        data = await reader.read(1024)
-        print(f"Master response to REPLCONF listening-port: {data.decode('utf-8', errors='replace')}")
-        
-        writer.write(b"*3\r\n$8\r\nREPLCONF\r\n$4\r\ncapa\r\n$6\r\npsync2\r\n")
-        await writer.drain()
-        data = await reader.read(1024)
-        print(f"Master response to REPLCONF capa: {data.decode('utf-8', errors='replace')}")
-        
-        writer.write(b"*3\r\n$5\r\nPSYNC\r\n$1\r\n?\r\n$2\r\n-1\r\n")
-        await writer.drain()
-        data = await reader.read(1024)
-        while b"$" not in data or data.count(b'\r\n') < 2:
-            additional_data = await reader.read(1024)
-            if not additional_data:
-                print("Error: Connection closed while reading PSYNC response")
-                return
-            data += additional_data
-            print(f"Debug: Read additional data, total length now: {len(data)}")
-        
-        if b"FULLRESYNC" in data:
-            fullresync_line = data.split(b'\r\n')[0].decode('utf-8')
-            print(f"Master response to PSYNC: {fullresync_line}")
-            parts = fullresync_line.split()
-            replid = parts[1]
-            offset = int(parts[2]) if len(parts) > 2 else 0
-            print(f"Received FULLRESYNC: replid={replid}, offset={offset}")
-            
-            # Read RDB file
-            lines = data.split(b'\r\n')
-            print(f"Debug: Found {len(lines)} lines in PSYNC response")
-            
-            for i, line in enumerate(lines[:3]):  # Print first 3 lines for debugging
-                print(f"Debug: Line {i}: {line}")
-            if len(lines) > 1:
-                rdb_length_line = lines[1]
-                if rdb_length_line.startswith(b'$'):
-                    rdb_length = int(rdb_length_line[1:].decode('utf-8'))
-                    print(f"RDB length indicator: {rdb_length}")
-                else:
-                    print(f"Error: Expected RDB length line starting with $, got: {rdb_length_line}")
-                    return
-            else:
-                print("Error: No RDB length line found in PSYNC response")
-                return
-            print(f"RDB length indicator: {rdb_length}")
-            
-            # Calculate how much RDB data we already have in the initial response
-            header_size = len(fullresync_line.encode()) + 2 + len(rdb_length_line) + 2  # +2 for each \r\n
-            rdb_data_received = data[header_size:]
-            print(f"Debug: header_size={header_size}, rdb_data_received length={len(rdb_data_received)}")
-            remaining_rdb = rdb_length - len(rdb_data_received)
-            
-            if remaining_rdb > 0:
-                print(f"Debug: Reading additional {remaining_rdb} bytes of RDB data")
-                additional_rdb = await reader.read(remaining_rdb)
-                rdb_data = rdb_data_received + additional_rdb
-            else:
-                rdb_data = rdb_data_received[:rdb_length]            
-            print(f"Received RDB file: expected_len={rdb_length}, actual_len={len(rdb_data)}")
-            
-            # Set up buffer for remaining data (commands after RDB)
-            buffer = rdb_data_received[rdb_length:] if len(rdb_data_received) > rdb_length else b""
-            print(f"Debug: Initial buffer length={len(buffer)}")
-            # Initialize processed_offset after receiving RDB
-            server_state['processed_offset'] = 0
-                    
-        while True:
+    """Keep a link to the master, reconnecting after a drop; reconnects try a partial resync."""
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(master_host, master_port)
+        except OSError as e:
+            print(f"Error connecting to master {master_host}:{master_port}: {e}")
+        else:
+            print(f"Connected to master at {master_host}:{master_port}")
             try:
-                if not buffer:
-                    data = await reader.read(1024)
-                    if not data:
-                        break
-                    buffer += data
-                    print(f"New data received: len={len(data)}")
+                await replication_session(reader, writer, server_state, local_port)
+            except Exception as e:
+                print(f"Replication error: {str(e)}")
+            finally:
+                writer.close()
+                print(f"Disconnected from master {master_host}:{master_port}")
+        await asyncio.sleep(REPL_RECONNECT_DELAY)
+
+async def replication_session(reader, writer, server_state, local_port):
+    # Replication handshake
+    writer.write(build_resp_array("PING", []))
+    await writer.drain()
+    print(f"Master response to PING: {(await reader.readline()).decode('utf-8', errors='replace').strip()}")
+    
+    writer.write(build_resp_array("REPLCONF", [b"listening-port", b"%d" % local_port]))
+    await writer.drain()
+    print(f"Master response to REPLCONF listening-port: {(await reader.readline()).decode('utf-8', errors='replace').strip()}")
+    
+    # capa eof: we can load a diskless snapshot whose length is not known in advance
+    writer.write(build_resp_array("REPLCONF", [b"capa", b"eof", b"capa", b"psync2"]))
+    await writer.drain()
+    print(f"Master response to REPLCONF capa: {(await reader.readline()).decode('utf-8', errors='replace').strip()}")
+    
+    # After a first sync, ask to continue right after the last byte we processed
+    if 'processed_offset' in server_state:
+        psync_args = [server_state['master_replid'].encode(), b"%d" % (server_state['processed_offset'] + 1)]
+    else:
+        psync_args = [b"?", b"-1"]
+    writer.write(build_resp_array("PSYNC", psync_args))
+    await writer.drain()
+    psync_line = (await reader.readline()).decode('utf-8').strip()
+    print(f"Master response to PSYNC: {psync_line}")
+    parts = psync_line.split()
+    buffer = b""
+    if psync_line.startswith("+CONTINUE"):
+        # Partial resync: the missing part of the stream follows as ordinary commands
+        if len(parts) > 1:
+            server_state['master_replid'] = parts[1]
+    elif psync_line.startswith("+FULLRESYNC"):
+        replid = parts[1]
+        offset = int(parts[2]) if len(parts) > 2 else 0
+        print(f"Received FULLRESYNC: replid={replid}, offset={offset}")
+
+        # The snapshot is streamed straight from the socket into the keyspaces.
+        # Until it is fully loaded the dataset matches no offset we could continue from.
+        server_state.pop('processed_offset', None)
+        buffer = await load_rdb_from_master(reader, await reader.readline())
+        server_state['master_replid'] = replid
+        server_state['processed_offset'] = offset
+    else:
+        print(f"Error: unexpected PSYNC response: {psync_line}")
+        return
                 
-                cmd, args, consumed = convert_resp(buffer)
-                if cmd:
-                    server_state['processed_offset'] = server_state.get('processed_offset', 0) + consumed
-                    if cmd.lower() == 'replconf' and args and args[0].lower() == 'getack':
-                        offset = server_state.get('processed_offset', 0) - consumed
-                        ack_resp = f"*3\r\n$8\r\nREPLCONF\r\n$3\r\nACK\r\n${len(str(offset))}\r\n{offset}\r\n"
-                        print(f"Sending REPLCONF ACK: offset={offset}")
-                        writer.write(ack_resp.encode())
-                        await writer.drain()
-                    else:
-                        # Create proper client_state for replica commands
-                        replica_client_state = {
-                            'multi_event': asyncio.Event(),
-                            'exec_event': [],
-                            'server_state': server_state,
-                            'is_replica': True,
-                            'writer': writer
-                        }
-                        replica_client_state['multi_event'].set()
-                        result = redis_command(cmd, args, replica_client_state, is_replica=True)                       
-                        if inspect.iscoroutine(result):
-                            await result
-                    buffer = buffer[consumed:]
-                else:
-                    break
+    ack_task = asyncio.create_task(send_acks(writer, server_state))
+    try:
+        await apply_replication_stream(reader, writer, server_state, buffer)
+    finally:
+        ack_task.cancel()
 
+async def send_acks(writer, server_state):
+    """Report the processed offset every second, so the master knows our lag without asking."""
+    while True:
+        await asyncio.sleep(REPL_ACK_INTERVAL)
+        writer.write(build_resp_array("REPLCONF", [b"ACK", b"%d" % server_state['processed_offset']]))
+
+async def apply_replication_stream(reader, writer, server_state, buffer: bytes):
+    # Create proper client_state for replica commands
+    replica_client_state = {
+        'multi_event': asyncio.Event(),
+        'exec_event': [],
+        'server_state': server_state,
+        'is_replica': True,
+        'writer': writer
+    }
+    replica_client_state['multi_event'].set()
+
+    parser = RespParser()
+    parser.feed(buffer)
+    while True:
+        for cmd, args, consumed in parser:
+            try:
+                if cmd == 'replconf' and args and args[0].lower() == b'getack':
+                    offset = server_state.get('processed_offset', 0)
+                    writer.write(build_resp_array("REPLCONF", [b"ACK", b"%d" % offset]))
+                else:
+                    await redis_command(cmd, args, replica_client_state, is_replica=True)
             except Exception as e:
                 print(f"Replication command error: {cmd} {args} - {str(e)}")
-    except Exception as e:
-        print(f"Replication error: {str(e)}")
-    finally:
-        writer.close()
-        await writer.wait_closed()
-        print(f"Disconnected from master {master_host}:{master_port}")
+            server_state['processed_offset'] = server_state.get('processed_offset', 0) + consumed
+        await writer.drain()
+
+        data = await reader.read(READ_CHUNK)
+        if not data:
+            break
+        parser.feed(data)
         
 async def main():
     print("Logs from your program will appear here!")
@@ -178,6 +262,96 @@ async def main():
         default=None,
         help="Master server as 'host port' (e.g., '127.0.0.1 6379') to act as a slave, omit for master"
     )
+    parser.add_argument(
+        "--auto-aof-rewrite-percentage",
+        type=int,
+        default=100,
+        help="Rewrite the AOF once it grew by this percentage since the last rewrite (0 disables)"
+    )
+    parser.add_argument(
+        "--auto-aof-rewrite-min-size",
+        type=parse_size,
+        default="64mb",
+        help="Minimum AOF size before an automatic rewrite is considered (e.g. 64mb)"
+    )
+    parser.add_argument(
+        "--appendfsync",
+        choices=APPENDFSYNC_POLICIES,
+        default="everysec",
+        help="AOF fsync policy: always, everysec or no"
+    )
+    parser.add_argument(
+        "--repl-backlog-size",
+        type=parse_size,
+        default="1mb",
+        help="Size of the replication backlog used for partial resynchronization (e.g. 1mb)"
+    )
+    parser.add_argument(
+        "--client-output-buffer-limit",
+        type=parse_output_buffer_limit,
+        default="replica 256mb 64mb 60",
+        help="Disconnect a replica whose output buffer passes <hard>, or stays over <soft> for <seconds>"
+    )
+    parser.add_argument(
+        "--maxmemory",
+        type=parse_size,
+        default="0",
+        help="Memory limit for the dataset (e.g. 100mb); 0 means no limit"
+    )
+    parser.add_argument(
+        "--maxmemory-policy",
+        choices=evict.POLICIES,
+        default="noeviction",
+        help="How keys are chosen for eviction when maxmemory is reached"
+    )
+    parser.add_argument(
+        "--maxmemory-samples",
+        type=int,
+        default=evict.MAXMEMORY_SAMPLES,
+        help="Keys sampled per eviction; more is closer to true LRU/LFU but slower"
+    )
+    parser.add_argument(
+        "--set-max-intset-entries",
+        type=int,
+        default=redisSet.SET_MAX_INTSET_ENTRIES,
+        help="Sets of integers with more members than this are stored as a hashtable instead of an intset"
+    )
+    parser.add_argument(
+        "--hash-max-listpack-entries",
+        type=int,
+        default=redisHash.HASH_MAX_LISTPACK_ENTRIES,
+        help="Hashes with more fields than this are stored as a hashtable instead of a listpack"
+    )
+    parser.add_argument(
+        "--hash-max-listpack-value",
+        type=int,
+        default=redisHash.HASH_MAX_LISTPACK_VALUE,
+        help="Hashes with a field or value longer than this are stored as a hashtable"
+    )
+    parser.add_argument(
+        "--zset-max-listpack-entries",
+        type=int,
+        default=redisZset.ZSET_MAX_LISTPACK_ENTRIES,
+        help="Sorted sets with more members than this are stored as a skiplist instead of a listpack"
+    )
+    parser.add_argument(
+        "--zset-max-listpack-value",
+        type=int,
+        default=redisZset.ZSET_MAX_LISTPACK_VALUE,
+        help="Sorted sets with a member longer than this are stored as a skiplist"
+    )
+    parser.add_argument(
+        "--rdbcompression",
+        choices=("yes", "no"),
+        default="yes",
+        help="LZF-compress long strings in RDB snapshots"
+    )
+    parser.add_argument(
+        "--rdbchecksum",
+        choices=("yes", "no"),
+        default="yes",
+        help="Write and verify the CRC64 trailer of RDB snapshots; with no the trailer is 0"
+    )
     args = parser.parse_args()
     port = args.port
     master_host = None
@@ -194,7 +368,8 @@ async def main():
         'role': 'slave' if master_host else 'master',
         'master_host': master_host,
         'master_port': master_port,
-        'master_replid': '8371b4fb1155b71f4a04d3e1bc3e18c4a990aeeb',
+        # A fresh id per run: offsets from an earlier run must never be continued
+        'master_replid': secrets.token_hex(20),
         'master_repl_offset': 0,
         'replicas': []
     }
@@ -206,13 +381,30 @@ async def main():
         'is_replica': True # Prevents cycles during recovery
     }
     recovery_state['multi_event'].set()
-    #  1. First, load the RDB snapshot (Point-in-time)
-    
-    initial_data = load_rdb()
-    rkey._data = initial_data
-    
-    # 2. Then, replay the AOF (Delta changes since last snapshot)
-    await load_from_aof(recovery_state)
+    evict.configure(args.maxmemory, args.maxmemory_policy, args.maxmemory_samples)
+    redisSet.configure(args.set_max_intset_entries)
+    redisHash.configure(args.hash_max_listpack_entries, args.hash_max_listpack_value)
+    redisZset.configure(args.zset_max_listpack_entries, args.zset_max_listpack_value)
+    rdb.checksum = args.rdbchecksum == "yes"
+    # The AOF holds the full write history (rewrites compact it into a full dataset),
+    # so when it exists it is authoritative; the RDB snapshot is only used without it,
+    # and then becomes the base of a new AOF before any write is accepted.
+    if os.path.exists(aof.path):
+        await load_from_aof(recovery_state)
+    elif load_rdb():
+        aof.write_base()
+    # Only a master deletes expired keys, and it tells the AOF and its replicas with a DEL
+    expiry.active = server_state['role'] == 'master'
+    expiry.propagate_hook = lambda key: propagate("del", [key], server_state)
+    evict.propagate_hook = lambda key: propagate("del", [key], server_state)
+    # Pops handed to blocked clients are propagated as the matching non-blocking command
+    blocking.propagate_hook = lambda cmd, cmd_args: propagate(cmd, cmd_args, server_state)
+    rdb.compression = args.rdbcompression == "yes"
+    backlog.size = args.repl_backlog_size
+    ReplicaLink.hard_limit, ReplicaLink.soft_limit, ReplicaLink.soft_seconds = args.client_output_buffer_limit
+    aof.rewrite_percentage = args.auto_aof_rewrite_percentage
+    aof.rewrite_min_size = args.auto_aof_rewrite_min_size
+    aof.open(args.appendfsync)
     print(f"Starting server on port {port}")
     if master_host and master_port:
         print(f"Configured as slave of {master_host}:{master_port}")
@@ -227,9 +419,13 @@ async def main():
     
     if master_host and master_port:
         asyncio.create_task(start_replication(master_host, master_port, server_state, port))
+    asyncio.create_task(expiry.active_expire_loop())
     
-    async with server:
-        await server.serve_forever()
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        aof.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -1,57 +1,627 @@
-import pickle
 import os
-from convert_commands import convert_resp
+import time
+import asyncio
+import signal
+import sys
+from typing import Optional
+from convert_commands import RespParser, build_resp_array
+from rdb_format import (RdbWriter, RdbDecoder, RdbError, load_file, feed_async, RDB_TYPE_STRING, RDB_TYPE_LIST, RDB_TYPE_LIST_ZIPLIST,
+                        RDB_TYPE_LIST_QUICKLIST, RDB_TYPE_LIST_QUICKLIST_2, RDB_TYPE_SET, RDB_TYPE_SET_INTSET,
+                        RDB_TYPE_SET_LISTPACK, RDB_TYPE_HASH, RDB_TYPE_HASH_ZIPMAP,
+                        RDB_TYPE_HASH_ZIPLIST, RDB_TYPE_HASH_LISTPACK, RDB_TYPE_ZSET, RDB_TYPE_ZSET_2,
+                        RDB_TYPE_ZSET_ZIPLIST, RDB_TYPE_ZSET_LISTPACK, RDB_TYPE_STREAM_LISTPACKS,
+                        RDB_TYPE_STREAM_LISTPACKS_2, RDB_TYPE_STREAM_LISTPACKS_3, encode_intset)
+import data_type.keyspace as keyspace
+import data_type.expires as expiry
+from data_type.expires import expires, now_ms
+from data_type.redisList import get_list
+from data_type.redisSet import get_set
+from data_type.redisHash import get_hash
+from data_type.redisZset import get_zset, format_score
+from data_type.redisStream import get_stream, field_pairs, pack_id, unpack_id, format_id
+from data_type.redisKey import try_int_encoding
 
 AOF_FILE = "appendonly.aof"
 RDB_FILE = "dump.rdb"
 
 #RDB
-def save_rdb(data):
-    """Save the in-memory dictionary to a binary file"""
+RDB_WRITE_BUFFER = 1024 * 1024
+LIST_RDB_TYPES = (RDB_TYPE_LIST, RDB_TYPE_LIST_ZIPLIST, RDB_TYPE_LIST_QUICKLIST, RDB_TYPE_LIST_QUICKLIST_2)
+SET_RDB_TYPES = (RDB_TYPE_SET, RDB_TYPE_SET_INTSET, RDB_TYPE_SET_LISTPACK)
+HASH_RDB_TYPES = (RDB_TYPE_HASH, RDB_TYPE_HASH_ZIPMAP, RDB_TYPE_HASH_ZIPLIST, RDB_TYPE_HASH_LISTPACK)
+ZSET_RDB_TYPES = (RDB_TYPE_ZSET, RDB_TYPE_ZSET_2, RDB_TYPE_ZSET_ZIPLIST, RDB_TYPE_ZSET_LISTPACK)
+STREAM_RDB_TYPES = (RDB_TYPE_STREAM_LISTPACKS, RDB_TYPE_STREAM_LISTPACKS_2, RDB_TYPE_STREAM_LISTPACKS_3)
+
+def stream_entries(stream) -> list:
+    """[(ms, seq, fields dict)] in ID order."""
+    return [(*unpack_id(sid), dict(field_pairs(fields))) for sid, fields in stream.entries()]
+
+def stream_groups(stream) -> list:
+    """The consumer groups of a stream in the form RdbWriter.write_stream_key takes."""
+    groups = []
+    for group in stream.groups.values():
+        pel = [(unpack_id(sid), group.pel[sid].delivery_time, group.pel[sid].delivery_count)
+               for sid in group.pending_ids(0)]
+        consumers = [{'name': c.name, 'seen_time': c.seen_time, 'active_time': c.active_time,
+                      'pel': [unpack_id(sid) for sid in sorted(c.pel)]} for c in group.consumers.values()]
+        groups.append({'name': group.name, 'last_id': unpack_id(group.last_id),
+                       'entries_read': group.entries_read, 'pel': pel, 'consumers': consumers})
+    return groups
+
+def write_rdb(f, compress: bool = True, checksum: bool = True) -> None:
+    """Serialize the keyspace to the binary file object f in the RDB format."""
+    now = now_ms()
+
+    def live(key):
+        when = expires.get(key)
+        return when is None or when > now
+
+    entries = [(key, ent) for key, ent in keyspace.db.items() if live(key)]
+    writer = RdbWriter(f, compress, checksum)
+    writer.write_header(len(entries), len(expires))
+    for key, ent in entries:
+        expire_ms = expires.get(key)
+        if ent.kind == 'string':
+            writer.write_string_key(key, ent.value, expire_ms)
+        elif ent.kind == 'list':
+            writer.write_quicklist_key(key, ent.value.elements.node_buffers(), expire_ms)
+        elif ent.kind == 'set':
+            if ent.value.encoding == 'intset':
+                writer.write_listpack_key(RDB_TYPE_SET_INTSET, key, encode_intset(ent.value.members), expire_ms)
+            else:
+                writer.write_set_key(key, ent.value, expire_ms)
+        elif ent.kind == 'hash':
+            if ent.value.encoding == 'listpack':
+                writer.write_listpack_key(RDB_TYPE_HASH_LISTPACK, key, ent.value.fields.tobytes(), expire_ms)
+            else:
+                writer.write_hash_key(key, ent.value.items(), expire_ms)
+        elif ent.kind == 'zset':
+            if ent.value.encoding == 'listpack':
+                writer.write_listpack_key(RDB_TYPE_ZSET_LISTPACK, key, ent.value.entries.tobytes(), expire_ms)
+            else:
+                writer.write_zset_key(key, ent.value.items(), expire_ms)
+        elif ent.kind == 'stream':
+            stream = ent.value
+            writer.write_stream_key(key, stream_entries(stream), last_id=unpack_id(stream.last_id),
+                                    first_id=unpack_id(stream.first_id),
+                                    max_deleted_id=unpack_id(stream.max_deleted_id),
+                                    entries_added=stream.entries_added, groups=stream_groups(stream),
+                                    expire_ms=expire_ms)
+    writer.finish()
+
+def save_rdb(path: str = RDB_FILE, compress: bool = True, checksum: bool = True):
+    """Save the keyspace to an RDB file, written to a temp file and renamed into place"""
+    tmp = f"temp-{os.getpid()}.rdb"
+    with open(tmp, "wb", buffering=RDB_WRITE_BUFFER) as f:
+        write_rdb(f, compress, checksum)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    print(f"RDB snapshot saved: {path}")
+
+def restore_key(key: bytes, rdb_type: int, value, expire_ms: Optional[int]) -> None:
+    """Insert one key decoded from an RDB payload into the keyspace."""
+    if expire_ms is not None and expire_ms <= now_ms():
+        return
+    if rdb_type == RDB_TYPE_STRING:
+        keyspace.store(key, 'string', try_int_encoding(value))
+    elif rdb_type in LIST_RDB_TYPES:
+        get_list(key, create=True).extend(value)
+    elif rdb_type in SET_RDB_TYPES:
+        get_set(key, create=True).update(value)
+    elif rdb_type in HASH_RDB_TYPES:
+        h = get_hash(key, create=True)
+        for field, val in value:
+            h.set(field, val)
+    elif rdb_type in ZSET_RDB_TYPES:
+        get_zset(key, create=True).extend(value)
+    elif rdb_type in STREAM_RDB_TYPES:
+        stream = get_stream(key, create=True)
+        for ms, seq, fields in value['entries']:
+            stream.append(pack_id(ms, seq), fields)
+        stream.last_id = max(stream.last_id, pack_id(*value['last_id']))
+        stream.max_deleted_id = pack_id(*value['max_deleted_id'])
+        stream.entries_added = max(stream.entries_added, value['entries_added'])
+        now = now_ms()
+        for g in value['groups']:
+            group = stream.create_group(g['name'], pack_id(*g['last_id']), g['entries_read'])
+            deliveries = {pack_id(*sid): (when, count) for sid, when, count in g['pel']}
+            for c in g['consumers']:
+                consumer = group.consumer(c['name'], now)
+                consumer.seen_time, consumer.active_time = c['seen_time'], c['active_time']
+                for sid in c['pel']:
+                    sid = pack_id(*sid)
+                    group.add_pending(sid, consumer, *deliveries.get(sid, (now, 1)))
+    else:
+        print(f"Skipping key {key!r}: RDB object type {rdb_type} is not supported")
+        return
+    if expire_ms is not None:
+        expires.set(key, expire_ms)
+
+def load_rdb(path: str = RDB_FILE) -> bool:
+    """Load a snapshot into the keyspace. Returns False if there is no snapshot."""
+    if not os.path.exists(path):
+        return False
+    started = time.time()
     try:
-        # Create a snapshot copy so the dictionary doesn't change during save
-        data_snapshot = data.copy() 
-        with open(RDB_FILE, "wb") as f:
-            pickle.dump(data_snapshot, f)
-        print(f"RDB snapshot saved: {RDB_FILE}")
-    except Exception as e:
-        print(f"RDB Save Error: {e}")
-
-def load_rdb():
-    if os.path.exists(RDB_FILE):
-        with open(RDB_FILE, "rb") as f:
-            return pickle.load(f)
-    return {}
-        
+        decoder = load_file(path, restore_key, rdb.checksum)
+    except RdbError as e:
+        sys.exit(f"Bad file format reading the RDB file {path}: {e}")
+    print(f"Loaded {decoder.keys_loaded} keys from {path} (RDB v{decoder.version}) "
+          f"in {time.time() - started:.3f}s")
+    return True
+
+def flush_dataset() -> None:
+    keyspace.db.clear()
+    expires.clear()
+
+async def load_rdb_from_master(reader: asyncio.StreamReader, header: bytes) -> bytes:
+    """
+    Replace the dataset with the snapshot a master streams after FULLRESYNC.
+    header is the bulk line that precedes it: $<length>, or $EOF:<40 byte mark>
+    for a diskless transfer whose end is only known from the trailing mark.
+    Keys are inserted as they are decoded, so the payload is never buffered.
+    Returns the bytes read past the snapshot, the start of the command stream.
+    """
+    header = header.rstrip(b"\r\n")
+    eof_mark = header[5:] if header.startswith(b"$EOF:") else None
+    started = time.time()
+    flush_dataset()
+    decoder = RdbDecoder(restore_key, rdb.checksum)
+    if eof_mark is None:
+        length = int(header[1:])
+        rest = await feed_async(decoder.run(), reader.read, limit=length)
+        if rest:
+            raise RdbError(f"RDB payload of {length} bytes has trailing data")
+    else:
+        rest = await feed_async(decoder.run(), reader.read)
+        if len(rest) < len(eof_mark):
+            rest += await reader.readexactly(len(eof_mark) - len(rest))
+        if not rest.startswith(eof_mark):
+            raise RdbError("diskless payload does not end with the EOF mark")
+        rest = rest[len(eof_mark):]
+    print(f"Loaded {decoder.keys_loaded} keys from master in {time.time() - started:.3f}s")
+    return rest
+
+class RdbSaver:
+    """BGSAVE bookkeeping: the snapshot itself is written by a forked child."""
+
+    def __init__(self, path: str = RDB_FILE):
+        self.path = path
+        self.compression = True
+        self.checksum = True
+        self.in_progress = False
+        self.lastsave = int(time.time())
+        self.last_bgsave_ok = True
+        self.last_bgsave_duration = -1
+        self._task = None
+
+    def start_bgsave(self) -> bool:
+        if self.in_progress:
+            return False
+        self.in_progress = True
+        started = time.time()
+        try:
+            pid = fork_child(lambda: save_rdb(self.path, self.compression, self.checksum))
+        except OSError as e:
+            print(f"Can't save in background: {e}")
+            self._bgsave_done(False, started)
+            return False
+        self._task = asyncio.get_running_loop().create_task(self._wait(pid, started))
+        return True
+
+    async def _wait(self, pid: Optional[int], started: float) -> None:
+        self._bgsave_done(await wait_child(pid), started)
+
+    def _bgsave_done(self, ok: bool, started: float) -> None:
+        self.in_progress = False
+        self._task = None
+        self.last_bgsave_ok = ok
+        self.last_bgsave_duration = int(time.time() - started)
+        if ok:
+            self.lastsave = int(time.time())
+
+    def info(self) -> dict:
+        return {
+            'rdb_bgsave_in_progress': int(self.in_progress),
+            'rdb_last_save_time': self.lastsave,
+            'rdb_last_bgsave_status': 'ok' if self.last_bgsave_ok else 'err',
+            'rdb_last_bgsave_time_sec': self.last_bgsave_duration,
+        }
+
+rdb = RdbSaver()
+
+#Background jobs
+def fork_child(job) -> Optional[int]:
+    """
+    Run job() in a forked child that sees a copy-on-write snapshot of the dataset.
+    Returns the child's pid, or None if fork is unavailable and job() ran inline.
+    """
+    if not hasattr(os, 'fork'):
+        job()
+        return None
+    sys.stdout.flush()
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            job()
+        except BaseException as e:
+            print(f"Background job failed: {e}")
+            code = 1
+        finally:
+            sys.stdout.flush()
+            os._exit(code)
+    return pid
+
+async def wait_child(pid: Optional[int]) -> bool:
+    """Wait for a child started by fork_child without blocking the event loop."""
+    if pid is None:
+        return True
+    _, status = await asyncio.get_running_loop().run_in_executor(None, os.waitpid, pid, 0)
+    return os.waitstatus_to_exitcode(status) == 0
+
+def kill_child(pid: Optional[int]) -> None:
+    """Stop a child started by fork_child whose work is no longer wanted, and reap it."""
+    if pid is None:
+        return
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    os.waitpid(pid, 0)
+
 #AOF
-def log_to_aof(resp_cmd):
-    with open(AOF_FILE, "a") as f:
-        f.write(resp_cmd)
+APPENDFSYNC_POLICIES = ('always', 'everysec', 'no')
+AOF_LOAD_CHUNK = 64 * 1024
+AOF_REWRITE_ITEMS_PER_CMD = 64
+AOF_REWRITE_CATCHUP = 1024 * 1024
+# Group that recreates an empty stream with last ID 0-0 in a rewrite, destroyed right after
+AOF_MKSTREAM_GROUP = b"aof-rewrite-mkstream"
+
+def dataset_commands():
+    """Yield the minimal set of RESP commands that rebuilds the current dataset."""
+    now = now_ms()
+    for key, ent in keyspace.db.items():
+        when = expires.get(key)
+        if when is not None and when <= now:
+            continue
+        if ent.kind == 'string':
+            val = b"%d" % ent.value if isinstance(ent.value, int) else ent.value
+            yield build_resp_array("SET", [key, val])
+        elif ent.kind == 'list':
+            items = list(ent.value.get_elements())
+            for i in range(0, len(items), AOF_REWRITE_ITEMS_PER_CMD):
+                yield build_resp_array("RPUSH", [key] + items[i:i + AOF_REWRITE_ITEMS_PER_CMD])
+        elif ent.kind == 'set':
+            items = list(ent.value)
+            for i in range(0, len(items), AOF_REWRITE_ITEMS_PER_CMD):
+                yield build_resp_array("SADD", [key] + items[i:i + AOF_REWRITE_ITEMS_PER_CMD])
+        elif ent.kind == 'hash':
+            items = [e for pair in ent.value.items() for e in pair]
+            for i in range(0, len(items), 2 * AOF_REWRITE_ITEMS_PER_CMD):
+                yield build_resp_array("HSET", [key] + items[i:i + 2 * AOF_REWRITE_ITEMS_PER_CMD])
+        elif ent.kind == 'zset':
+            items = [e for member, score in ent.value.items() for e in (format_score(score), member)]
+            for i in range(0, len(items), 2 * AOF_REWRITE_ITEMS_PER_CMD):
+                yield build_resp_array("ZADD", [key] + items[i:i + 2 * AOF_REWRITE_ITEMS_PER_CMD])
+        elif ent.kind == 'stream':
+            stream = ent.value
+            for sid, fields in stream.entries():
+                args = [key, format_id(sid)]
+                for field, value in field_pairs(fields):
+                    args += [field, value]
+                yield build_resp_array("XADD", args)
+            if not len(stream) and stream.last_id:
+                # XADD cannot create an empty stream, so add one entry and trim it away
+                yield build_resp_array("XADD", [key, b"MAXLEN", b"0", format_id(stream.last_id), b"x", b"y"])
+            elif not len(stream):
+                # Nor add an entry with ID 0-0 (XGROUP CREATE ... MKSTREAM left it empty):
+                # create it the same way, with a group destroyed again before the real ones
+                yield build_resp_array("XGROUP", [b"CREATE", key, AOF_MKSTREAM_GROUP, b"0", b"MKSTREAM"])
+                yield build_resp_array("XGROUP", [b"DESTROY", key, AOF_MKSTREAM_GROUP])
+            # Deleted and trimmed entries still count for the last ID and the counters
+            yield build_resp_array("XSETID", [key, format_id(stream.last_id),
+                                              b"ENTRIESADDED", b"%d" % stream.entries_added,
+                                              b"MAXDELETEDID", format_id(stream.max_deleted_id)])
+            for group in stream.groups.values():
+                yield build_resp_array("XGROUP", [b"CREATE", key, group.name, format_id(group.last_id),
+                                                  b"ENTRIESREAD", b"%d" % group.entries_read])
+                for sid in group.pending_ids(0):
+                    pe = group.pel[sid]
+                    yield build_resp_array("XCLAIM", [key, group.name, pe.consumer.name, b"0", format_id(sid),
+                                                      b"TIME", b"%d" % pe.delivery_time,
+                                                      b"RETRYCOUNT", b"%d" % pe.delivery_count,
+                                                      b"JUSTID", b"FORCE"])
+                for consumer in group.consumers.values():
+                    if not consumer.pel:
+                        yield build_resp_array("XGROUP", [b"CREATECONSUMER", key, group.name, consumer.name])
+
+    # Absolute times, so replaying the file later does not extend any TTL
+    for key, when in list(expires.items()):
+        if when > now:
+            yield build_resp_array("PEXPIREAT", [key, b"%d" % when])
+
+def write_rewrite_file(path: str) -> None:
+    with open(path, "wb", buffering=1024 * 1024) as f:
+        for cmd in dataset_commands():
+            f.write(cmd)
+        f.flush()
+        os.fsync(f.fileno())
+
+def _append_to_file(path: str, data: bytes, fsync: bool = True) -> None:
+    with open(path, "ab") as f:
+        f.write(data)
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+
+class AppendOnlyFile:
+    """
+    Append-only log kept open in binary mode for the life of the server.
+    Appended commands collect in a write buffer that is written to the file once
+    per event-loop tick. Durability follows the Redis appendfsync policies:
+      always   - fsync right after every buffer write (before clients see the reply)
+      everysec - a background task fsyncs once per second in an executor thread
+      no       - leave flushing to the operating system
+    """
+
+    def __init__(self, path: str = AOF_FILE, fsync_policy: str = 'everysec'):
+        self.path = path
+        self.fsync_policy = fsync_policy
+        self._fd = None
+        self._buf = bytearray()          # appended but not yet written to the file
+        self._flush_scheduled = False
+        self._fsync_task = None
+        self._fsync_in_progress = False
+        self.current_size = 0
+        self.unsynced_bytes = 0          # written to the file but not yet fsynced
+        self.last_write_ok = True
+        self.last_fsync_time = None
+        self.last_fsync_latency = 0.0    # seconds
+        self.fsync_count = 0
+        # Rewrite (BGREWRITEAOF) state
+        self.rewrite_percentage = 100    # auto rewrite once the file doubled since the last rewrite
+        self.rewrite_min_size = 64 * 1024 * 1024
+        self.base_size = 0
+        self.pre_fork_hook = None        # flushes writes queued upstream before the snapshot is taken
+        self.rewrite_in_progress = False
+        self._rewrite_buf = None         # writes made while the rewrite child runs
+        self._rewrite_task = None
+        self.last_rewrite_ok = True
+        self.last_rewrite_duration = -1
+
+    @property
+    def enabled(self) -> bool:
+        return self._fd is not None
+
+    def open(self, fsync_policy: Optional[str] = None) -> None:
+        if fsync_policy is not None:
+            self.fsync_policy = fsync_policy
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.current_size = os.fstat(self._fd).st_size
+        self.base_size = self.current_size
+        if self.fsync_policy == 'everysec':
+            self._fsync_task = asyncio.get_running_loop().create_task(self._fsync_every_second())
+
+    def append(self, data: bytes) -> None:
+        if self._fd is None:
+            return
+        self._buf += data
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def write(self, data: bytes) -> None:
+        """Append and write through at once; used by the per-tick propagation flush."""
+        if self._fd is None:
+            return
+        self._buf += data
+        self.flush()
+
+    def flush(self) -> None:
+        """Write the buffered commands to the file (and fsync under 'always')."""
+        self._flush_scheduled = False
+        if not self._buf or self._fd is None:
+            return
+        try:
+            written = os.write(self._fd, self._buf)
+            if self._rewrite_buf is not None:
+                self._rewrite_buf += self._buf[:written]
+            del self._buf[:written]
+            self.current_size += written
+            self.unsynced_bytes += written
+            self.last_write_ok = True
+        except OSError as e:
+            # Keep the buffer and retry on the next append
+            self.last_write_ok = False
+            print(f"AOF write error: {e}")
+            return
+        if self.fsync_policy == 'always':
+            self._fsync()
+        elif self._buf:
+            self.append(b"")
+        self._maybe_auto_rewrite()
+
+    def _fsync(self) -> None:
+        start = time.perf_counter()
+        pending = self.unsynced_bytes
+        os.fsync(self._fd)
+        self._record_fsync(pending, time.perf_counter() - start)
+
+    def _record_fsync(self, synced: int, latency: float) -> None:
+        self.unsynced_bytes -= synced
+        self.last_fsync_latency = latency
+        self.last_fsync_time = time.time()
+        self.fsync_count += 1
+
+    async def _fsync_every_second(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._fd is not None:
+            await asyncio.sleep(1)
+            if not self.unsynced_bytes or self._fsync_in_progress or self._fd is None:
+                continue
+            self._fsync_in_progress = True
+            pending = self.unsynced_bytes
+            start = time.perf_counter()
+            try:
+                await loop.run_in_executor(None, os.fsync, self._fd)
+                self._record_fsync(pending, time.perf_counter() - start)
+            except OSError as e:
+                print(f"AOF fsync error: {e}")
+            finally:
+                self._fsync_in_progress = False
+
+    def _maybe_auto_rewrite(self) -> None:
+        if self.rewrite_in_progress or not self.rewrite_percentage:
+            return
+        if self.current_size < self.rewrite_min_size:
+            return
+        base = self.base_size or 1
+        if (self.current_size - base) * 100 / base >= self.rewrite_percentage:
+            print(f"Starting automatic AOF rewrite ({self.current_size} bytes, base {self.base_size})")
+            self.start_rewrite()
+
+    def write_base(self) -> None:
+        """
+        Write the dataset loaded from the RDB snapshot as the AOF, before it is
+        opened. Otherwise the next start would find an AOF holding only the
+        writes made since, and replay that instead of the snapshot.
+        """
+        tmp = f"temp-rewriteaof-{os.getpid()}.aof"
+        write_rewrite_file(tmp)
+        os.replace(tmp, self.path)
+        print(f"Created AOF base from the RDB snapshot: {os.path.getsize(self.path)} bytes")
+
+    def start_rewrite(self) -> bool:
+        """
+        Fork a child that writes the minimal command set for the current dataset
+        to a temp file. Writes made meanwhile are kept in a rewrite buffer, appended
+        to the new file when the child finishes, and the file is swapped in atomically.
+        """
+        if self._fd is None or self.rewrite_in_progress:
+            return False
+        self.rewrite_in_progress = True
+        if self.pre_fork_hook:
+            self.pre_fork_hook()
+        self.flush()
+
+        tmp = f"temp-rewriteaof-{os.getpid()}.aof"
+        self._rewrite_buf = bytearray()
+        started = time.time()
+        try:
+            pid = fork_child(lambda: write_rewrite_file(tmp))
+        except OSError as e:
+            print(f"Can't start AOF rewrite: {e}")
+            self._rewrite_done(False, started)
+            return False
+        self._rewrite_task = asyncio.get_running_loop().create_task(self._rewrite(pid, tmp, started))
+        return True
+
+    async def _rewrite(self, pid: Optional[int], tmp: str, started: float) -> None:
+        loop = asyncio.get_running_loop()
+        ok = await wait_child(pid)
+        try:
+            if ok:
+                # Catch up with the writes buffered so far without blocking the loop,
+                # then append the (small) remainder and swap synchronously.
+                while len(self._rewrite_buf) > AOF_REWRITE_CATCHUP:
+                    chunk = bytes(self._rewrite_buf)
+                    self._rewrite_buf.clear()
+                    await loop.run_in_executor(None, _append_to_file, tmp, chunk)
+                self._swap_in(tmp)
+        except OSError as e:
+            print(f"AOF rewrite failed: {e}")
+            ok = False
+        if not ok and os.path.exists(tmp):
+            os.remove(tmp)
+        self._rewrite_done(ok, started)
+
+    def _swap_in(self, tmp: str) -> None:
+        self.flush()
+        _append_to_file(tmp, bytes(self._rewrite_buf), fsync=self.fsync_policy != 'no')
+        os.replace(tmp, self.path)
+        old_fd = self._fd
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        os.close(old_fd)
+        self.current_size = self.base_size = os.fstat(self._fd).st_size
+        self.unsynced_bytes = 0
+        print(f"AOF rewrite complete: {self.current_size} bytes")
+
+    def _rewrite_done(self, ok: bool, started: float) -> None:
+        self._rewrite_buf = None
+        self._rewrite_task = None
+        self.rewrite_in_progress = False
+        self.last_rewrite_ok = ok
+        self.last_rewrite_duration = int(time.time() - started)
+
+    def close(self) -> None:
+        if self._fd is None:
+            return
+        self.flush()
+        if self.fsync_policy != 'no':
+            self._fsync()
+        if self._fsync_task:
+            self._fsync_task.cancel()
+            self._fsync_task = None
+        os.close(self._fd)
+        self._fd = None
+
+    def info(self) -> dict:
+        return {
+            'aof_enabled': int(self.enabled),
+            'aof_fsync_policy': self.fsync_policy,
+            'aof_current_size': self.current_size,
+            'aof_buffer_length': len(self._buf),
+            'aof_pending_fsync_bytes': self.unsynced_bytes,
+            'aof_fsync_in_progress': int(self._fsync_in_progress),
+            'aof_last_fsync_latency_usec': int(self.last_fsync_latency * 1_000_000),
+            'aof_last_fsync_time': int(self.last_fsync_time or 0),
+            'aof_fsync_count': self.fsync_count,
+            'aof_last_write_status': 'ok' if self.last_write_ok else 'err',
+            'aof_rewrite_in_progress': int(self.rewrite_in_progress),
+            'aof_rewrite_buffer_length': len(self._rewrite_buf) if self._rewrite_buf is not None else 0,
+            'aof_last_bgrewrite_status': 'ok' if self.last_rewrite_ok else 'err',
+            'aof_last_rewrite_time_sec': self.last_rewrite_duration,
+            'aof_base_size': self.base_size,
+        }
+
+aof = AppendOnlyFile()
+
+def log_to_aof(resp_cmd: bytes):
+    aof.append(resp_cmd)
 
 async def load_from_aof(client_state):
     """
     Replays the AOF file on startup to restore server state.
+    The file is streamed through the RESP parser in chunks rather than read whole.
     """
     if not os.path.exists(AOF_FILE):
         print("No Aof File found. Starting with empty state")
         return 
     print(f"Loading AOF: {AOF_FILE}...")
-    with open(AOF_FILE,"rb") as f:
-        buffer = f.read()
-    
-    pos = 0
-    while pos < len(buffer):
-        # 1. Parse the next common from the buffer
-        cmd, args, consumed = convert_resp(buffer[pos:])
-        from commands import redis_command
-        if cmd:
-            # 2. Execute the common internally
-            # set is_replic= True to avoid re-logging to AOF or propagating to replicas during recovery
-            await redis_command(cmd,args,client_state,is_replica = True)
-            pos += consumed
-        else:
-            break
+    from commands import redis_command
+    parser = RespParser()
+    errors = 0
+    expiry.loading = True
+    try:
+        with open(AOF_FILE, "rb") as f:
+            while True:
+                chunk = f.read(AOF_LOAD_CHUNK)
+                if not chunk:
+                    break
+                parser.feed(chunk)
+                for cmd, args, _ in parser:
+                    # set is_replica=True to avoid re-logging to AOF or propagating to replicas during recovery
+                    reply = await redis_command(cmd, args, client_state, is_replica=True)
+                    if reply and reply.startswith(b"-"):
+                        errors += 1
+                        print(f"AOF command {cmd.upper()} {bytes(args[0]) if args else b''!r} failed: "
+                              f"{reply[1:].strip().decode(errors='replace')}")
+    finally:
+        expiry.loading = False
+    if errors:
+        print(f"AOF replay: {errors} commands failed")
+    if parser.pending():
+        print(f"AOF ends with a truncated command ({parser.pending()} bytes ignored)")
     print("AOF replay complete.")
-
-
-
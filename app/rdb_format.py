@@ -0,0 +1,848 @@
+"""
+RDB snapshot format (version 11): encoder and streaming decoder.
+
+Files written here load in real Redis, and dumps made by real Redis load here.
+Strings may be integer encoded or LZF compressed, keys may carry an
+EXPIRETIME_MS opcode and the file ends with a CRC64 (Jones) trailer.
+
+The decoder is sans-IO: RdbDecoder.run() is a generator that decodes from a
+buffered chunk and only suspends when the chunk runs dry, yielding how many
+more bytes it needs; it is sent at least that many back. load_file() and
+feed_async() drive it from a file or a socket, so a snapshot is never held
+in memory as a whole.
+"""
+import os
+import struct
+import time
+from typing import Callable, Optional
+from data_type import listpack
+
+RDB_VERSION = 11
+RDB_MAX_LOADABLE_VERSION = 12
+REDIS_VERSION = b"7.2.0"
+
+# Object types
+RDB_TYPE_STRING = 0
+RDB_TYPE_LIST = 1
+RDB_TYPE_SET = 2
+RDB_TYPE_ZSET = 3
+RDB_TYPE_HASH = 4
+RDB_TYPE_ZSET_2 = 5
+RDB_TYPE_HASH_ZIPMAP = 9
+RDB_TYPE_LIST_ZIPLIST = 10
+RDB_TYPE_SET_INTSET = 11
+RDB_TYPE_ZSET_ZIPLIST = 12
+RDB_TYPE_HASH_ZIPLIST = 13
+RDB_TYPE_LIST_QUICKLIST = 14
+RDB_TYPE_STREAM_LISTPACKS = 15
+RDB_TYPE_HASH_LISTPACK = 16
+RDB_TYPE_ZSET_LISTPACK = 17
+RDB_TYPE_LIST_QUICKLIST_2 = 18
+RDB_TYPE_STREAM_LISTPACKS_2 = 19
+RDB_TYPE_SET_LISTPACK = 20
+RDB_TYPE_STREAM_LISTPACKS_3 = 21
+
+# Opcodes
+RDB_OPCODE_SLOT_INFO = 244
+RDB_OPCODE_FUNCTION2 = 245
+RDB_OPCODE_FUNCTION_PRE_GA = 246
+RDB_OPCODE_MODULE_AUX = 247
+RDB_OPCODE_IDLE = 248
+RDB_OPCODE_FREQ = 249
+RDB_OPCODE_AUX = 250
+RDB_OPCODE_RESIZEDB = 251
+RDB_OPCODE_EXPIRETIME_MS = 252
+RDB_OPCODE_EXPIRETIME = 253
+RDB_OPCODE_SELECTDB = 254
+RDB_OPCODE_EOF = 255
+
+# Special string encodings (length byte 11xxxxxx)
+RDB_ENC_INT8 = 0
+RDB_ENC_INT16 = 1
+RDB_ENC_INT32 = 2
+RDB_ENC_LZF = 3
+
+QUICKLIST_NODE_CONTAINER_PLAIN = 1
+QUICKLIST_NODE_CONTAINER_PACKED = 2
+
+STREAM_ITEM_FLAG_DELETED = 1
+STREAM_ITEM_FLAG_SAMEFIELDS = 2
+STREAM_NODE_MAX_ENTRIES = 100
+
+LZF_MIN_LENGTH = 20
+LOAD_CHUNK = 64 * 1024
+SAVE_CHUNK = 64 * 1024
+
+
+class RdbError(Exception):
+    """Raised for snapshots that are corrupt or use features this server cannot load."""
+
+
+# CRC64 (Jones polynomial, reflected), as used by Redis for the RDB trailer
+def _make_crc64_table():
+    poly = 0x95AC9329AC4BC9B5
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ poly if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+_CRC64_TABLE = _make_crc64_table()
+
+def _make_slice8_tables():
+    # Table k advances a byte through k further zero bytes, so eight bytes fold in at once
+    tables = [_CRC64_TABLE]
+    for _ in range(7):
+        prev = tables[-1]
+        tables.append([(c >> 8) ^ _CRC64_TABLE[c & 0xFF] for c in prev])
+    return tables
+
+_CRC64_SLICE8 = _make_slice8_tables()
+
+def crc64(crc: int, data) -> int:
+    """CRC64 of data continuing from crc, eight bytes per step (slice-by-8)."""
+    t0, t1, t2, t3, t4, t5, t6, t7 = _CRC64_SLICE8
+    data = memoryview(data)
+    n = len(data) & ~7
+    for word, in struct.iter_unpack('<Q', data[:n]):
+        b = (crc ^ word).to_bytes(8, 'little')
+        crc = (t7[b[0]] ^ t6[b[1]] ^ t5[b[2]] ^ t4[b[3]] ^
+               t3[b[4]] ^ t2[b[5]] ^ t1[b[6]] ^ t0[b[7]])
+    for b in data[n:]:
+        crc = t0[(crc ^ b) & 0xFF] ^ (crc >> 8)
+    return crc
+
+
+# LZF
+LZF_MAX_OFF = 1 << 13
+LZF_MAX_REF = (1 << 8) + (1 << 3)
+LZF_MAX_LIT = 1 << 5
+
+def lzf_compress(data: bytes) -> Optional[bytes]:
+    """Compress with the LZF format. Returns None when compression does not pay off."""
+    n = len(data)
+    if n < 4:
+        return None
+    # A back reference of length L saves at most L - 2 bytes and starts L - 2
+    # positions whose 3 bytes occurred earlier; without two of those (the common
+    # case for short values) nothing can be saved, so skip the byte-by-byte pass
+    if n - 2 - len(set(zip(data, data[1:], data[2:]))) < 2:
+        return None
+    out = bytearray()
+    table = {}
+    lit_start = 0
+    ip = 0
+
+    def emit_literals(end):
+        start = lit_start
+        while start < end:
+            run = min(LZF_MAX_LIT, end - start)
+            out.append(run - 1)
+            out.extend(data[start:start + run])
+            start += run
+
+    while ip < n - 2:
+        key = data[ip:ip + 3]
+        ref = table.get(key)
+        table[key] = ip
+        if ref is not None and ip - ref - 1 < LZF_MAX_OFF:
+            off = ip - ref - 1
+            max_len = min(n - ip, LZF_MAX_REF)
+            length = 3
+            while length < max_len and data[ref + length] == data[ip + length]:
+                length += 1
+            emit_literals(ip)
+            length_code = length - 2
+            if length_code < 7:
+                out.append((off >> 8) + (length_code << 5))
+            else:
+                out.append((off >> 8) + (7 << 5))
+                out.append(length_code - 7)
+            out.append(off & 0xFF)
+            ip += length
+            lit_start = ip
+            if len(out) >= n:
+                return None
+        else:
+            ip += 1
+    emit_literals(n)
+    return bytes(out) if len(out) < n else None
+
+def lzf_decompress(data: bytes, expected_len: int) -> bytes:
+    out = bytearray()
+    ip = 0
+    n = len(data)
+    while ip < n:
+        ctrl = data[ip]
+        ip += 1
+        if ctrl < 32:
+            out += data[ip:ip + ctrl + 1]
+            ip += ctrl + 1
+            continue
+        length = ctrl >> 5
+        if length == 7:
+            length += data[ip]
+            ip += 1
+        ref = len(out) - ((ctrl & 0x1F) << 8) - 1 - data[ip]
+        ip += 1
+        length += 2
+        if ref < 0:
+            raise RdbError("invalid LZF back reference")
+        if ref + length <= len(out):
+            out += out[ref:ref + length]
+        else:
+            # Overlapping copy: the back reference repeats its last len(out) - ref bytes
+            pattern = out[ref:]
+            out += (pattern * (length // len(pattern) + 1))[:length]
+    if len(out) != expected_len:
+        raise RdbError("LZF payload has the wrong length")
+    return bytes(out)
+
+
+# Encoding
+def encode_length(n: int) -> bytes:
+    if n < 1 << 6:
+        return bytes((n,))
+    if n < 1 << 14:
+        return bytes((0x40 | (n >> 8), n & 0xFF))
+    if n <= 0xFFFFFFFF:
+        return b"\x80" + n.to_bytes(4, 'big')
+    return b"\x81" + n.to_bytes(8, 'big')
+
+def encode_string(value, compress: bool = True) -> bytes:
+    if isinstance(value, int):
+        value = b"%d" % value
+    elif isinstance(value, bytearray):
+        # Bitmaps; the LZF match table needs hashable slices
+        value = bytes(value)
+    n = len(value)
+    if n <= 11:
+        num = listpack.string_to_int(value)
+        if num is not None:
+            if -(1 << 7) <= num < 1 << 7:
+                return b"\xc0" + num.to_bytes(1, 'little', signed=True)
+            if -(1 << 15) <= num < 1 << 15:
+                return b"\xc1" + num.to_bytes(2, 'little', signed=True)
+            if -(1 << 31) <= num < 1 << 31:
+                return b"\xc2" + num.to_bytes(4, 'little', signed=True)
+    if compress and n > LZF_MIN_LENGTH:
+        packed = lzf_compress(value)
+        if packed is not None:
+            return b"\xc3" + encode_length(len(packed)) + encode_length(n) + packed
+    return encode_length(n) + value
+
+def encode_millis(ms: int) -> bytes:
+    return ms.to_bytes(8, 'little', signed=True)
+
+def stream_id_bytes(ms: int, seq: int) -> bytes:
+    return ms.to_bytes(8, 'big') + seq.to_bytes(8, 'big')
+
+
+class RdbWriter:
+    """
+    Writes an RDB snapshot to a binary file object. Output is gathered into
+    SAVE_CHUNK sized chunks and the CRC64 is computed a chunk at a time; with
+    checksum off the trailer is 0, which loaders take as "not checksummed".
+    """
+
+    def __init__(self, f, compress: bool = True, checksum: bool = True):
+        self._f = f
+        self.compress = compress
+        self.checksum = checksum
+        self.crc = 0
+        self._chunk = bytearray()
+
+    def write(self, data: bytes) -> None:
+        self._chunk += data
+        if len(self._chunk) >= SAVE_CHUNK:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self.checksum:
+            self.crc = crc64(self.crc, self._chunk)
+        self._f.write(self._chunk)
+        self._chunk = bytearray()
+
+    def write_string(self, value) -> None:
+        self.write(encode_string(value, self.compress))
+
+    def write_header(self, db_size: int = 0, expires_size: int = 0) -> None:
+        self.write(b"REDIS%04d" % RDB_VERSION)
+        for field, value in ((b"redis-ver", REDIS_VERSION), (b"redis-bits", b"64"),
+                             (b"ctime", b"%d" % int(time.time())), (b"aof-base", b"0")):
+            self.write(bytes((RDB_OPCODE_AUX,)))
+            self.write_string(field)
+            self.write_string(value)
+        self.write(bytes((RDB_OPCODE_SELECTDB,)) + encode_length(0))
+        self.write(bytes((RDB_OPCODE_RESIZEDB,)) + encode_length(db_size) + encode_length(expires_size))
+
+    def _key_header(self, rdb_type: int, key: bytes, expire_ms: Optional[int]) -> None:
+        if expire_ms is not None:
+            self.write(bytes((RDB_OPCODE_EXPIRETIME_MS,)) + encode_millis(expire_ms))
+        self.write(bytes((rdb_type,)))
+        self.write_string(key)
+
+    def write_string_key(self, key: bytes, value, expire_ms: Optional[int] = None) -> None:
+        self._key_header(RDB_TYPE_STRING, key, expire_ms)
+        self.write_string(value)
+
+    def write_list_key(self, key: bytes, items, expire_ms: Optional[int] = None) -> None:
+        items = list(items)
+        self._key_header(RDB_TYPE_LIST, key, expire_ms)
+        self.write(encode_length(len(items)))
+        for item in items:
+            self.write_string(item)
+
+    def write_quicklist_key(self, key: bytes, nodes, expire_ms: Optional[int] = None) -> None:
+        """nodes: the list's listpack node buffers, written as packed quicklist nodes."""
+        nodes = list(nodes)
+        self._key_header(RDB_TYPE_LIST_QUICKLIST_2, key, expire_ms)
+        self.write(encode_length(len(nodes)))
+        for node in nodes:
+            self.write(encode_length(QUICKLIST_NODE_CONTAINER_PACKED))
+            self.write_string(node)
+
+    def write_set_key(self, key: bytes, members, expire_ms: Optional[int] = None) -> None:
+        members = list(members)
+        self._key_header(RDB_TYPE_SET, key, expire_ms)
+        self.write(encode_length(len(members)))
+        for member in members:
+            self.write_string(member)
+
+    def write_hash_key(self, key: bytes, pairs, expire_ms: Optional[int] = None) -> None:
+        pairs = list(pairs)
+        self._key_header(RDB_TYPE_HASH, key, expire_ms)
+        self.write(encode_length(len(pairs)))
+        for field, value in pairs:
+            self.write_string(field)
+            self.write_string(value)
+
+    def write_zset_key(self, key: bytes, pairs, expire_ms: Optional[int] = None) -> None:
+        """pairs: (member, score), written with binary scores as RDB_TYPE_ZSET_2."""
+        pairs = list(pairs)
+        self._key_header(RDB_TYPE_ZSET_2, key, expire_ms)
+        self.write(encode_length(len(pairs)))
+        for member, score in pairs:
+            self.write_string(member)
+            self.write(struct.pack('<d', score))
+
+    def write_listpack_key(self, rdb_type: int, key: bytes, blob: bytes, expire_ms: Optional[int] = None) -> None:
+        """A small aggregate stored as one blob: a listpack (RDB_TYPE_HASH_LISTPACK and the like) or an intset."""
+        self._key_header(rdb_type, key, expire_ms)
+        self.write_string(blob)
+
+    def write_stream_key(self, key: bytes, entries, last_id, first_id=(0, 0), max_deleted_id=(0, 0),
+                         entries_added: int = 0, groups=(), expire_ms: Optional[int] = None) -> None:
+        """
+        entries: list of (ms, seq, fields) in ID order, fields being a dict of bytes.
+        groups: list of dicts with name, last_id, entries_read, pel and consumers.
+        """
+        self._key_header(RDB_TYPE_STREAM_LISTPACKS_3, key, expire_ms)
+        nodes = [entries[i:i + STREAM_NODE_MAX_ENTRIES] for i in range(0, len(entries), STREAM_NODE_MAX_ENTRIES)]
+        self.write(encode_length(len(nodes)))
+        for node in nodes:
+            master_ms, master_seq, master = node[0]
+            master_fields = list(master)
+            items = [len(node), 0, len(master_fields), *master_fields, 0]
+            for ms, seq, fields in node:
+                names = list(fields)
+                if names == master_fields:
+                    items += [STREAM_ITEM_FLAG_SAMEFIELDS, ms - master_ms, seq - master_seq]
+                    items += fields.values()
+                    items.append(len(names) + 3)
+                else:
+                    items += [0, ms - master_ms, seq - master_seq, len(names)]
+                    for name, value in fields.items():
+                        items += [name, value]
+                    items.append(len(names) * 2 + 4)
+            self.write_string(stream_id_bytes(master_ms, master_seq))
+            self.write_string(listpack.encode(items))
+        self.write(encode_length(len(entries)))
+        self.write(encode_length(last_id[0]) + encode_length(last_id[1]))
+        self.write(encode_length(first_id[0]) + encode_length(first_id[1]))
+        self.write(encode_length(max_deleted_id[0]) + encode_length(max_deleted_id[1]))
+        self.write(encode_length(entries_added))
+        self.write(encode_length(len(groups)))
+        for group in groups:
+            self.write_string(group['name'])
+            self.write(encode_length(group['last_id'][0]) + encode_length(group['last_id'][1]))
+            # -1 (unknown) is saved as the 64-bit length of its uint64 value, as Redis does
+            self.write(encode_length(group['entries_read'] & 0xFFFFFFFFFFFFFFFF))
+            self.write(encode_length(len(group['pel'])))
+            for (ms, seq), delivery_time, delivery_count in group['pel']:
+                self.write(stream_id_bytes(ms, seq) + encode_millis(delivery_time) + encode_length(delivery_count))
+            self.write(encode_length(len(group['consumers'])))
+            for consumer in group['consumers']:
+                self.write_string(consumer['name'])
+                self.write(encode_millis(consumer['seen_time']) + encode_millis(consumer['active_time']))
+                self.write(encode_length(len(consumer['pel'])))
+                for ms, seq in consumer['pel']:
+                    self.write(stream_id_bytes(ms, seq))
+
+    def finish(self) -> None:
+        self.write(bytes((RDB_OPCODE_EOF,)))
+        self._flush()
+        self._f.write(self.crc.to_bytes(8, 'little'))
+
+
+# Decoding of the packed encodings embedded in RDB strings
+def decode_ziplist(buf: bytes) -> list:
+    """Decode a (pre Redis 7) ziplist into bytes/int elements."""
+    out = []
+    pos = 10
+    while buf[pos] != 0xFF:
+        pos += 5 if buf[pos] == 0xFE else 1          # prevlen
+        enc = buf[pos]
+        kind = enc >> 6
+        if kind == 0:
+            n = enc & 0x3F
+            out.append(bytes(buf[pos + 1:pos + 1 + n]))
+            pos += 1 + n
+        elif kind == 1:
+            n = ((enc & 0x3F) << 8) | buf[pos + 1]
+            out.append(bytes(buf[pos + 2:pos + 2 + n]))
+            pos += 2 + n
+        elif kind == 2:
+            n = int.from_bytes(buf[pos + 1:pos + 5], 'big')
+            out.append(bytes(buf[pos + 5:pos + 5 + n]))
+            pos += 5 + n
+        elif enc == 0xC0:
+            out.append(int.from_bytes(buf[pos + 1:pos + 3], 'little', signed=True))
+            pos += 3
+        elif enc == 0xD0:
+            out.append(int.from_bytes(buf[pos + 1:pos + 5], 'little', signed=True))
+            pos += 5
+        elif enc == 0xE0:
+            out.append(int.from_bytes(buf[pos + 1:pos + 9], 'little', signed=True))
+            pos += 9
+        elif enc == 0xF0:
+            out.append(int.from_bytes(buf[pos + 1:pos + 4], 'little', signed=True))
+            pos += 4
+        elif enc == 0xFE:
+            out.append(int.from_bytes(buf[pos + 1:pos + 2], 'little', signed=True))
+            pos += 2
+        elif 0xF1 <= enc <= 0xFD:
+            out.append((enc & 0x0F) - 1)
+            pos += 1
+        else:
+            raise RdbError(f"invalid ziplist encoding 0x{enc:02x}")
+    return out
+
+def encode_intset(values) -> bytes:
+    """An intset blob of sorted, distinct ints, in the narrowest of the 2, 4 and 8 byte widths that fits."""
+    values = list(values)
+    low, high = (values[0], values[-1]) if values else (0, 0)
+    for width, code in ((2, 'h'), (4, 'i'), (8, 'q')):
+        if -(1 << (8 * width - 1)) <= low and high < (1 << (8 * width - 1)):
+            break
+    return struct.pack(f'<II{len(values)}{code}', width, len(values), *values)
+
+def decode_intset(buf: bytes) -> list:
+    width = int.from_bytes(buf[0:4], 'little')
+    count = int.from_bytes(buf[4:8], 'little')
+    return [int.from_bytes(buf[8 + i * width:8 + (i + 1) * width], 'little', signed=True) for i in range(count)]
+
+def decode_zipmap(buf: bytes) -> list:
+    """Decode the (Redis 2.x) zipmap hash encoding into a flat field/value list."""
+    out = []
+    pos = 1
+
+    def read_len(p):
+        b = buf[p]
+        if b < 254:
+            return b, p + 1
+        return int.from_bytes(buf[p + 1:p + 5], 'little'), p + 5
+
+    while buf[pos] != 0xFF:
+        n, pos = read_len(pos)
+        out.append(bytes(buf[pos:pos + n]))
+        pos += n
+        n, pos = read_len(pos)
+        free = buf[pos]
+        pos += 1
+        out.append(bytes(buf[pos:pos + n]))
+        pos += n + free
+    return out
+
+def _pairs(flat) -> list:
+    flat = [listpack.as_bytes(v) for v in flat]
+    return list(zip(flat[0::2], flat[1::2]))
+
+
+class RdbDecoder:
+    """
+    Generator-based RDB decoder. Every complete key is handed to
+    on_key(key, rdb_type, value, expire_ms) as soon as it is decoded, with values as:
+      string -> bytes                      list -> list of bytes
+      set    -> list of bytes              hash -> list of (field, value)
+      zset   -> list of (member, score)    stream -> dict (see _read_stream)
+    Keys outside db 0 are skipped.
+    """
+
+    def __init__(self, on_key: Callable, verify_checksum: bool = True):
+        self.on_key = on_key
+        self.verify_checksum = verify_checksum
+        self.aux = {}
+        self.version = None
+        self.keys_loaded = 0
+        self._crc = 0 if verify_checksum else None
+        self._buf = b""
+        self._pos = 0
+
+    def _take(self, n: int) -> Optional[bytes]:
+        """Consume n buffered bytes without suspending; None when fewer are buffered."""
+        pos = self._pos
+        if pos + n > len(self._buf):
+            return None
+        self._pos = pos + n
+        return self._buf[pos:pos + n]
+
+    def _read(self, n: int):
+        data = self._take(n)
+        if data is None:
+            yield from self._fill(n)
+            data = self._take(n)
+        return data
+
+    def _fill(self, n: int):
+        """Suspend until n unread bytes are buffered; the consumed part is checksummed first."""
+        buf, pos = self._buf, self._pos
+        if self._crc is not None:
+            self._crc = crc64(self._crc, memoryview(buf)[:pos])
+        rest = buf[pos:]
+        data = yield n - len(rest)
+        self._buf = rest + data if rest else data
+        self._pos = 0
+
+    def _read_byte(self):
+        return (yield from self._read(1))[0]
+
+    def _buffered_length(self):
+        """_read_length() without suspending; None when the length is not all buffered."""
+        buf, pos = self._buf, self._pos
+        if pos >= len(buf):
+            return None
+        b = buf[pos]
+        kind = b >> 6
+        if kind == 0 or kind == 3:
+            self._pos = pos + 1
+            return b & 0x3F, kind == 3
+        if kind == 1:
+            if pos + 2 > len(buf):
+                return None
+            self._pos = pos + 2
+            return ((b & 0x3F) << 8) | buf[pos + 1], False
+        size = 4 if b == 0x80 else 8 if b == 0x81 else 0
+        if not size or pos + 1 + size > len(buf):
+            return None
+        self._pos = pos + 1 + size
+        return int.from_bytes(buf[pos + 1:pos + 1 + size], 'big'), False
+
+    def _read_length(self):
+        """Returns (length, is_special_encoding)."""
+        length = self._buffered_length()
+        if length is not None:
+            return length
+        b = yield from self._read_byte()
+        kind = b >> 6
+        if kind == 0:
+            return b & 0x3F, False
+        if kind == 1:
+            return ((b & 0x3F) << 8) | (yield from self._read_byte()), False
+        if b == 0x80:
+            return int.from_bytes((yield from self._read(4)), 'big'), False
+        if b == 0x81:
+            return int.from_bytes((yield from self._read(8)), 'big'), False
+        if kind == 3:
+            return b & 0x3F, True
+        raise RdbError(f"unknown length encoding 0x{b:02x}")
+
+    def _read_len(self):
+        n, special = yield from self._read_length()
+        if special:
+            raise RdbError("unexpected encoded length")
+        return n
+
+    def _read_string(self) -> bytes:
+        length = self._buffered_length()
+        n, special = length if length is not None else (yield from self._read_length())
+        if not special:
+            data = self._take(n)
+            return data if data is not None else (yield from self._read(n))
+        if n == RDB_ENC_INT8:
+            return b"%d" % int.from_bytes((yield from self._read(1)), 'little', signed=True)
+        if n == RDB_ENC_INT16:
+            return b"%d" % int.from_bytes((yield from self._read(2)), 'little', signed=True)
+        if n == RDB_ENC_INT32:
+            return b"%d" % int.from_bytes((yield from self._read(4)), 'little', signed=True)
+        if n == RDB_ENC_LZF:
+            clen = yield from self._read_len()
+            ulen = yield from self._read_len()
+            return lzf_decompress((yield from self._read(clen)), ulen)
+        raise RdbError(f"unknown string encoding {n}")
+
+    def _read_millis(self) -> int:
+        return int.from_bytes((yield from self._read(8)), 'little', signed=True)
+
+    def _read_double_string(self) -> float:
+        n = yield from self._read_byte()
+        if n == 253:
+            return float('nan')
+        if n == 254:
+            return float('inf')
+        if n == 255:
+            return float('-inf')
+        return float((yield from self._read(n)))
+
+    def _read_binary_double(self) -> float:
+        return struct.unpack('<d', (yield from self._read(8)))[0]
+
+    def _read_object(self, rdb_type: int):
+        if rdb_type == RDB_TYPE_STRING:
+            return (yield from self._read_string())
+
+        if rdb_type in (RDB_TYPE_LIST, RDB_TYPE_SET):
+            items = []
+            for _ in range((yield from self._read_len())):
+                items.append((yield from self._read_string()))
+            return items
+        if rdb_type == RDB_TYPE_LIST_ZIPLIST:
+            return [listpack.as_bytes(v) for v in decode_ziplist((yield from self._read_string()))]
+        if rdb_type in (RDB_TYPE_LIST_QUICKLIST, RDB_TYPE_LIST_QUICKLIST_2):
+            items = []
+            for _ in range((yield from self._read_len())):
+                container = QUICKLIST_NODE_CONTAINER_PACKED
+                if rdb_type == RDB_TYPE_LIST_QUICKLIST_2:
+                    container = yield from self._read_len()
+                data = yield from self._read_string()
+                if container == QUICKLIST_NODE_CONTAINER_PLAIN:
+                    items.append(data)
+                elif rdb_type == RDB_TYPE_LIST_QUICKLIST:
+                    items += [listpack.as_bytes(v) for v in decode_ziplist(data)]
+                else:
+                    items += [listpack.as_bytes(v) for v in listpack.iter_elements(data)]
+            return items
+
+        if rdb_type == RDB_TYPE_SET_INTSET:
+            return [b"%d" % v for v in decode_intset((yield from self._read_string()))]
+        if rdb_type == RDB_TYPE_SET_LISTPACK:
+            return [listpack.as_bytes(v) for v in listpack.iter_elements((yield from self._read_string()))]
+
+        if rdb_type == RDB_TYPE_HASH:
+            pairs = []
+            for _ in range((yield from self._read_len())):
+                field = yield from self._read_string()
+                pairs.append((field, (yield from self._read_string())))
+            return pairs
+        if rdb_type == RDB_TYPE_HASH_ZIPMAP:
+            return _pairs(decode_zipmap((yield from self._read_string())))
+        if rdb_type == RDB_TYPE_HASH_ZIPLIST:
+            return _pairs(decode_ziplist((yield from self._read_string())))
+        if rdb_type == RDB_TYPE_HASH_LISTPACK:
+            return _pairs(listpack.decode((yield from self._read_string())))
+
+        if rdb_type in (RDB_TYPE_ZSET, RDB_TYPE_ZSET_2):
+            read_score = self._read_binary_double if rdb_type == RDB_TYPE_ZSET_2 else self._read_double_string
+            pairs = []
+            for _ in range((yield from self._read_len())):
+                member = yield from self._read_string()
+                pairs.append((member, (yield from read_score())))
+            return pairs
+        if rdb_type in (RDB_TYPE_ZSET_ZIPLIST, RDB_TYPE_ZSET_LISTPACK):
+            data = yield from self._read_string()
+            flat = decode_ziplist(data) if rdb_type == RDB_TYPE_ZSET_ZIPLIST else listpack.decode(data)
+            return [(member, float(score)) for member, score in _pairs(flat)]
+
+        if rdb_type in (RDB_TYPE_STREAM_LISTPACKS, RDB_TYPE_STREAM_LISTPACKS_2, RDB_TYPE_STREAM_LISTPACKS_3):
+            return (yield from self._read_stream(rdb_type))
+
+        raise RdbError(f"unsupported object type {rdb_type}")
+
+    def _read_stream_id(self):
+        ms = yield from self._read_len()
+        seq = yield from self._read_len()
+        return ms, seq
+
+    def _read_raw_stream_id(self):
+        raw = yield from self._read(16)
+        return int.from_bytes(raw[:8], 'big'), int.from_bytes(raw[8:], 'big')
+
+    def _read_stream(self, rdb_type: int) -> dict:
+        entries = []
+        for _ in range((yield from self._read_len())):
+            node_key = yield from self._read_string()
+            node = yield from self._read_string()
+            entries += decode_stream_node(node_key, node)
+        stream = {'entries': entries, 'length': (yield from self._read_len())}
+        stream['last_id'] = yield from self._read_stream_id()
+        if rdb_type >= RDB_TYPE_STREAM_LISTPACKS_2:
+            stream['first_id'] = yield from self._read_stream_id()
+            stream['max_deleted_id'] = yield from self._read_stream_id()
+            stream['entries_added'] = yield from self._read_len()
+        else:
+            stream['first_id'] = entries[0][:2] if entries else (0, 0)
+            stream['max_deleted_id'] = (0, 0)
+            stream['entries_added'] = stream['length']
+
+        groups = []
+        for _ in range((yield from self._read_len())):
+            group = {'name': (yield from self._read_string()), 'last_id': (yield from self._read_stream_id())}
+            group['entries_read'] = (yield from self._read_len()) if rdb_type >= RDB_TYPE_STREAM_LISTPACKS_2 else 0
+            if group['entries_read'] >= 1 << 63:
+                group['entries_read'] -= 1 << 64
+            pel = []
+            for _ in range((yield from self._read_len())):
+                entry_id = yield from self._read_raw_stream_id()
+                delivery_time = yield from self._read_millis()
+                pel.append((entry_id, delivery_time, (yield from self._read_len())))
+            group['pel'] = pel
+            consumers = []
+            for _ in range((yield from self._read_len())):
+                consumer = {'name': (yield from self._read_string()), 'seen_time': (yield from self._read_millis())}
+                consumer['active_time'] = ((yield from self._read_millis())
+                                           if rdb_type >= RDB_TYPE_STREAM_LISTPACKS_3 else consumer['seen_time'])
+                consumer['pel'] = []
+                for _ in range((yield from self._read_len())):
+                    consumer['pel'].append((yield from self._read_raw_stream_id()))
+                consumers.append(consumer)
+            group['consumers'] = consumers
+            groups.append(group)
+        stream['groups'] = groups
+        return stream
+
+    def run(self):
+        magic = yield from self._read(9)
+        if magic[:5] != b"REDIS" or not magic[5:].isdigit():
+            raise RdbError("wrong signature, not an RDB file")
+        self.version = int(magic[5:])
+        if not 1 <= self.version <= RDB_MAX_LOADABLE_VERSION:
+            raise RdbError(f"can't handle RDB format version {self.version}")
+
+        db = 0
+        expire_ms = None
+        while True:
+            data = self._take(1)
+            op = data[0] if data is not None else (yield from self._read_byte())
+            if op == RDB_OPCODE_EOF:
+                break
+            if op == RDB_OPCODE_EXPIRETIME_MS:
+                expire_ms = yield from self._read_millis()
+            elif op == RDB_OPCODE_EXPIRETIME:
+                expire_ms = int.from_bytes((yield from self._read(4)), 'little', signed=True) * 1000
+            elif op == RDB_OPCODE_FREQ:
+                yield from self._read(1)
+            elif op == RDB_OPCODE_IDLE:
+                yield from self._read_len()
+            elif op == RDB_OPCODE_AUX:
+                field = yield from self._read_string()
+                self.aux[field] = yield from self._read_string()
+            elif op == RDB_OPCODE_RESIZEDB:
+                yield from self._read_len()
+                yield from self._read_len()
+            elif op == RDB_OPCODE_SELECTDB:
+                db = yield from self._read_len()
+            elif op == RDB_OPCODE_SLOT_INFO:
+                for _ in range(3):
+                    yield from self._read_len()
+            elif op == RDB_OPCODE_FUNCTION2:
+                # Function libraries are not supported; skip the library code
+                yield from self._read_string()
+            elif op in (RDB_OPCODE_MODULE_AUX, RDB_OPCODE_FUNCTION_PRE_GA):
+                raise RdbError(f"unsupported opcode {op}")
+            else:
+                key = yield from self._read_string()
+                value = yield from self._read_object(op)
+                if db == 0:
+                    self.on_key(key, op, value, expire_ms)
+                    self.keys_loaded += 1
+                expire_ms = None
+
+        if self.version >= 5:
+            if self._crc is not None:
+                self._crc = crc64(self._crc, memoryview(self._buf)[:self._pos])
+            expected = self._crc
+            self._crc = None
+            stored = int.from_bytes((yield from self._read(8)), 'little')
+            if self.verify_checksum and stored and stored != expected:
+                raise RdbError("wrong RDB checksum")
+        return self._buf[self._pos:]
+
+
+def decode_stream_node(node_key: bytes, node: bytes) -> list:
+    """Decode one stream listpack node into [(ms, seq, fields)], skipping deleted entries."""
+    master_ms = int.from_bytes(node_key[:8], 'big')
+    master_seq = int.from_bytes(node_key[8:16], 'big')
+    items = listpack.decode(node)
+    master_count = items[2]
+    master_fields = [listpack.as_bytes(f) for f in items[3:3 + master_count]]
+    i = 3 + master_count + 1                 # skip the master entry terminator
+    out = []
+    while i < len(items):
+        flags = items[i]
+        ms = master_ms + items[i + 1]
+        seq = master_seq + items[i + 2]
+        i += 3
+        if flags & STREAM_ITEM_FLAG_SAMEFIELDS:
+            names = master_fields
+            values = items[i:i + master_count]
+            i += master_count
+        else:
+            count = items[i]
+            flat = items[i + 1:i + 1 + count * 2]
+            names = [listpack.as_bytes(f) for f in flat[0::2]]
+            values = flat[1::2]
+            i += 1 + count * 2
+        i += 1                               # lp-count
+        if not flags & STREAM_ITEM_FLAG_DELETED:
+            out.append((ms, seq, dict(zip(names, [listpack.as_bytes(v) for v in values]))))
+    return out
+
+
+def feed(gen, read):
+    """Drive a decoder generator with a blocking read(n) callable, a chunk at a time."""
+    try:
+        n = next(gen)
+        while True:
+            data = read(max(n, LOAD_CHUNK))
+            if len(data) < n:
+                raise RdbError("unexpected end of RDB data")
+            n = gen.send(data)
+    except StopIteration as stop:
+        return stop.value
+
+async def feed_async(gen, read_chunk, limit: Optional[int] = None):
+    """
+    Drive a decoder generator from an awaitable read_chunk(max_bytes) such as
+    StreamReader.read. At most limit bytes are consumed when it is given;
+    returns the bytes read past the end of the snapshot.
+    """
+    try:
+        n = next(gen)
+        while True:
+            buf = bytearray()
+            while len(buf) < n:
+                want = max(n - len(buf), LOAD_CHUNK)
+                if limit is not None:
+                    want = min(want, limit)
+                chunk = await read_chunk(want) if want else b""
+                if not chunk:
+                    raise RdbError("unexpected end of RDB data")
+                if limit is not None:
+                    limit -= len(chunk)
+                buf += chunk
+            n = gen.send(bytes(buf))
+    except StopIteration as stop:
+        return stop.value
+
+def load_file(path: str, on_key: Callable, verify_checksum: bool = True) -> RdbDecoder:
+    with open(path, "rb", buffering=1024 * 1024) as f:
+        if verify_checksum:
+            # A zero trailer means the file was written without a checksum
+            f.seek(-8, os.SEEK_END)
+            verify_checksum = f.read(8) != b"\0" * 8
+            f.seek(0)
+        decoder = RdbDecoder(on_key, verify_checksum)
+        feed(decoder.run(), f.read)
+    return decoder
@@ -1,10 +1,12 @@
 COMMAND_REGISTRY = {}
 WRITE_COMMANDS = set()
 
-def redis_cmd(is_write = False):
+def redis_cmd(is_write = False, deny_oom = None):
+    # deny_oom: refused while over maxmemory; every write except those that only remove data
     def decorator(func):
         cmd_name = func.__name__.replace("_func", "").lower()
         func.is_write = is_write
+        func.deny_oom = is_write if deny_oom is None else deny_oom
         
         COMMAND_REGISTRY[cmd_name] = func
         if is_write:
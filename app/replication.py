@@ -0,0 +1,324 @@
+"""
+Master side of replication: the backlog used for partial resynchronization
+and the snapshot transfer of a full one.
+
+A replica reconnecting with our replid and an offset still covered by the
+backlog is answered +CONTINUE and sent only the bytes it missed.
+
+After FULLRESYNC the replica is sent a live RDB snapshot of the dataset at the
+announced offset. A forked child writes the snapshot and the event loop relays it
+to the replica chunk by chunk with drain(), so neither side holds the whole file:
+  - diskless (replica sent `capa eof`): the child writes into a pipe and the payload
+    is framed as $EOF:<mark> ... <mark>, since its length is not known up front
+  - otherwise the child writes a temp file, which is then sent as $<length>
+Writes propagated while the snapshot is in flight are kept in `pending` and
+sent right after it, when the replica joins server_state['replicas'] as a ReplicaLink.
+"""
+import asyncio
+import os
+import secrets
+import time
+from collections import deque
+from typing import Optional
+from persistence import fork_child, wait_child, kill_child, save_rdb, write_rdb, rdb
+
+REPL_SYNC_CHUNK = 64 * 1024
+RDB_EOF_MARK_SIZE = 40
+REPL_BACKLOG_SIZE = 1024 * 1024
+# client-output-buffer-limit replica <hard> <soft> <soft seconds>, as in redis.conf
+REPLICA_OUTPUT_HARD_LIMIT = 256 * 1024 * 1024
+REPLICA_OUTPUT_SOFT_LIMIT = 64 * 1024 * 1024
+REPLICA_OUTPUT_SOFT_SECONDS = 60
+
+
+class ReplicationBacklog:
+    """
+    Circular buffer with the most recent `size` bytes of the replication stream.
+    Allocated when the first replica attaches; from then on every propagated
+    batch is fed to it, so end_offset tracks master_repl_offset.
+    """
+
+    def __init__(self, size: int = REPL_BACKLOG_SIZE):
+        self.size = size
+        self.histlen = 0
+        self.end_offset = 0   # replication offset just past the newest byte
+        self._buf = None
+        self._idx = 0         # where the next byte goes
+
+    @property
+    def active(self) -> bool:
+        return self._buf is not None
+
+    @property
+    def start_offset(self) -> int:
+        return self.end_offset - self.histlen
+
+    def activate(self, offset: int) -> None:
+        if self._buf is None:
+            self._buf = bytearray(self.size)
+            self._idx = 0
+            self.histlen = 0
+            self.end_offset = offset
+
+    def feed(self, data: bytes) -> None:
+        if self._buf is None:
+            return
+        n = len(data)
+        self.end_offset += n
+        if n >= self.size:
+            self._buf[:] = data[n - self.size:]
+            self._idx = 0
+            self.histlen = self.size
+            return
+        first = min(n, self.size - self._idx)
+        self._buf[self._idx:self._idx + first] = data[:first]
+        if first < n:
+            self._buf[:n - first] = data[first:]
+        self._idx = (self._idx + n) % self.size
+        self.histlen = min(self.histlen + n, self.size)
+
+    def read_from(self, offset: int) -> Optional[bytes]:
+        """The stream from offset up to now, or None when offset is not covered."""
+        if self._buf is None or not self.start_offset <= offset <= self.end_offset:
+            return None
+        n = self.end_offset - offset
+        start = (self._idx - n) % self.size
+        if start + n <= self.size:
+            return bytes(self._buf[start:start + n])
+        return bytes(self._buf[start:]) + bytes(self._buf[:n - (self.size - start)])
+
+    def info(self) -> dict:
+        return {
+            'repl_backlog_active': int(self.active),
+            'repl_backlog_size': self.size,
+            'repl_backlog_first_byte_offset': self.start_offset + 1 if self.active else 0,
+            'repl_backlog_histlen': self.histlen,
+        }
+
+backlog = ReplicationBacklog()
+
+
+class ReplicaLink:
+    """
+    An online replica. Propagated writes are appended to its own output queue and
+    a dedicated task moves them to the socket, so the master never waits on any
+    replica's network and a slow one only grows its own queue. A replica whose
+    queue passes the hard limit, or stays over the soft limit for soft_seconds,
+    is disconnected; it can come back with a partial resync.
+    """
+    hard_limit = REPLICA_OUTPUT_HARD_LIMIT
+    soft_limit = REPLICA_OUTPUT_SOFT_LIMIT
+    soft_seconds = REPLICA_OUTPUT_SOFT_SECONDS
+
+    def __init__(self, writer: asyncio.StreamWriter, server_state, offset: int, port=None):
+        self.writer = writer
+        self.server_state = server_state
+        self.ip = (writer.get_extra_info('peername') or ('?',))[0]
+        self.port = port
+        self.ack_offset = offset
+        self.ack_time = time.time()
+        self.closed = False
+        self._queue = deque()
+        self._queued_bytes = 0
+        self._soft_limit_since = None
+        self._ready = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._send_loop())
+
+    @property
+    def output_buffer(self) -> int:
+        """Bytes not yet accepted by the kernel: our queue plus the transport buffer."""
+        return self._queued_bytes + self.writer.transport.get_write_buffer_size()
+
+    def send(self, data: bytes) -> None:
+        if self.closed or not data:
+            return
+        self._queue.append(data)
+        self._queued_bytes += len(data)
+        self._ready.set()
+        self._check_limits()
+
+    def _check_limits(self) -> None:
+        used = self.output_buffer
+        if self.hard_limit and used > self.hard_limit:
+            self.close(f"output buffer of {used} bytes is over the hard limit")
+        elif self.soft_limit and used > self.soft_limit:
+            now = time.monotonic()
+            if self._soft_limit_since is None:
+                self._soft_limit_since = now
+            elif now - self._soft_limit_since > self.soft_seconds:
+                self.close(f"output buffer over the soft limit for {self.soft_seconds}s")
+        else:
+            self._soft_limit_since = None
+
+    async def _send_loop(self) -> None:
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                while self._queue:
+                    chunks = list(self._queue)
+                    self._queue.clear()
+                    self._queued_bytes = 0
+                    self.writer.writelines(chunks)
+                    await self.writer.drain()
+        except (ConnectionError, OSError) as e:
+            self.close(f"write failed: {e}")
+
+    def close(self, reason: str = "") -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if reason:
+            print(f"Disconnecting replica {self.ip}:{self.port}: {reason}")
+        if self in self.server_state['replicas']:
+            self.server_state['replicas'].remove(self)
+        self._queue.clear()
+        self._queued_bytes = 0
+        if asyncio.current_task() is not self._task:
+            self._task.cancel()
+        self.writer.close()
+
+    def info(self, master_offset: int) -> str:
+        return (f"ip={self.ip},port={self.port},state=online,offset={self.ack_offset},"
+                f"lag={int(time.time() - self.ack_time)},repl_lag_bytes={max(0, master_offset - self.ack_offset)},"
+                f"omem={self.output_buffer}")
+
+
+class AckWaiters:
+    """
+    Clients blocked in WAIT. Each registers a future for (offset, replicas) that is
+    resolved by the REPLCONF ACK which gets enough replicas to the offset, so WAIT
+    returns as soon as the acknowledgement arrives. GETACK requests from WAITs
+    issued in the same tick are coalesced into one.
+    """
+
+    def __init__(self):
+        self._waiters = []
+        self._getack_scheduled = False
+        self.send_getack = None   # installed by the router: puts GETACK on the replication stream
+
+    @staticmethod
+    def acked(server_state, offset: int) -> int:
+        return sum(1 for link in server_state['replicas'] if link.ack_offset >= offset)
+
+    async def wait(self, server_state, num_replicas: int, offset: int, timeout_ms: int) -> int:
+        """Wait until num_replicas acknowledged offset or timeout_ms passed (0 waits forever)."""
+        count = self.acked(server_state, offset)
+        if count >= num_replicas:
+            return count
+        waiter = (offset, num_replicas, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        self.request_acks(server_state)
+        try:
+            await asyncio.wait((waiter[2],), timeout=timeout_ms / 1000 if timeout_ms else None)
+        finally:
+            self._waiters.remove(waiter)
+        return self.acked(server_state, offset)
+
+    def request_acks(self, server_state) -> None:
+        if not self._getack_scheduled:
+            self._getack_scheduled = True
+            asyncio.get_running_loop().call_soon(self._send_getack, server_state)
+
+    def _send_getack(self, server_state) -> None:
+        self._getack_scheduled = False
+        if self._waiters:
+            self.send_getack(server_state)
+
+    def notify(self, server_state) -> None:
+        """Called for every REPLCONF ACK."""
+        for offset, num_replicas, future in self._waiters:
+            if not future.done() and self.acked(server_state, offset) >= num_replicas:
+                future.set_result(None)
+
+ack_waiters = AckWaiters()
+
+
+class FullResync:
+    def __init__(self, writer: asyncio.StreamWriter, server_state, diskless: bool, port=None):
+        self.writer = writer
+        self.server_state = server_state
+        self.port = port
+        self.offset = server_state['master_repl_offset']
+        self.diskless = diskless and hasattr(os, 'fork')
+        self.pending = bytearray()
+        self._task = None
+
+    def start(self) -> None:
+        """Fork the snapshot child. Must run in the same tick as the FULLRESYNC reply."""
+        if self.diskless:
+            rfd, wfd = os.pipe()
+            pid = fork_child(lambda: self._write_to_pipe(rfd, wfd))
+            os.close(wfd)
+            transfer = self._send_from_pipe(pid, rfd)
+        else:
+            path = f"temp-repl-{os.getpid()}-{id(self)}.rdb"
+            pid = fork_child(lambda: save_rdb(path, rdb.compression, rdb.checksum))
+            transfer = self._send_from_file(pid, path)
+        self.server_state.setdefault('syncing_replicas', []).append(self)
+        self._task = asyncio.get_running_loop().create_task(self._run(transfer))
+
+    def add(self, data: bytes) -> None:
+        """Hold a propagated batch until the snapshot is sent; the hard limit applies here too."""
+        self.pending += data
+        if ReplicaLink.hard_limit and len(self.pending) > ReplicaLink.hard_limit:
+            print("Disconnecting replica during full resync: pending writes are over the hard limit")
+            self.writer.close()
+
+    @staticmethod
+    def _write_to_pipe(rfd: int, wfd: int) -> None:
+        os.close(rfd)
+        with os.fdopen(wfd, "wb", buffering=REPL_SYNC_CHUNK) as f:
+            write_rdb(f, rdb.compression, rdb.checksum)
+
+    async def _send_from_pipe(self, pid, rfd: int) -> None:
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=REPL_SYNC_CHUNK)
+        pipe, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader),
+                                               os.fdopen(rfd, "rb", 0))
+        try:
+            mark = secrets.token_hex(RDB_EOF_MARK_SIZE // 2).encode()
+            self.writer.write(b"$EOF:%s\r\n" % mark)
+            while chunk := await reader.read(REPL_SYNC_CHUNK):
+                self.writer.write(chunk)
+                await self.writer.drain()
+        except BaseException:
+            # The replica went away: the child would stay blocked on the full pipe,
+            # holding its copy of the dataset
+            kill_child(pid)
+            raise
+        finally:
+            pipe.close()
+        if not await wait_child(pid):
+            raise RuntimeError("snapshot child failed")
+        self.writer.write(mark)
+
+    async def _send_from_file(self, pid, path: str) -> None:
+        try:
+            if not await wait_child(pid):
+                raise RuntimeError("snapshot child failed")
+            self.writer.write(b"$%d\r\n" % os.path.getsize(path))
+            with open(path, "rb") as f:
+                while chunk := f.read(REPL_SYNC_CHUNK):
+                    self.writer.write(chunk)
+                    await self.writer.drain()
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def _run(self, transfer) -> None:
+        try:
+            await transfer
+            if self.writer.is_closing():
+                raise ConnectionError("replica went away during the transfer")
+            # From here on the replica receives the live command stream
+            link = ReplicaLink(self.writer, self.server_state, self.offset, self.port)
+            link.send(bytes(self.pending))
+            self.server_state['replicas'].append(link)
+            print(f"Full resync done at offset {self.offset} ({'diskless' if self.diskless else 'disk'})")
+        except Exception as e:
+            print(f"Full resync failed: {e}")
+            self.writer.close()
+        finally:
+            self.pending = bytearray()
+            self.server_state['syncing_replicas'].remove(self)
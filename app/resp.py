@@ -0,0 +1,108 @@
+"""
+RESP reply encoding shared by every command handler.
+Replies are built as bytes; multi-element replies are appended into one bytearray
+so large arrays are encoded in linear time.
+"""
+
+CRLF = b"\r\n"
+
+# Common status replies
+OK = b"+OK\r\n"
+PONG = b"+PONG\r\n"
+QUEUED = b"+QUEUED\r\n"
+NIL = b"$-1\r\n"
+NIL_ARRAY = b"*-1\r\n"
+EMPTY_ARRAY = b"*0\r\n"
+WRONGTYPE = b"-WRONGTYPE Operation against a key holding the wrong kind of value\r\n"
+
+# Encoded forms of small integers and length headers, built once at import
+SHARED_INTEGERS = 10000
+SHARED_HEADERS = 1024
+_INTEGERS = [b":%d\r\n" % i for i in range(SHARED_INTEGERS)]
+_BULK_HEADERS = [b"$%d\r\n" % i for i in range(SHARED_HEADERS)]
+_ARRAY_HEADERS = [b"*%d\r\n" % i for i in range(SHARED_HEADERS)]
+
+
+def integer(n: int) -> bytes:
+    if 0 <= n < SHARED_INTEGERS:
+        return _INTEGERS[n]
+    return b":%d\r\n" % n
+
+
+def bulk_header(n: int) -> bytes:
+    return _BULK_HEADERS[n] if n < SHARED_HEADERS else b"$%d\r\n" % n
+
+
+def array_header(n: int) -> bytes:
+    return _ARRAY_HEADERS[n] if 0 <= n < SHARED_HEADERS else b"*%d\r\n" % n
+
+
+def bulk(value) -> bytes:
+    """Encode a bulk string; None becomes the nil reply."""
+    if value is None:
+        return NIL
+    if isinstance(value, int):
+        value = b"%d" % value
+    elif isinstance(value, str):
+        value = value.encode()
+    return bulk_header(len(value)) + value + CRLF
+
+
+def simple(text: str) -> bytes:
+    return b"+%s\r\n" % text.encode()
+
+
+def error(message: str) -> bytes:
+    """Encode an error reply. The message should start with its error code (ERR, WRONGTYPE, ...)."""
+    return b"-%s\r\n" % message.encode()
+
+
+def bulk_array(items) -> bytes:
+    """Encode a flat array of bulk strings, e.g. the result of LRANGE."""
+    out = ReplyBuilder()
+    out.array(len(items))
+    for item in items:
+        out.bulk(item)
+    return out.getvalue()
+
+
+class ReplyBuilder:
+    """Accumulates a (possibly nested) RESP reply in a single bytearray."""
+
+    __slots__ = ('_buf',)
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def array(self, n: int) -> 'ReplyBuilder':
+        self._buf += array_header(n)
+        return self
+
+    def bulk(self, value) -> 'ReplyBuilder':
+        buf = self._buf
+        if value is None:
+            buf += NIL
+            return self
+        if isinstance(value, int):
+            value = b"%d" % value
+        elif isinstance(value, str):
+            value = value.encode()
+        buf += bulk_header(len(value))
+        buf += value
+        buf += CRLF
+        return self
+
+    def integer(self, n: int) -> 'ReplyBuilder':
+        self._buf += integer(n)
+        return self
+
+    def raw(self, data: bytes) -> 'ReplyBuilder':
+        """Append an already encoded reply (e.g. the result of a queued command)."""
+        self._buf += data
+        return self
+
+    def __len__(self) -> int:
+        return len(self._buf)
+
+    def getvalue(self) -> bytearray:
+        return self._buf
@@ -1,16 +1,22 @@
-empty_rdb = bytes.fromhex(
-    '524544495330303131fa0972656469732d76657205372e322e30fa0a72656469732d62697473c040'
-    'fa056374696d65c26d08bc65fa08757365642d6d656dc2b0c41000fa08616f662d62617365c000fff06e3bfec0ff5aa2'
-)
 from registry import COMMAND_REGISTRY,WRITE_COMMANDS
-from persistence import log_to_aof
+from persistence import aof
 from convert_commands import build_resp_array
+from replication import FullResync, ReplicaLink, backlog, ack_waiters
+from data_type.keyspace import WrongTypeError
+import data_type.evict as evict
+import data_type.blocking as blocking
+import resp
 import inspect
+import time
+import asyncio
+
+GETACK = build_resp_array("REPLCONF", [b"GETACK", b"*"])
+OOM_ERROR = resp.error("OOM command not allowed when used memory > 'maxmemory'.")
 
 def check_permissions(server_role, cmd_key):
     """Returns an error message if the command is blocked, else None."""
     if server_role == 'slave' and cmd_key in WRITE_COMMANDS:
-        return "-ERR write commands not allowed on slave\r\n"
+        return resp.error("ERR write commands not allowed on slave")
     return None
 
 async def handle_replication_handshake(cmd, args, client_state, server_state):
@@ -21,77 +27,172 @@ async def handle_replication_handshake(cmd, args, client_state, server_state):
     step = client_state.get('handshake_step', 0)
     
     match (cmd.lower(), step):
+        case ('replconf', _) if len(args) >= 2 and args[0].lower() == b'ack':
+            # Acknowledgements are never answered; they only advance the replica's offset
+            link = next((r for r in server_state['replicas'] if r.writer is client_state['writer']), None)
+            if link is not None:
+                try:
+                    link.ack_offset = max(link.ack_offset, int(args[1]))
+                except ValueError:
+                    return b"", False
+                link.ack_time = time.time()
+                ack_waiters.notify(server_state)
+            return b"", False
+
         case ('ping', 0):
             client_state['handshake_step'] = 1
-            return "+PONG\r\n", False
+            return resp.PONG, False
             
-        case ('replconf', 1) if args and args[0].lower() == 'listening-port':
+        case ('replconf', 1) if args and args[0].lower() == b'listening-port':
             client_state['handshake_step'] = 2
-            return "+OK\r\n", False
+            client_state['listening_port'] = args[1].decode() if len(args) > 1 else None
+            return resp.OK, False
             
-        case ('replconf', 2) if args and args[0].lower() == 'capa':
+        case ('replconf', 2) if args and args[0].lower() == b'capa':
             client_state['handshake_step'] = 3
-            return "+OK\r\n", False
+            client_state['capa_eof'] = b'eof' in [capa.lower() for capa in args[1::2]]
+            return resp.OK, False
             
         case ('psync', 3) if len(args) == 2:
-            # Prepare the FULLRESYNC sequence
-            replid = server_state.get('master_replid', '8371...')
-            offset = server_state.get('master_repl_offset', 0)
-            # You can return the bytes directly to the networking layer
+            # The backlog and the snapshot must both end exactly at master_repl_offset,
+            # so everything executed so far is flushed to the other replicas first
+            propagation.flush()
+            replid = server_state['master_replid']
+            offset = server_state['master_repl_offset']
+            # PSYNC carries the offset of the first byte the replica is missing, plus one
+            try:
+                psync_offset = int(args[1]) - 1
+            except ValueError:
+                psync_offset = -1
+            missing = backlog.read_from(psync_offset) if args[0].decode() == replid else None
+            if missing is not None:
+                # The reply goes through the replica's queue so the backlog and live writes follow it in order
+                link = ReplicaLink(client_state['writer'], server_state, psync_offset, client_state.get('listening_port'))
+                link.send(b"+CONTINUE %s\r\n" % replid.encode() + missing)
+                server_state['replicas'].append(link)
+                print(f"Partial resync from offset {psync_offset}: sending {len(missing)} bytes of backlog")
+                return b"", False
+
+            backlog.activate(offset)
             resync_header = f"+FULLRESYNC {replid} {offset}\r\n".encode()
-            # ... add RDB data ...
-            return (resync_header + empty_rdb), False
+            # The RDB payload follows the header, streamed by the resync task
+            FullResync(client_state['writer'], server_state, client_state.get('capa_eof', False),
+                       client_state.get('listening_port')).start()
+            return resync_header, False
             
     return None, True # Not a handshake command, proceed to normal execution
 
 
-async def handle_persistence_and_replication(cmd, args, client_state):
+class PropagationBatch:
+    """
+    Write commands collected during one event-loop tick.
+    The batch is flushed by a scheduled callback with one AOF write and one
+    append to each replica's output queue, so the client reply never waits on a replica.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._server_state = None
+        self._scheduled = False
+
+    def add(self, cmd_resp: bytes, server_state) -> None:
+        self._buf += cmd_resp
+        self._server_state = server_state
+        if not self._scheduled:
+            self._scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def send_to_replicas(self, data: bytes, server_state) -> None:
+        """Put data on the replication stream without logging it to the AOF (e.g. REPLCONF GETACK)."""
+        self._server_state = server_state
+        self.flush()
+        server_state['master_repl_offset'] += len(data)
+        backlog.feed(data)
+        for link in list(server_state['replicas']):
+            link.send(data)
+        for sync in server_state.get('syncing_replicas', ()):
+            sync.add(data)
+
+    def flush(self) -> None:
+        self._scheduled = False
+        if not self._buf:
+            return
+        batch = bytes(self._buf)
+        self._buf.clear()
+
+        # Only the master logs to AOF to avoid duplicate write logs in the cluster
+        aof.write(batch)
+        backlog.feed(batch)
+
+        # Each replica has its own output queue; nothing here waits on a replica's network
+        for link in list(self._server_state['replicas']):
+            link.send(batch)
+        # Replicas still receiving their snapshot get the batch once it is sent
+        for sync in self._server_state.get('syncing_replicas', ()):
+            sync.add(batch)
+
+propagation = PropagationBatch()
+ack_waiters.send_getack = lambda server_state: propagation.send_to_replicas(GETACK, server_state)
+# Writes queued for this tick must land in the AOF before a rewrite snapshot is forked
+aof.pre_fork_hook = propagation.flush
+
+
+def handle_persistence_and_replication(cmd, args, client_state):
     """
     Post-execution middleware to handle AOF logging and Master-Slave propagation.
     """
-    server_state = client_state['server_state']
-    
-    # 1. Convert the command back to RESP format
+    propagate(cmd, args, client_state['server_state'])
+
+def propagate(cmd, args, server_state):
+    """Log a write to the AOF and stream it to replicas (master only)."""
+    if server_state['role'] != 'master':
+        return
+
+    # Convert the command back to RESP format
     # This is what will be stored in the AOF and sent to replicas
     cmd_resp = build_resp_array(cmd, args)
-    
-    # 2. AOF Persistence
-    # Only the master logs to AOF to avoid duplicate write logs in the cluster
-    if server_state['role'] == 'master':
-        log_to_aof(cmd_resp)
-    
-    # 3. Replication Propagation
-    if server_state['role'] == 'master':
-        cmd_bytes = cmd_resp.encode()
-        
-        # Update the master offset globally so WAIT command can track it
-        server_state['master_repl_offset'] += len(cmd_bytes)
-        
-        # Send the command to every connected replica
-        for writer, _ in server_state['replicas']:
-            try:
-                writer.write(cmd_bytes)
-                await writer.drain() # Ensure the replica actually receives the write
-            except Exception as e:
-                print(f"Failed to propagate to replica: {e}")
+
+    # Update the master offset right away so WAIT can target it
+    server_state['master_repl_offset'] += len(cmd_resp)
+    propagation.add(cmd_resp, server_state)
 
 # router.py snippet
 
 async def execute_command(cmd_key, args, client_state):
     fn = COMMAND_REGISTRY.get(cmd_key)
     if not fn:
-        return "-ERR unknown command\r\n"
+        return resp.error("ERR unknown command")
+
+    # Only a master evicts; replicas apply the DELs it propagates
+    if evict.maxmemory and not client_state['is_replica'] and client_state['server_state']['role'] == 'master':
+        if not evict.perform_evictions() and fn.deny_oom:
+            return OOM_ERROR
 
     # TRANSACTION GUARD: If multi_event is NOT set, we are in a transaction
     if not client_state['multi_event'].is_set() and cmd_key not in ('exec', 'discard', 'multi'):
         client_state['exec_event'].append((cmd_key, args))
-        return "+QUEUED\r\n"
+        return resp.QUEUED
 
     # Standard Execution (Layer 3)
-    result = await fn(args, client_state) if inspect.iscoroutinefunction(fn) else fn(args, client_state)
+    try:
+        result = await fn(args, client_state) if inspect.iscoroutinefunction(fn) else fn(args, client_state)
+    except WrongTypeError:
+        result = resp.WRONGTYPE
 
     # Post-Execution (AOF & Replication)
-    if getattr(fn, 'is_write', False) and not client_state['is_replica']:
-        await handle_persistence_and_replication(cmd_key, args, client_state)
+    # A handler may ask for a different, deterministic form to be propagated,
+    # e.g. EXPIRE key 10 is logged as PEXPIREAT key <unix ms>, or for nothing
+    # to be propagated with an empty tuple
+    rewritten = client_state.pop('propagate_as', None)
+    # Writes that failed changed nothing and are not propagated
+    if getattr(fn, 'is_write', False) and not client_state['is_replica'] and not result.startswith(b"-") \
+            and rewritten != ():
+        if rewritten:
+            cmd_key, args = rewritten
+        handle_persistence_and_replication(cmd_key, args, client_state)
+
+    # Clients blocked on keys this command filled are served before anything else runs
+    if not client_state.get('in_exec'):
+        blocking.serve_ready_keys()
 
     return result
\ No newline at end of file